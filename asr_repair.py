@@ -0,0 +1,187 @@
+"""
+Selective re-decoding of suspicious chunks.
+
+The batched runners store per-chunk metadata in the sidecars: index, seconds,
+text, flags ('repetition', 'length_cap' from the repetition guard, 'error' for a
+failed batch such as a CUDA OOM). repair_flagged_chunks reads the latest record
+of every utterance, finds the chunks that look wrong (flagged or empty), rebuilds
+exactly those segments by re-running the deterministic chunker with the original
+chunk parameters, and re-decodes them with whatever decoder the caller passes in
+(smaller sub-chunks, beam search, another profile). The new chunk texts are spliced
+into the utterance transcript and appended to the same sidecar, together with a
+'repair' field listing every re-decoded chunk, so the merge picks up the fixed text.
+When no chunk improved, an attempt record ('repair_attempt', skipped by the merge and by
+latest_records) is appended instead, so a rerun with the same repair params skips every
+chunk already tried against the latest record and loads no model when nothing is left.
+"""
+
+import os
+
+from tqdm import tqdm
+
+from asr_results import is_repair_attempt, latest_records
+from audio_utils import iter_audio_chunks, segment_durations
+from inference_utils import chunk_result
+
+REPAIR_FLAGS = ('repetition', 'length_cap', 'error', 'empty')
+
+
+def chunk_issues(chunk):
+    """Flags of a chunk, plus 'empty' for a chunk that decoded to no text."""
+    issues = set(chunk.get('flags') or [])
+    if not chunk.get('text') and 'error' not in issues:
+        issues.add('empty')
+    return issues
+
+
+def repair_attempts(records):
+    """utterance_id -> attempt records (repairs that changed nothing), in file order."""
+    attempts = {}
+    for r in records:
+        if is_repair_attempt(r):
+            attempts.setdefault(r['utterance_id'], []).append(r)
+    return attempts
+
+
+def tried_repairs(record, repair_params=None, attempts=()):
+    """
+    'replaced' entries of every chunk already re-decoded with the same repair_params: by the
+    record's own repair, or by an attempt record written against this record.
+    """
+    params = repair_params or {}
+    tried = []
+    repair = record.get('repair')
+    if repair and repair.get('params') == params:
+        tried += repair.get('replaced') or []
+    for attempt in attempts:
+        attempt = attempt['repair_attempt']
+        if attempt.get('of') == record.get('finished_at') and attempt.get('params') == params:
+            tried += attempt.get('replaced') or []
+    return tried
+
+
+def find_repairs(results_log, flags=REPAIR_FLAGS, repair_params=None):
+    """
+    utterance_id -> (latest record, [indices of chunks with any of `flags`]) for records with chunk
+    metadata. Chunks already tried against the latest record with the same repair_params (by its
+    own repair or by an attempt record) are left out, so a rerun does not re-decode what the same
+    settings could not fix, and a caller can skip loading a model when nothing is returned.
+    """
+    records = results_log.records()
+    attempts = repair_attempts(records)
+    repairs = {}
+    for utt_id, record in latest_records(records).items():
+        tried = {r['index'] for r in tried_repairs(record, repair_params, attempts.get(utt_id, ()))}
+        indices = [c['index'] for c in record.get('chunks') or []
+                   if chunk_issues(c) & set(flags) and c['index'] not in tried]
+        if indices:
+            repairs[utt_id] = (record, indices)
+    return repairs
+
+
+def split_segment(segment, max_seconds=None):
+    """Split one (array, sample_rate) segment into pieces of at most max_seconds (no split when None)."""
+    seg, sr = segment
+    if not max_seconds:
+        return [segment]
+    step = max(1, int(max_seconds * sr))
+    return [(seg[start : start + step], sr) for start in range(0, len(seg), step)]
+
+
+def is_better(old_chunk, new_chunk):
+    """Replace when the new chunk is clean, or at least no longer an error."""
+    new_issues = chunk_issues(new_chunk)
+    return not new_issues or ('error' in chunk_issues(old_chunk) and 'error' not in new_issues)
+
+
+def repair_flagged_chunks(results_log, audio_paths, decode_segments, chunk_seconds=30, use_vad=False, cache_dir=None,
+                          split_seconds=None, batch_size=8, flags=REPAIR_FLAGS, repair_params=None):
+    """
+    Re-decode the suspicious chunks of every utterance in results_log and append repaired records.
+
+    audio_paths maps utterance_id -> audio file. chunk_seconds / use_vad / cache_dir must match
+    the original run so chunk indices line up (a chunk_seconds in the record's telemetry wins). decode_segments(list of (array, sr)) returns one
+    text or {'text', 'flags', 'generated_tokens'} dict per segment; with split_seconds each
+    suspicious chunk is decoded as shorter pieces whose texts are joined. repair_params (the
+    alternative settings used) is stored with each replacement.
+    Returns a summary dict with the number of utterances and chunks repaired or left unresolved.
+    """
+    summary = {'utterances': 0, 'chunks_replaced': 0, 'chunks_unresolved': 0, 'skipped': 0}
+    attempts = repair_attempts(results_log.records())
+    repairs = find_repairs(results_log, flags, repair_params)
+    for utt_id, (record, indices) in tqdm(repairs.items(), desc='Repairing flagged chunks'):
+        audio_path = audio_paths.get(utt_id)
+        if audio_path is None or not os.path.exists(audio_path):
+            summary['skipped'] += 1
+            continue
+        chunks = [dict(c) for c in record['chunks']]
+        # a run under memory pressure may have cut later files shorter; the record says how long
+        record_chunk_seconds = (record.get('telemetry') or {}).get('chunk_seconds') or chunk_seconds
+        segments = list(iter_audio_chunks(audio_path, record_chunk_seconds, use_vad=use_vad, cache_dir=cache_dir))
+        if len(segments) != len(chunks):
+            print(f'WARNING: {utt_id}: {len(segments)} chunks now vs {len(chunks)} recorded; chunk params differ, skipping')
+            summary['skipped'] += 1
+            continue
+
+        pieces = [(i, piece) for i in indices for piece in split_segment(segments[i], split_seconds)]
+        outputs = []
+        try:
+            for start in range(0, len(pieces), batch_size):
+                outputs.extend(decode_segments([piece for _, piece in pieces[start : start + batch_size]]))
+        except Exception as e:
+            print(f'WARNING: {utt_id}: repair decode failed: {e}')
+            summary['skipped'] += 1
+            continue
+
+        # regroup the decoded pieces per chunk index, in order
+        decoded = {}
+        for (i, piece), output, seconds in zip(pieces, outputs, segment_durations([p for _, p in pieces])):
+            decoded.setdefault(i, []).append(chunk_result(i, output, seconds))
+        replaced = []
+        accepted = 0
+        for i in indices:
+            parts = decoded.get(i, [])
+            new_chunk = {
+                'index': i,
+                'seconds': chunks[i]['seconds'],
+                'text': " ".join(p['text'] for p in parts if p['text']),
+                'flags': sorted({f for p in parts for f in p['flags']}),
+            }
+            old_chunk = chunks[i]
+            if is_better(old_chunk, new_chunk):
+                chunks[i] = new_chunk
+                accepted += 1
+            else:
+                summary['chunks_unresolved'] += 1
+            replaced.append({
+                'index': i,
+                'old_text': old_chunk.get('text', ''),
+                'old_flags': sorted(chunk_issues(old_chunk)),
+                'new_text': new_chunk['text'],
+                'new_flags': new_chunk['flags'],
+                'accepted': chunks[i] is new_chunk,
+            })
+
+        summary['chunks_replaced'] += accepted
+        if not accepted:
+            # nothing changed: the latest record stays, and an attempt record (ignored by the merge)
+            # marks these chunks as tried so a rerun with the same params does not decode them again
+            results_log.append(
+                utt_id, record['text'],
+                repair_attempt={'of': record.get('finished_at'), 'params': repair_params or {}, 'replaced': replaced},
+            )
+            continue
+        # chunks tried earlier with the same params stay listed, so a rerun skips them too
+        replaced = tried_repairs(record, repair_params, attempts.get(utt_id, ())) + replaced
+        errors = [c['error'] for c in chunks if c.get('error')]
+        text = errors[0] if errors else " ".join(c['text'] for c in chunks if c['text'])
+        results_log.append(
+            utt_id, text,
+            telemetry=record.get('telemetry'),
+            chunks=chunks,
+            repair={'replaced': replaced, 'params': repair_params or {}, 'split_seconds': split_seconds},
+        )
+        summary['utterances'] += 1
+    print(f"Repaired {summary['chunks_replaced']} chunks in {summary['utterances']} utterances "
+          f"({summary['chunks_unresolved']} still flagged, {summary['skipped']} utterances skipped)")
+    return summary
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Append-only, resumable storage for ASR transcripts.
+
+Every runner appends one JSON line per finished utterance to a sidecar file
+(results/sidecars/<model>.jsonl), keyed by (model_id, utterance_id, decode params).
+On restart the runner skips utterances that already have a successful record for
+the same model and decode params, so a crash only loses the utterance in flight.
+The merge step pivots any number of sidecars into the final wide CSV, and
+throughput_table aggregates the per-utterance telemetry records into a cost
+table (real-time factor, tokens/s, compute seconds per hour of audio, peak memory).
+
+Sharded runs (--shard-index/--shard-count, one process or array task per shard) write
+partial sidecars; the merge command folds them with --fold_parts and reports missing and
+duplicated utterances per column (--strict fails the merge on either).
+
+Usage:
+python asr_results.py --manifest data/final_120_sampled_medical_datasets.csv \
+    --sidecars results/sidecars/phi4.jsonl results/sidecars/whisper.jsonl \
+    --output results/whisper_phi4_asr_results_all.csv --fold_parts --strict
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timezone
+
+import pandas as pd
+
+SIDECAR_DIR = 'results/sidecars'
+FOLDING_SUFFIX = '.folding'
+
+
+def is_failed_transcript(text):
+    """True for the ERROR / FILE_NOT_FOUND placeholders the runners write on failure."""
+    return not isinstance(text, str) or text.startswith('ERROR') or text.startswith('FILE_NOT_FOUND')
+
+
+def chunk_flags(record):
+    """'index:flag; ...' for the flagged chunks of a sidecar record ('' when none)."""
+    return '; '.join(
+        f"{c.get('index')}:{flag}" for c in record.get('chunks') or [] for flag in c.get('flags') or []
+    )
+
+
+def params_key(decode_params):
+    """Stable short hash of a decode-params dict (key order does not matter)."""
+    blob = json.dumps(decode_params, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()[:12]
+
+
+def read_sidecar(path):
+    """Read all records of a JSONL sidecar, ignoring a truncated trailing line from a crash."""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def is_repair_attempt(record):
+    """True for the bookkeeping record asr_repair writes when a repair changed nothing (it carries no new text)."""
+    return bool(record.get('repair_attempt'))
+
+
+def latest_records(records):
+    """
+    utterance_id -> record; a later successful record wins, a later failure never replaces a
+    success, and repair attempt records are skipped.
+    """
+    out = {}
+    for r in records:
+        if is_repair_attempt(r):
+            continue
+        utt_id = r['utterance_id']
+        if utt_id in out and not is_failed_transcript(out[utt_id]['text']) and is_failed_transcript(r['text']):
+            continue
+        out[utt_id] = r
+    return out
+
+
+def latest_transcripts(records):
+    """utterance_id -> text of the latest record (see latest_records)."""
+    return {utt_id: r['text'] for utt_id, r in latest_records(records).items()}
+
+
+def sidecar_part_path(path, part):
+    """Partial sidecar one shard worker writes next to the main sidecar: <name>.part-<part>.jsonl."""
+    root, ext = os.path.splitext(path)
+    return f'{root}.part-{part}{ext}'
+
+
+def sidecar_part_paths(path, count=None):
+    """Existing partial sidecars of `path`, sorted by name; with count, only those of a count-shard run (<i>of<count>)."""
+    root, ext = os.path.splitext(path)
+    suffix = f'of{count}' if count is not None else ''
+    return sorted(glob.glob(f'{glob.escape(root)}.part-*{suffix}{ext}'))
+
+
+def fold_sidecar_parts(path, manifest_ids=None, count=None):
+    """
+    Append the records of every partial sidecar of `path` (with count, only the parts of a
+    count-shard run) to the main sidecar and delete the parts. Records are ordered by the row
+    of their utterance in manifest_ids (unknown ids last), then by part name and file order, so
+    the folded file does not depend on which worker finished first. Each part is first renamed
+    to <part>.folding, so a worker still appending to it starts a new part instead of writing
+    into a file that is about to be deleted; .folding files left by an interrupted fold are
+    picked up again. Returns the number of records folded.
+    """
+    for part in sidecar_part_paths(path, count):
+        os.replace(part, part + FOLDING_SUFFIX)
+    root, ext = os.path.splitext(path)
+    suffix = f'of{count}' if count is not None else ''
+    folding = sorted(glob.glob(f'{glob.escape(root)}.part-*{suffix}{ext}{FOLDING_SUFFIX}'))
+    if not folding:
+        return 0
+    row = {utt_id: i for i, utt_id in enumerate(manifest_ids or [])}
+    records = [r for part in folding for r in read_sidecar(part)]
+    records.sort(key=lambda r: row.get(r.get('utterance_id'), len(row)))  # stable: keeps part / file order
+    if records:
+        with open(path, 'a', encoding='utf-8') as f:
+            for r in records:
+                f.write(json.dumps(r, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+    for part in folding:
+        os.remove(part)
+    return len(records)
+
+
+class ResultsLog:
+    """
+    Append-only JSONL sidecar for one model column and one set of decode params.
+    Records look like {"model_id", "column", "params_key", "decode_params",
+    "utterance_id", "text", "finished_at", ...extra fields}.
+    With `part` (one shard worker of a parallel run), new records go to the partial sidecar
+    <name>.part-<part>.jsonl so workers never write to the same file; reads always cover
+    the main sidecar and all of its parts.
+    """
+
+    def __init__(self, path, model_id, column, decode_params=None, part=None):
+        self.path = path
+        self.write_path = sidecar_part_path(path, part) if part is not None else path
+        self.model_id = model_id
+        self.column = column
+        self.decode_params = dict(decode_params or {})
+        self.params_key = params_key(self.decode_params)
+
+    def records(self):
+        """Records of this log's model/column/params, in file order (main sidecar, then parts)."""
+        return [
+            r for source in [self.path] + sidecar_part_paths(self.path) for r in read_sidecar(source)
+            if r.get('model_id') == self.model_id
+            and r.get('column') == self.column
+            and r.get('params_key') == self.params_key
+        ]
+
+    def transcripts(self):
+        """utterance_id -> latest transcript for this model/params."""
+        return latest_transcripts(self.records())
+
+    def finished_ids(self):
+        """Utterance ids that already have a successful transcript and can be skipped."""
+        return {utt_id for utt_id, text in self.transcripts().items() if not is_failed_transcript(text)}
+
+    def append(self, utterance_id, text, **extra):
+        """Append one finished utterance and fsync it so it survives a crash."""
+        record = {
+            'model_id': self.model_id,
+            'column': self.column,
+            'params_key': self.params_key,
+            'decode_params': self.decode_params,
+            'utterance_id': utterance_id,
+            'text': text,
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            **extra,
+        }
+        os.makedirs(os.path.dirname(self.write_path) or '.', exist_ok=True)
+        with open(self.write_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def records_by_column(sidecars):
+    """
+    column -> records from JSONL paths (all records, including not yet folded partial
+    sidecars) or ResultsLog instances (only that model/params). Repair attempt records are left out.
+    A column written by more than one model_id raises ValueError: the latest record per utterance
+    would otherwise mix transcripts (and timings) of different models in one column.
+    """
+    by_column = {}
+    for source in sidecars:
+        if isinstance(source, ResultsLog):
+            records = source.records()
+        else:
+            records = [r for path in [source] + sidecar_part_paths(source) for r in read_sidecar(path)]
+        for r in records:
+            if not is_repair_attempt(r):
+                by_column.setdefault(r['column'], []).append(r)
+    for column, records in by_column.items():
+        model_ids = sorted({str(r.get('model_id')) for r in records})
+        if len(model_ids) > 1:
+            raise ValueError(f"column {column} holds records of several models ({', '.join(model_ids)}); "
+                             f"merge their sidecars separately or give each model its own column")
+    return by_column
+
+
+def merge_results(manifest_df, sidecars, output_path=None, utterance_id_column='utterance_id'):
+    """
+    Build the wide results table: one column per model column found in the sidecars,
+    aligned to manifest_df rows by utterance id. sidecars holds JSONL paths (all records)
+    or ResultsLog instances (only that model/params). For each (column, utterance) the
+    latest successful record wins; utterances with no record are left empty. When any
+    chunk of a column was flagged (repetition loop, length cap), a '<column>_flags'
+    column lists the flagged chunks per utterance.
+    """
+    df = manifest_df.copy()
+    for column, records in records_by_column(sidecars).items():
+        texts = latest_transcripts(records)
+        df[column] = df[utterance_id_column].map(texts).fillna('')
+        flags = {r['utterance_id']: chunk_flags(r) for r in records if r['text'] == texts.get(r['utterance_id'])}
+        if any(flags.values()):
+            df[f'{column}_flags'] = df[utterance_id_column].map(flags).fillna('')
+            print(f'{column}: {sum(1 for f in flags.values() if f)} utterances have flagged chunks')
+        missing = int((df[column] == '').sum())
+        if missing:
+            print(f'WARNING: {column} has no transcript for {missing} of {len(df)} utterances')
+    if output_path:
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        df.to_csv(output_path, index=False)
+        print(f'Saved merged results to: {output_path}')
+    return df
+
+
+def throughput_table(sidecars):
+    """
+    Per-column throughput from the telemetry of the latest successful record of each utterance:
+    audio hours, compute hours (read + features + generation), real-time factor, tokens/s,
+    compute seconds per hour of audio and peak RSS / accelerator memory.
+    """
+    rows = []
+    for column, records in records_by_column(sidecars).items():
+        latest = {}
+        for r in records:
+            if isinstance(r.get('telemetry'), dict) and not is_failed_transcript(r['text']):
+                latest[r['utterance_id']] = r
+        if not latest:
+            continue
+        tele = [r['telemetry'] for r in latest.values()]
+        audio = sum(t.get('audio_seconds') or 0.0 for t in tele)
+        compute = sum(t.get('wall_seconds') or 0.0 for t in tele)
+        generate = sum(t.get('generate_seconds') or 0.0 for t in tele)
+        tokens = sum(t.get('generated_tokens') or 0 for t in tele)
+        accelerator = [t['peak_accelerator_mb'] for t in tele if t.get('peak_accelerator_mb') is not None]
+        rows.append({
+            'column': column,
+            'model_id': list(latest.values())[-1].get('model_id'),
+            'utterances': len(tele),
+            'audio_hours': audio / 3600.0,
+            'compute_hours': compute / 3600.0,
+            'rtf': compute / audio if audio else None,
+            'tokens_per_second': tokens / generate if generate else None,
+            'compute_s_per_audio_hour': 3600.0 * compute / audio if audio else None,
+            'peak_rss_mb': max(t.get('peak_rss_mb') or 0.0 for t in tele),
+            'peak_accelerator_mb': max(accelerator) if accelerator else None,
+        })
+    return pd.DataFrame(rows)
+
+
+def validate_results(manifest_df, sidecars, utterance_id_column='utterance_id'):
+    """
+    Completeness report, one row per column: manifest utterances without a successful
+    transcript (missing), utterances with more than one successful record for the same model
+    and params outside a repair (duplicates, e.g. from overlapping shards), sidecar
+    utterances that are not in the manifest (unknown) and repeated manifest ids.
+    """
+    ids = manifest_df[utterance_id_column].tolist()
+    expected = set(ids)
+    repeated_ids = sorted(u for u, n in Counter(ids).items() if n > 1)
+    rows = []
+    for column, records in records_by_column(sidecars).items():
+        finished = {u for u, text in latest_transcripts(records).items() if not is_failed_transcript(text)}
+        counts = Counter(
+            (r['utterance_id'], r.get('model_id'), r.get('params_key')) for r in records
+            if not r.get('repair') and not is_failed_transcript(r['text'])
+        )
+        rows.append({
+            'column': column,
+            'expected': len(expected),
+            'transcribed': len(finished & expected),
+            'missing': list(dict.fromkeys(u for u in ids if u not in finished)),
+            'duplicates': sorted({u for (u, _, _), n in counts.items() if n > 1}),
+            'unknown': sorted(finished - expected),
+            'repeated_manifest_ids': repeated_ids,
+        })
+    return pd.DataFrame(rows)
+
+
+def print_validation(report, max_ids=10):
+    """Print the validate_results report; returns True when every column is complete and duplicate-free."""
+    ok = True
+    for row in report.to_dict('records'):
+        print(f"{row['column']}: {row['transcribed']}/{row['expected']} utterances transcribed")
+        for key in ('missing', 'duplicates', 'unknown', 'repeated_manifest_ids'):
+            if row[key]:
+                if key != 'unknown':
+                    ok = False
+                shown = ', '.join(map(str, row[key][:max_ids])) + (' ...' if len(row[key]) > max_ids else '')
+                print(f"  {len(row[key])} {key.replace('_', ' ')}: {shown}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-utterance ASR sidecars into a wide results CSV.")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV defining row order.")
+    parser.add_argument("--sidecars", type=str, nargs="+", required=True, help="JSONL sidecar files to merge.")
+    parser.add_argument("--output", type=str, required=True, help="Output CSV path.")
+    parser.add_argument("--utterance_id_column", type=str, default="utterance_id", help="Column name for utterance IDs.")
+    parser.add_argument("--fold_parts", action="store_true",
+                        help="First fold partial sidecars of sharded runs (<name>.part-*.jsonl) into each sidecar, in manifest order.")
+    parser.add_argument("--strict", action="store_true", help="Exit with status 1 when utterances are missing or duplicated.")
+    args = parser.parse_args()
+
+    manifest_df = pd.read_csv(args.manifest)
+    if args.fold_parts:
+        for path in args.sidecars:
+            folded = fold_sidecar_parts(path, manifest_df[args.utterance_id_column].tolist())
+            if folded:
+                print(f'{path}: folded {folded} records from partial sidecars')
+    complete = print_validation(validate_results(manifest_df, args.sidecars, args.utterance_id_column))
+    merge_results(manifest_df, args.sidecars, args.output, args.utterance_id_column)
+    table = throughput_table(args.sidecars)
+    if len(table):
+        print(table.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    if args.strict and not complete:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
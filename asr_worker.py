@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+Resident ASR worker: load a model once and serve transcription jobs over local HTTP.
+
+Every runner otherwise reloads multi-GB weights per job. The worker keeps one backend
+(phi4, whisper, parakeet, granite or audioflamingo3) loaded and accepts jobs on
+127.0.0.1:
+  GET  /info        backend, model id and the decode params to store with sidecar records
+  POST /transcribe  {"audio_path": ...} or {"audio": base64 float32, "sample_rate": sr}
+                    -> {"text", "chunks", "telemetry"}, the same fields the batched runners
+                    pass to on_result
+  POST /decode      {"segments": [{"audio", "sample_rate"}, ...]} -> {"outputs": [...]},
+                    one decoder output per segment (used by asr_repair through the client)
+
+Request threads read and chunk the audio; a single model thread (DynamicBatcher) drains
+the chunks of all pending requests into batches of up to batch_size, waiting at most
+max_wait_ms for a batch to fill, so concurrent jobs share generate calls.
+
+The runners' --worker URL option submits jobs through WorkerClient instead of loading the
+model. A tiny model on CPU is enough to try it out:
+python asr_worker.py --backend whisper --model_id openai/whisper-tiny --profile cpu --port 8765
+python model_inference.py --model whisper --limit 4 --worker http://127.0.0.1:8765
+"""
+
+import argparse
+import base64
+import json
+import os
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import soxr
+from tqdm import tqdm
+
+from audio_utils import AUDIO_CACHE_DIR, TARGET_SAMPLE_RATE, audio_duration, iter_audio_chunks, segment_durations
+from asr_repair import split_segment
+from inference_utils import MemoryBackoff, ThroughputStats, chunk_result, peak_rss_mb
+
+WORKER_BACKENDS = ('phi4', 'whisper', 'parakeet', 'granite', 'audioflamingo3')
+DEFAULT_PORT = 8765
+
+
+# ---------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------
+def load_decoder(backend, profile_name='default', model_id=None, batch_size=8, max_new_tokens=None,
+                 chunk_seconds=30, use_vad=False):
+    """
+    Load one backend and return (decode_segments, count_tokens, model_id, decode_params, chunk_seconds).
+    decode_params are built exactly as the backend's own runner builds them, so worker
+    results resume and merge with sidecar records of local runs (the key holding the chunk
+    length differs between runners); chunk_seconds is the chunk length the worker must cut
+    files into (None for whole Whisper files).
+    """
+    if backend == 'phi4':
+        from model_inference import BACKENDS, PHI4_MODEL_ID, generate_segments_batched, load_phi4, phi4_profile
+        max_new_tokens = max_new_tokens or BACKENDS['phi4']['max_new_tokens']
+        phi4 = load_phi4(model_id or PHI4_MODEL_ID, profile_name)
+        tokenizer = phi4['processor'].tokenizer
+        decode = lambda segments: generate_segments_batched(phi4, segments, max_new_tokens=max_new_tokens)
+        decode_params = {'chunk_seconds': chunk_seconds, 'max_new_tokens': max_new_tokens, 'use_vad': use_vad,
+                         'profile': phi4_profile(profile_name)}
+        model_id = model_id or PHI4_MODEL_ID
+    elif backend == 'whisper':
+        from model_inference import (BACKENDS, WHISPER_MODEL_ID, load_whisper, transcribe_whisper_batch,
+                                     whisper_chunk_seconds, whisper_profile)
+        chunk_seconds = whisper_chunk_seconds(chunk_seconds, use_vad)
+        max_new_tokens = max_new_tokens or BACKENDS['whisper']['max_new_tokens']
+        whisper = load_whisper(model_id or WHISPER_MODEL_ID, profile_name, max_new_tokens=max_new_tokens)
+        tokenizer = whisper['processor'].tokenizer
+        decode = lambda segments: transcribe_whisper_batch(whisper, segments, batch_size=batch_size)
+        decode_params = {'chunk_seconds': chunk_seconds, 'max_new_tokens': max_new_tokens, 'language': 'english',
+                         'use_vad': use_vad, 'profile': whisper_profile(profile_name)}
+        model_id = model_id or WHISPER_MODEL_ID
+    elif backend == 'parakeet':
+        from parakeet_granite_inference import PARAKEET_MODEL_ID, load_parakeet, transcribe_parakeet_batch
+        from generation_utils import resolve_profile
+        nvidia_model = load_parakeet(model_id or PARAKEET_MODEL_ID, profile_name)
+        decode = lambda segments: transcribe_parakeet_batch(nvidia_model, segments, batch_size=batch_size)
+        decode_params = {"chunk_size_seconds": chunk_seconds, "use_vad": use_vad,
+                         "profile": resolve_profile(profile_name)}
+        model_id = model_id or PARAKEET_MODEL_ID
+        count_tokens = lambda text: len(nvidia_model.tokenizer.text_to_ids(text))
+        return decode, count_tokens, model_id, decode_params, chunk_seconds
+    elif backend == 'granite':
+        from parakeet_granite_inference import GRANITE_MODEL_ID, load_granite, transcribe_granite_batch
+        from generation_utils import resolve_profile
+        max_new_tokens = max_new_tokens or 500
+        granite = load_granite(model_id or GRANITE_MODEL_ID, profile_name)
+        tokenizer = granite['tokenizer']
+        decode = lambda segments: transcribe_granite_batch(granite, segments, max_new_tokens=max_new_tokens)
+        decode_params = {"chunk_size_seconds": chunk_seconds, "max_new_tokens": max_new_tokens,
+                         "use_vad": use_vad, "profile": resolve_profile(profile_name)}
+        model_id = model_id or GRANITE_MODEL_ID
+    elif backend == 'audioflamingo3':
+        from audioflamingo3_inference import AF3_DECODE_PARAMS, generate_chunks, prepare_chunks, setup_audioflamingo3
+        max_new_tokens = max_new_tokens or AF3_DECODE_PARAMS['max_new_tokens']
+        model, model_path = setup_audioflamingo3()
+        tokenizer = getattr(model, 'tokenizer', None)
+        decode = lambda segments: generate_chunks(model, prepare_chunks(segments), max_new_tokens=max_new_tokens)
+        decode_params = dict(AF3_DECODE_PARAMS, chunk_seconds=chunk_seconds, max_new_tokens=max_new_tokens,
+                             use_vad=use_vad)
+        model_id = model_id or model_path
+    else:
+        raise ValueError(f"Unknown worker backend '{backend}'. Choose from: {list(WORKER_BACKENDS)}")
+    count_tokens = (lambda text: len(tokenizer.encode(text, add_special_tokens=False))) if tokenizer is not None else None
+    return decode, count_tokens, model_id, decode_params, chunk_seconds
+
+
+# ---------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------
+class DynamicBatcher:
+    """
+    Single model thread that batches segments across concurrent requests.
+
+    submit(segments) queues (array, sr) segments and returns one Future per segment; each
+    resolves to (decoder output, generate seconds) where the seconds are the segment's
+    duration share of its batch. A batch is decoded once batch_size segments are queued or
+    max_wait_ms after its first segment arrived. With a MemoryBackoff, memory errors and RSS
+    pressure lower the batch size of later decodes, and only a segment that still does not
+    fit on its own is halved.
+    """
+
+    def __init__(self, decode_segments, batch_size=8, max_wait_ms=20, backoff=None):
+        self.decode_segments = decode_segments
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.backoff = backoff
+        if backoff is not None:
+            backoff.start(batch_size)
+        self.batches = 0
+        self.segments = 0
+        self._queue = queue.Queue()
+        threading.Thread(target=self._loop, name='asr-worker-model', daemon=True).start()
+
+    def submit(self, segments):
+        futures = []
+        for segment in segments:
+            future = Future()
+            self._queue.put((segment, future))
+            futures.append(future)
+        return futures
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _decode(self, segments):
+        if self.backoff is None:
+            return self.decode_segments(segments)
+        return self.backoff.decode_batch(self.decode_segments, segments)
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            segments = [segment for segment, _ in batch]
+            start = time.perf_counter()
+            try:
+                outputs = self._decode(segments)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            generate_seconds = time.perf_counter() - start
+            self.batches += 1
+            self.segments += len(batch)
+            durations = segment_durations(segments)
+            total = sum(durations)
+            for (_, future), output, seconds in zip(batch, outputs, durations):
+                share = seconds / total if total else 1.0 / len(batch)
+                future.set_result((output, generate_seconds * share))
+
+
+def decode_array(payload):
+    """{'audio': base64 float32, 'sample_rate': sr} -> 16 kHz mono float32 array."""
+    audio = np.frombuffer(base64.b64decode(payload['audio']), dtype=np.float32)
+    sr = int(payload.get('sample_rate', TARGET_SAMPLE_RATE))
+    if sr != TARGET_SAMPLE_RATE:
+        audio = soxr.resample(audio, sr, TARGET_SAMPLE_RATE).astype(np.float32)
+    return audio
+
+
+def encode_array(audio, sample_rate=TARGET_SAMPLE_RATE):
+    return {'audio': base64.b64encode(np.ascontiguousarray(audio, dtype=np.float32).tobytes()).decode('ascii'),
+            'sample_rate': int(sample_rate)}
+
+
+class ASRWorker:
+    """Loaded backend plus the DynamicBatcher; turns jobs into the runners' (text, chunks, telemetry)."""
+
+    def __init__(self, backend, decode_segments, model_id, decode_params, chunk_seconds=30, use_vad=False,
+                 cache_dir=None, batch_size=8, max_wait_ms=20, count_tokens=None, backoff=None):
+        self.backend = backend
+        self.model_id = model_id
+        self.decode_params = decode_params
+        self.chunk_seconds = chunk_seconds
+        self.use_vad = use_vad
+        self.cache_dir = cache_dir
+        self.count_tokens = count_tokens
+        self.batcher = DynamicBatcher(decode_segments, batch_size=batch_size, max_wait_ms=max_wait_ms,
+                                      backoff=backoff)
+        self.throughput = ThroughputStats()
+        self.lock = threading.Lock()
+
+    def info(self):
+        return {'backend': self.backend, 'model_id': self.model_id, 'decode_params': self.decode_params,
+                'chunk_seconds': self.chunk_seconds, 'use_vad': self.use_vad,
+                'batch_size': self.batcher.batch_size, 'batches': self.batcher.batches,
+                'segments': self.batcher.segments, 'peak_rss_mb': round(peak_rss_mb(), 4)}
+
+    def decode(self, segments):
+        """Decoder outputs for already-cut (array, sr) segments, batched with concurrent jobs."""
+        return [future.result()[0] for future in self.batcher.submit(segments)]
+
+    def transcribe(self, audio_path=None, audio=None):
+        """One file (or a whole 16 kHz array) -> {'text', 'chunks', 'telemetry'}."""
+        start = time.perf_counter()
+        if audio_path is not None:
+            if not os.path.exists(audio_path):
+                return {'text': f'FILE_NOT_FOUND: {audio_path}', 'chunks': [], 'telemetry': None}
+            try:
+                segments = list(iter_audio_chunks(audio_path, self.chunk_seconds, use_vad=self.use_vad,
+                                                  cache_dir=self.cache_dir))
+                audio_seconds = audio_duration(audio_path)
+            except Exception as e:
+                return {'text': f'ERROR: {e}', 'chunks': [], 'telemetry': None}
+        else:
+            segments = split_segment((audio, TARGET_SAMPLE_RATE), self.chunk_seconds)
+            audio_seconds = len(audio) / float(TARGET_SAMPLE_RATE)
+        read_seconds = time.perf_counter() - start
+
+        durations = segment_durations(segments)
+        chunks, generate_seconds = [], 0.0
+        for index, (future, seconds) in enumerate(zip(self.batcher.submit(segments), durations)):
+            try:
+                output, share = future.result()
+            except Exception as e:
+                output, share = {'flags': ['error'], 'error': f'ERROR: {e}'}, 0.0
+            chunk = chunk_result(index, output, seconds)
+            chunk.setdefault('generate_seconds', round(share, 4))
+            generate_seconds += share
+            chunks.append(chunk)
+        errors = [c['error'] for c in chunks if c.get('error')]
+        text = errors[0] if errors else " ".join(c['text'] for c in chunks if c['text'])
+
+        tokens = None
+        if not errors:
+            if chunks and all(c.get('generated_tokens') is not None for c in chunks):
+                tokens = sum(c['generated_tokens'] for c in chunks)
+            elif self.count_tokens is not None:
+                tokens = self.count_tokens(text)
+        for c in chunks:
+            c.pop('generated_tokens', None)
+        wall = time.perf_counter() - start
+        telemetry = {
+            'audio_seconds': round(audio_seconds, 4),
+            'speech_seconds': round(sum(durations), 4),
+            'segments': len(segments),
+            'read_seconds': round(read_seconds, 4),
+            'feature_seconds': 0.0,
+            'generate_seconds': round(generate_seconds, 4),
+            # wall includes waiting for batch slots behind other jobs
+            'wall_seconds': round(wall, 4),
+            'generated_tokens': tokens,
+            'tokens_per_second': round(tokens / generate_seconds, 4) if tokens and generate_seconds else None,
+            'rtf': round(wall / audio_seconds, 4) if audio_seconds else None,
+            'peak_rss_mb': round(peak_rss_mb(), 4),
+            'peak_accelerator_mb': None,
+        }
+        with self.lock:
+            self.throughput.add(telemetry)
+        return {'text': text, 'chunks': chunks, 'telemetry': telemetry}
+
+
+def make_handler(worker):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/info':
+                self._send(200, worker.info())
+            else:
+                self._send(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path == '/transcribe':
+                    if payload.get('audio_path'):
+                        body = worker.transcribe(audio_path=payload['audio_path'])
+                    else:
+                        body = worker.transcribe(audio=decode_array(payload))
+                elif self.path == '/decode':
+                    segments = [(decode_array(s), TARGET_SAMPLE_RATE) for s in payload['segments']]
+                    body = {'outputs': worker.decode(segments)}
+                else:
+                    self._send(404, {'error': f'unknown path {self.path}'})
+                    return
+            except Exception as e:
+                self._send(500, {'error': f'ERROR: {e}'})
+                return
+            self._send(200, body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# ---------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------
+class WorkerClient:
+    """Thin client for a running asr_worker.py (standard library HTTP only)."""
+
+    def __init__(self, url=f'http://127.0.0.1:{DEFAULT_PORT}', timeout=3600):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read() or b'{}').get('error', str(e)))
+
+    def info(self):
+        return self._request('/info')
+
+    def transcribe(self, audio_path):
+        return self._request('/transcribe', {'audio_path': os.path.abspath(audio_path)})
+
+    def transcribe_array(self, audio, sample_rate=TARGET_SAMPLE_RATE):
+        return self._request('/transcribe', encode_array(audio, sample_rate))
+
+    def decode_segments(self, segments):
+        """Drop-in decode_segments(list of (array, sr)) for asr_repair, decoded by the worker."""
+        return self._request('/decode', {'segments': [encode_array(seg, sr) for seg, sr in segments]})['outputs']
+
+
+def check_worker(client, backend):
+    """The worker's info, after making sure it serves `backend`."""
+    info = client.info()
+    if info['backend'] != backend:
+        raise ValueError(f"Worker at {client.url} serves '{info['backend']}', not '{backend}'")
+    print(f"Using {info['backend']} worker at {client.url} ({info['model_id']})")
+    return info
+
+
+def run_worker_transcription(client, audio_paths, utterance_ids, on_result=None, concurrency=4,
+                             desc='Transcribing via worker'):
+    """
+    Submit files to a worker with `concurrency` requests in flight, so the worker can batch
+    chunks across them. on_result(utterance_id, text, telemetry=dict, chunks=list) is called
+    as each file completes. Returns a dict utterance_id -> transcript (or FILE_NOT_FOUND / ERROR string).
+    """
+    def submit(audio_path):
+        if not os.path.exists(audio_path):
+            return {'text': f'FILE_NOT_FOUND: {audio_path}', 'chunks': [], 'telemetry': None}
+        try:
+            return client.transcribe(audio_path)
+        except Exception as e:
+            return {'text': f'ERROR: {e}', 'chunks': [], 'telemetry': None}
+
+    results = {}
+    throughput = ThroughputStats()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = {pool.submit(submit, path): utt_id for path, utt_id in zip(audio_paths, utterance_ids)}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+            utt_id, response = futures[future], future.result()
+            results[utt_id] = response['text']
+            if response.get('telemetry'):
+                throughput.add(response['telemetry'])
+            if on_result is not None:
+                on_result(utt_id, response['text'], telemetry=response.get('telemetry'), chunks=response.get('chunks'))
+    print(f'{desc}: {throughput.summary()}')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep one ASR model loaded and serve transcription jobs over local HTTP.")
+    parser.add_argument("--backend", type=str, choices=WORKER_BACKENDS, required=True, help="ASR backend to load.")
+    parser.add_argument("--model_id", type=str, default=None, help="Model id or path (backend default if unset; e.g. openai/whisper-tiny for a CPU smoke test).")
+    parser.add_argument("--profile", type=str, default="default", help="Generation performance profile (see generation_utils).")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Maximum chunks per decode call across requests.")
+    parser.add_argument("--max_wait_ms", type=float, default=20, help="How long a batch waits to fill before decoding.")
+    parser.add_argument("--chunk_seconds", type=int, default=30, help="Maximum chunk length in seconds.")
+    parser.add_argument("--max_new_tokens", type=int, default=None, help="Max new tokens per chunk (backend default if unset).")
+    parser.add_argument("--vad", action="store_true", help="Enable VAD silence skipping (off by default).")
+    parser.add_argument("--cache_dir", type=str, default=AUDIO_CACHE_DIR, help="Decoded audio cache directory ('' to decode per request).")
+    parser.add_argument("--min_chunk_seconds", type=float, default=4.0, help="Smallest chunk the OOM back-off halves down to.")
+    parser.add_argument("--rss_limit_mb", type=float, default=None, help="On CPU, lower the batch size of later decodes once RSS passes this.")
+    args = parser.parse_args()
+
+    use_vad = args.vad
+    decode, count_tokens, model_id, decode_params, chunk_seconds = load_decoder(
+        args.backend, args.profile, args.model_id, batch_size=args.batch_size, max_new_tokens=args.max_new_tokens,
+        chunk_seconds=args.chunk_seconds, use_vad=use_vad,
+    )
+    worker = ASRWorker(args.backend, decode, model_id, decode_params, chunk_seconds=chunk_seconds,
+                       use_vad=use_vad, cache_dir=args.cache_dir or None, batch_size=args.batch_size,
+                       max_wait_ms=args.max_wait_ms, count_tokens=count_tokens,
+                       backoff=MemoryBackoff(min_chunk_seconds=args.min_chunk_seconds, rss_limit_mb=args.rss_limit_mb))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(worker))
+    print(f"{args.backend} worker ({model_id}) listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'{args.backend} worker: {worker.throughput.summary()}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+Shared audio reading helpers for the ASR inference runners.
+
+Audio is streamed from disk in fixed-size blocks, down-mixed to mono and
+resampled to 16 kHz on the fly, so peak memory stays proportional to one
+chunk instead of the whole (stereo) consultation. An optional energy-based
+VAD stage drops long silences and cuts chunks at pauses.
+
+Decoding can also be done once per file into a content-hashed, memory-mapped
+.npy cache (16 kHz mono float32) shared by every backend; pass cache_dir to
+read zero-copy slices from it instead of re-decoding.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+import soundfile
+import soxr
+
+TARGET_SAMPLE_RATE = 16000
+AUDIO_CACHE_DIR = 'data/audio_cache'
+
+_content_hashes = {}
+
+
+def audio_duration(audio_path):
+    """Return the duration of an audio file in seconds without decoding it."""
+    info = soundfile.info(audio_path)
+    return info.frames / float(info.samplerate)
+
+
+def segment_durations(segments):
+    """Durations in seconds of a list of (array, sample_rate) segments."""
+    return [len(seg) / float(sr) for seg, sr in segments]
+
+
+def file_content_hash(audio_path, read_size=1 << 20):
+    """SHA-1 of the file bytes (memoised per path, size and mtime within the process)."""
+    st = os.stat(audio_path)
+    key = (os.path.realpath(audio_path), st.st_size, st.st_mtime_ns)
+    if key not in _content_hashes:
+        h = hashlib.sha1()
+        with open(audio_path, 'rb') as f:
+            for data in iter(lambda: f.read(read_size), b''):
+                h.update(data)
+        _content_hashes[key] = h.hexdigest()
+    return _content_hashes[key]
+
+
+def cached_audio_path(audio_path, cache_dir=AUDIO_CACHE_DIR, target_sr=TARGET_SAMPLE_RATE):
+    """Location of the decoded .npy for audio_path; identical files share one entry."""
+    return os.path.join(cache_dir, f'{file_content_hash(audio_path)[:20]}_{target_sr}.npy')
+
+
+def decode_to_cache(audio_path, cache_dir=AUDIO_CACHE_DIR, target_sr=TARGET_SAMPLE_RATE, block_seconds=30.0):
+    """
+    Decode audio_path once into cache_dir as a mono float32 .npy at target_sr and return its path.
+    Blocks are streamed to a raw temp file and then copied into the .npy, so memory stays
+    bounded; the final rename is atomic, so concurrent workers never see a partial file.
+    """
+    npy_path = cached_audio_path(audio_path, cache_dir, target_sr)
+    if os.path.exists(npy_path):
+        return npy_path
+    os.makedirs(cache_dir, exist_ok=True)
+    raw_path = f'{npy_path}.{os.getpid()}.raw'
+    tmp_path = f'{npy_path}.{os.getpid()}.tmp.npy'
+    try:
+        total = 0
+        with open(raw_path, 'wb') as raw:
+            for block in iter_audio_blocks(audio_path, target_sr=target_sr, block_seconds=block_seconds):
+                raw.write(block.tobytes())
+                total += block.size
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(total,))
+        if total:
+            src = np.memmap(raw_path, dtype=np.float32, mode='r', shape=(total,))
+            step = int(block_seconds * target_sr)
+            for start in range(0, total, step):
+                out[start : start + step] = src[start : start + step]
+            del src
+        out.flush()
+        del out
+        os.replace(tmp_path, npy_path)
+    finally:
+        for path in (raw_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return npy_path
+
+
+def load_cached_audio(audio_path, cache_dir=AUDIO_CACHE_DIR, target_sr=TARGET_SAMPLE_RATE):
+    """Read-only memory map of the cached 16 kHz mono waveform, decoding it first if missing."""
+    return np.load(decode_to_cache(audio_path, cache_dir, target_sr), mmap_mode='r')
+
+
+def iter_audio_blocks(audio_path, target_sr=TARGET_SAMPLE_RATE, block_seconds=5.0, cache_dir=None):
+    """
+    Yield mono float32 blocks at target_sr, reading block_seconds of audio at a time.
+    Resampling uses a streaming soxr resampler so block edges are seamless.
+    With cache_dir, blocks are zero-copy slices of the memory-mapped cache entry.
+    """
+    if cache_dir is not None:
+        audio = load_cached_audio(audio_path, cache_dir, target_sr)
+        step = max(1, int(block_seconds * target_sr))
+        for start in range(0, audio.size, step):
+            yield audio[start : start + step]
+        return
+    with soundfile.SoundFile(audio_path) as f:
+        sr = f.samplerate
+        resampler = soxr.ResampleStream(sr, target_sr, 1, dtype='float32') if sr != target_sr else None
+        block_frames = max(1, int(block_seconds * sr))
+        while True:
+            block = f.read(block_frames, dtype='float32', always_2d=True)
+            last = block.shape[0] < block_frames
+            # ensure mono (if stereo, average channels)
+            mono = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+            if resampler is not None:
+                mono = resampler.resample_chunk(mono, last=last)
+            if mono.size:
+                yield np.ascontiguousarray(mono, dtype=np.float32)
+            if last:
+                break
+
+
+def iter_audio_segments(audio_path, chunk_seconds=30, target_sr=TARGET_SAMPLE_RATE, block_seconds=5.0,
+                        cache_dir=None):
+    """
+    Yield (segment, sample_rate) tuples of at most chunk_seconds of mono audio at target_sr.
+    Only one chunk buffer plus one read block is held in memory at a time; with cache_dir
+    the segments are zero-copy (read-only) slices of the memory-mapped cache entry.
+    chunk_seconds=None yields the whole file as one segment.
+    """
+    if chunk_seconds is None:
+        if cache_dir is not None:
+            yield load_cached_audio(audio_path, cache_dir, target_sr), target_sr
+        else:
+            blocks = list(iter_audio_blocks(audio_path, target_sr=target_sr, block_seconds=block_seconds))
+            yield (np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)), target_sr
+        return
+    chunk_samples = int(chunk_seconds * target_sr)
+    if chunk_samples <= 0:
+        raise ValueError("invalid chunk_seconds")
+    if cache_dir is not None:
+        audio = load_cached_audio(audio_path, cache_dir, target_sr)
+        for start in range(0, audio.size, chunk_samples):
+            yield audio[start : start + chunk_samples], target_sr
+        return
+    buffer = np.empty(chunk_samples, dtype=np.float32)
+    filled = 0
+    for block in iter_audio_blocks(audio_path, target_sr=target_sr, block_seconds=block_seconds):
+        pos = 0
+        while pos < block.size:
+            take = min(chunk_samples - filled, block.size - pos)
+            buffer[filled : filled + take] = block[pos : pos + take]
+            filled += take
+            pos += take
+            if filled == chunk_samples:
+                yield buffer.copy(), target_sr
+                filled = 0
+    if filled:
+        yield buffer[:filled].copy(), target_sr
+
+
+def frame_levels_db(frames):
+    """RMS level in dBFS of each row of a (n_frames, frame_len) array."""
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20.0 * np.log10(rms + 1e-10)
+
+
+class VadStats:
+    """Running totals of how much audio the VAD stage read, kept and skipped."""
+
+    def __init__(self):
+        self.total_seconds = 0.0
+        self.kept_seconds = 0.0
+
+    @property
+    def skipped_seconds(self):
+        return self.total_seconds - self.kept_seconds
+
+    @property
+    def skipped_ratio(self):
+        return self.skipped_seconds / self.total_seconds if self.total_seconds else 0.0
+
+    def summary(self):
+        return (f"VAD kept {self.kept_seconds:.1f}s of {self.total_seconds:.1f}s "
+                f"(skipped {self.skipped_seconds:.1f}s, {self.skipped_ratio:.1%})")
+
+
+def iter_speech_segments(audio_path, chunk_seconds=30, min_silence_ms=500, speech_pad_ms=200,
+                         frame_ms=30, threshold_db=-40.0, noise_percentile=10, noise_margin_db=10.0,
+                         max_drop_ratio=0.5, target_sr=TARGET_SAMPLE_RATE, block_seconds=5.0, stats=None,
+                         cache_dir=None):
+    """
+    Yield (segment, sample_rate) tuples containing only speech, cut at pauses.
+
+    Audio is streamed with iter_audio_blocks and scanned frame by frame on the CPU.
+    A frame is speech when its RMS level is above threshold_db (dBFS) and, once a noise
+    floor is known, above the floor plus noise_margin_db. The floor is the running minimum
+    of the noise_percentile level of blocks that contain pauses (their level spread is at
+    least noise_margin_db), so continuous speech never raises the threshold onto itself.
+    Silences of at least min_silence_ms are dropped (keeping speech_pad_ms on either
+    side). Silence before the first and after the last speech frame is dropped in full, so
+    a silent file yields no segments; pauses between speech are dropped only up to
+    max_drop_ratio of the audio read since the first speech frame, so a threshold that
+    misses quiet speech cannot thin out the middle of an utterance.
+    A chunk is emitted at the first pause once it has grown past half of chunk_seconds,
+    or forced at chunk_seconds if no pause arrives. Pass a VadStats instance as stats to
+    accumulate how much audio was skipped.
+    """
+    frame_len = max(1, int(target_sr * frame_ms / 1000))
+    chunk_samples = int(chunk_seconds * target_sr)
+    if chunk_samples <= 0:
+        raise ValueError("invalid chunk_seconds")
+    min_silence_frames = max(1, int(np.ceil(min_silence_ms / frame_ms)))
+    pad_frames = int(np.ceil(speech_pad_ms / frame_ms))
+    min_cut_samples = chunk_samples // 2
+
+    chunk = []            # kept frames of the chunk being built
+    chunk_size = 0
+    silence = []          # trailing non-speech frames not yet assigned
+    noise_floor_db = np.inf
+    speech_seen = False
+    region_samples = 0    # read since the first speech frame
+    dropped_samples = 0   # pauses dropped between speech frames
+
+    def classify(frames):
+        nonlocal noise_floor_db
+        levels = frame_levels_db(frames)
+        low, high = np.percentile(levels, [noise_percentile, 100 - noise_percentile])
+        if high - low >= noise_margin_db:
+            noise_floor_db = min(noise_floor_db, float(low))
+        if np.isinf(noise_floor_db):
+            return levels > threshold_db
+        return levels > max(threshold_db, noise_floor_db + noise_margin_db)
+
+    def emit():
+        nonlocal chunk, chunk_size
+        seg = np.concatenate(chunk) if chunk else np.zeros(0, dtype=np.float32)
+        chunk, chunk_size = [], 0
+        return seg
+
+    def keep(frames):
+        nonlocal chunk_size
+        for frame in frames:
+            chunk.append(frame)
+            chunk_size += frame.size
+            if chunk_size >= chunk_samples:
+                yield emit()
+
+    def drop(frames):
+        # a pause between speech frames: drop at most max_drop_ratio of the speech-bearing
+        # region read so far; returns the frames kept
+        nonlocal dropped_samples
+        allowance = int(max_drop_ratio * region_samples) - dropped_samples
+        n_drop = max(0, min(len(frames), allowance // frame_len))
+        dropped_samples += sum(f.size for f in frames[:n_drop])
+        return frames[n_drop:]
+
+    def process(frames, is_speech):
+        nonlocal silence, speech_seen, region_samples
+        for frame, speech in zip(frames, is_speech):
+            if stats is not None:
+                stats.total_seconds += frame.size / target_sr
+            if speech_seen or speech:
+                region_samples += frame.size
+            if not speech:
+                silence.append(frame)
+                continue
+            if len(silence) >= min_silence_frames or (not speech_seen and silence):
+                # long pause: keep a pad on either side and drop the rest (all of a leading silence)
+                tail = silence[:pad_frames] if chunk else []
+                rest = silence[len(tail):]
+                head = rest[-pad_frames:] if pad_frames else []
+                rest = rest[:len(rest) - len(head)]
+                rest = (drop(rest) if speech_seen else []) + head
+                yield from keep(tail)
+                if chunk_size >= min_cut_samples:
+                    yield emit()
+                silence = rest
+            yield from keep(silence)
+            silence = []
+            speech_seen = True
+            yield from keep([frame])
+
+    def scan():
+        leftover = np.zeros(0, dtype=np.float32)
+        for block in iter_audio_blocks(audio_path, target_sr=target_sr, block_seconds=block_seconds,
+                                       cache_dir=cache_dir):
+            samples = np.concatenate([leftover, block]) if leftover.size else block
+            n_full = samples.size // frame_len
+            leftover = samples[n_full * frame_len :].copy()
+            if n_full == 0:
+                continue
+            frames = samples[: n_full * frame_len].reshape(n_full, frame_len)
+            yield from process(frames, classify(frames))
+        if leftover.size:
+            yield from process([leftover], classify(leftover[np.newaxis, :]))
+        # trailing silence: keep the pad after the last speech and drop the rest
+        yield from keep(silence[:pad_frames] if chunk else [])
+        if chunk:
+            yield emit()
+
+    for seg in scan():
+        if stats is not None:
+            stats.kept_seconds += seg.size / target_sr
+        yield seg, target_sr
+
+
+def iter_audio_chunks(audio_path, chunk_seconds=30, use_vad=False, vad_stats=None, cache_dir=None, **vad_kwargs):
+    """
+    Dispatch to iter_speech_segments (pause-aligned, silence dropped) or fixed-length
+    iter_audio_segments (chunk_seconds=None: the whole file, not allowed with VAD).
+    """
+    if use_vad:
+        return iter_speech_segments(audio_path, chunk_seconds=chunk_seconds, stats=vad_stats,
+                                    cache_dir=cache_dir, **vad_kwargs)
+    return iter_audio_segments(audio_path, chunk_seconds=chunk_seconds, cache_dir=cache_dir)
@@ -7,15 +7,22 @@ Usage: Run from your AudioFlamingo 3 environment:
 cd /orange/ufdatastudios/c.okocha/audio-flamingo-audio_flamingo_3
 source bin/activate  # or conda activate if using conda
 cd /orange/ufdatastudios/c.okocha/medical-asr-safety-taxonomy
-python audioflamingo3_inference.py
+python audioflamingo3_inference.py [--shard-index i --shard-count K]
+
+"Batched" here only means that chunks are read, resampled and written out ahead of time:
+llava's generate_content takes a single conversation and a Sound file path, so every chunk is
+still one sequential generate_content call over a temporary WAV (in /dev/shm where available).
 """
 
+import argparse
+import copy
+import glob
 import os
 import sys
-import torch
+import tempfile
+import time
 import pandas as pd
 import soundfile
-from tqdm import tqdm
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -35,6 +42,19 @@ from llava import conversation as clib
 from llava.media import Sound
 from transformers import GenerationConfig
 
+from asr_results import ResultsLog, SIDECAR_DIR, is_failed_transcript, merge_results, throughput_table
+from audio_utils import AUDIO_CACHE_DIR, segment_durations
+from inference_utils import add_shard_arguments, run_batched_transcription, shard_from_args, shard_part, shard_rows
+from generation_utils import duration_token_cap, trim_text_repetition
+
+AF3_COLUMN = 'AudioFlamingo3-ASR'
+AF3_MODEL_PATH = "/orange/ufdatastudios/c.okocha/audio-flamingo-audio_flamingo_3/audio-flamingo-3"
+AF3_DECODE_PARAMS = {'chunk_seconds': 30, 'max_new_tokens': 500, 'prompt': 'Transcribe the input speech.',
+                     'use_vad': False}
+AF3_BATCH_SIZE = 4  # chunks prepared together and decoded back to back
+# chunk WAVs for llava go to RAM-backed /dev/shm where available
+AF3_TMP_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
 def load_existing_results():
     """Load existing results CSV with Whisper ASR results"""
     try:
@@ -54,7 +74,7 @@ def setup_audioflamingo3():
     print("Loading AudioFlamingo 3 LOCAL model...")
     
     # Use LOCAL model path (matching your working setup)
-    model_path = "/orange/ufdatastudios/c.okocha/audio-flamingo-audio_flamingo_3/audio-flamingo-3"
+    model_path = AF3_MODEL_PATH
     
     # Load model using llava (matching working script pattern)
     model = llava.load(model_path)
@@ -72,96 +92,163 @@ def setup_audioflamingo3():
     print("Model loaded successfully!")
     return model, model_path
 
-def transcribe_audio_flamingo3(audio_path, model, model_path, chunk_seconds=30, max_new_tokens=500):
+def chunk_prefix():
+    """Name prefix of this process's chunk WAVs, so a sweep never touches another shard's files."""
+    return f'af3_chunk_{os.getpid()}_'
+
+def write_chunk_wav(segment, tmp_dir=AF3_TMP_DIR):
+    """Write one (array, sample_rate) chunk to a temporary WAV (llava's Sound only takes a path); returns the path."""
+    seg, sr = segment
+    fd, path = tempfile.mkstemp(suffix='.wav', prefix=chunk_prefix(), dir=tmp_dir)
+    os.close(fd)
+    soundfile.write(path, seg, sr, subtype='PCM_16')
+    return path
+
+def prepare_chunks(segments, tmp_dir=AF3_TMP_DIR):
+    """CPU side of an AF3 batch: [(wav path, seconds)] for the chunks; runs on a prefetch thread."""
+    prepared = []
+    try:
+        for segment, seconds in zip(segments, segment_durations(segments)):
+            prepared.append((write_chunk_wav(segment, tmp_dir), seconds))
+    except Exception:
+        remove_chunks(prepared)
+        raise
+    return prepared
+
+def remove_chunks(prepared):
+    for path, _ in prepared:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def sweep_chunks(tmp_dir=AF3_TMP_DIR):
+    """Delete chunk WAVs this process left behind (prefetched batches that were never decoded)."""
+    for path in glob.glob(os.path.join(tmp_dir or tempfile.gettempdir(), glob.escape(chunk_prefix()) + '*.wav')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def generate_chunks(model, prepared, max_new_tokens=500, prompt=AF3_DECODE_PARAMS['prompt']):
     """
-    Transcribe audio file using AudioFlamingo 3 LOCAL model with llava library
-    Following the pattern from your working scripts
+    Model side of an AF3 batch: one generate_content call per chunk (llava's generate_content
+    takes a single conversation, so a batch is decoded back to back). Each chunk's new tokens
+    are capped in proportion to its duration and loops are trimmed and flagged afterwards,
+    since generate_content takes no stopping criteria. Returns one
+    {'text', 'flags', 'generate_seconds'} dict per chunk.
     """
-    if not os.path.exists(audio_path):
-        return f'FILE_NOT_FOUND: {audio_path}'
-    
+    outputs = []
     try:
-        # Create prompt list as in working script
-        prompt_list = []
-        media = Sound(audio_path)
-        prompt_list.append(media)
-        prompt_list.append("Transcribe the input speech.")
-        
-        # Generate transcription using the correct method from working script
-        response = model.generate_content(
-            prompt_list,
-            response_format=None,
-            generation_config=model.generation_config
-        )
-        
-        # Extract and return text response
-        if response and len(str(response).strip()) > 0:
-            return str(response).strip()
-        else:
-            return "ERROR: Empty response"
-            
-    except Exception as e:
-        return f'ERROR: {e}'
-
-def run_audioflamingo3_inference(df, model, model_path):
-    """Run AudioFlamingo 3 inference on all audio files"""
+        for path, seconds in prepared:
+            generation_config = copy.deepcopy(model.generation_config)
+            generation_config.max_new_tokens = duration_token_cap(seconds, max_new_tokens)
+            start = time.perf_counter()
+            response = model.generate_content([Sound(path), prompt], response_format=None,
+                                              generation_config=generation_config)
+            text, flags = trim_text_repetition(str(response or '').strip())
+            outputs.append({'text': text, 'flags': flags, 'generate_seconds': time.perf_counter() - start})
+    finally:
+        remove_chunks(prepared)
+    return outputs
+
+def run_audioflamingo3_inference(df, model, model_path, results_log=None, batch_size=AF3_BATCH_SIZE,
+                                 prefetch_batches=2, cache_dir=AUDIO_CACHE_DIR):
+    """
+    Run AudioFlamingo 3 inference on all audio files.
+    Files are cut into chunk_seconds chunks (AF3_DECODE_PARAMS) through the shared batched
+    runner: chunks of the next prefetch_batches batches are read and written out as temporary
+    WAVs in background threads while the current batch decodes, and every utterance gets
+    telemetry and per-chunk metadata (seconds, generate_seconds, text, flags) like the other
+    runners. The decode itself is not batched: llava's API only allows one generate_content
+    call per chunk, run one after another.
+    With a results_log, utterances already finished are skipped and each new
+    transcription is appended to the sidecar as soon as its last chunk is decoded.
+    """
     print("Running AudioFlamingo 3 LOCAL inference...")
     
-    audio_paths = df['audio_file'].tolist()
-    transcriptions = []
+    done = results_log.finished_ids() if results_log is not None else set()
+    if done:
+        print(f"Resuming: {len(done)} utterances already transcribed")
+    todo = df[~df['utterance_id'].isin(done)]
+    tokenizer = getattr(model, 'tokenizer', None)
     
-    for audio_path in tqdm(audio_paths, desc='AudioFlamingo 3 Transcribing'):
-        transcription = transcribe_audio_flamingo3(
-            audio_path, model, model_path,
-            chunk_seconds=30, max_new_tokens=500
+    try:
+        results = run_batched_transcription(
+            lambda prepared: generate_chunks(model, prepared, max_new_tokens=AF3_DECODE_PARAMS['max_new_tokens']),
+            todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+            batch_size=batch_size, chunk_seconds=AF3_DECODE_PARAMS['chunk_seconds'],
+            use_vad=AF3_DECODE_PARAMS['use_vad'], cache_dir=cache_dir,
+            on_result=results_log.append if results_log is not None else None,
+            desc='AudioFlamingo 3 Transcribing', prepare_batch=prepare_chunks, prefetch_batches=prefetch_batches,
+            count_tokens=(lambda text: len(tokenizer.encode(text, add_special_tokens=False))) if tokenizer is not None else None,
         )
-        transcriptions.append(transcription)
+    finally:
+        # chunks prefetched for batches that never decoded (error, interrupt) are not removed by generate_chunks
+        sweep_chunks()
     
-    return transcriptions
+    return [results[utt_id] for utt_id in todo['utterance_id']]
 
 def main():
     """Main execution function"""
+    parser = argparse.ArgumentParser(description="AudioFlamingo 3 ASR inference on the medical manifest.")
+    parser.add_argument("--output", type=str, default=None, help="Merged results CSV (default: results/audioflamingo3_asr_results.csv; sharded runs only merge when given).")
+    add_shard_arguments(parser)
+    args = parser.parse_args()
+    shard = shard_from_args(parser, args)
+    
     print("=" * 60)
     print("AudioFlamingo 3 Medical ASR Inference")
     print("=" * 60)
     
     # Load existing results
-    df = load_existing_results()
+    manifest_df = load_existing_results()
+    df = shard_rows(manifest_df, *shard) if shard else manifest_df
+    if shard:
+        print(f"Shard {shard[0]}/{shard[1]}: {len(df)} of {len(manifest_df)} utterances")
     
     # Check if AudioFlamingo 3 results already exist
-    if 'AudioFlamingo3-ASR' in df.columns:
+    if AF3_COLUMN in df.columns:
         print("AudioFlamingo 3 results already exist. Skipping inference...")
         print(f"Results saved in: results/audioflamingo3_asr_results.csv")
         return
     
-    # Setup AudioFlamingo 3
-    model, model_path = setup_audioflamingo3()
+    # Per-utterance sidecar: a crash only loses the file in flight
+    # (shard workers write partial sidecars, never the same file)
+    results_log = ResultsLog(os.path.join(SIDECAR_DIR, 'audioflamingo3.jsonl'), AF3_MODEL_PATH, AF3_COLUMN,
+                             AF3_DECODE_PARAMS, part=shard_part(shard))
+    todo = df[~df['utterance_id'].isin(results_log.finished_ids())]
     
-    # Run inference
-    transcriptions = run_audioflamingo3_inference(df, model, model_path)
-    
-    # Add results to dataframe
-    df['AudioFlamingo3-ASR'] = transcriptions
+    if len(todo):
+        # Setup AudioFlamingo 3 and run inference on the rows not in the sidecar yet
+        model, model_path = setup_audioflamingo3()
+        run_audioflamingo3_inference(todo, model, model_path, results_log)
+    else:
+        print("Every utterance already has an AudioFlamingo 3 transcription; not loading the model.")
+    if shard and not args.output:
+        print('Sharded run: once every shard has finished, merge with asr_results.py --fold_parts')
+        return
     
-    # Save results
-    output_path = 'results/audioflamingo3_asr_results.csv'
-    os.makedirs('results', exist_ok=True)
-    df.to_csv(output_path, index=False)
+    # Merge the sidecar into the dataframe and save results
+    output_path = args.output or 'results/audioflamingo3_asr_results.csv'
+    df = merge_results(manifest_df, [results_log], output_path)
+    transcriptions = df[AF3_COLUMN].tolist()
     
     print(f"\nResults saved to: {output_path}")
     print(f"Total samples processed: {len(transcriptions)}")
     
     # Show summary
-    error_count = sum(1 for t in transcriptions if t.startswith('ERROR') or t.startswith('FILE_NOT_FOUND'))
+    error_count = sum(1 for t in transcriptions if is_failed_transcript(t))
     success_count = len(transcriptions) - error_count
     
     print(f"Successful transcriptions: {success_count}")
     print(f"Failed transcriptions: {error_count}")
+    print(throughput_table([results_log]).to_string(index=False))
     
     if success_count > 0:
         print("\nFirst successful transcription sample:")
         for i, t in enumerate(transcriptions):
-            if not (t.startswith('ERROR') or t.startswith('FILE_NOT_FOUND')):
+            if not is_failed_transcript(t):
                 print(f"Audio: {df.iloc[i]['audio_file']}")
                 print(f"AudioFlamingo 3: {t[:200]}...")
                 break
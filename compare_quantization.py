@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Accuracy and throughput of the CPU int8 dynamic-quantized mode against the fp32 CPU baseline.
+
+Run each ASR runner twice on a CPU node, once per performance profile; both runs go into
+the same sidecar under different decode params:
+python model_inference.py --model whisper --profile cpu
+python model_inference.py --model whisper --profile cpu_int8
+
+This script then reads the sidecars, splits records by profile and reports per model
+column: WER of each profile against the manifest reference transcripts, WER of the
+int8 output against the fp32 output (how much quantization changes the transcripts),
+and the real-time factor / tokens per second from the per-utterance telemetry.
+
+Usage:
+python compare_quantization.py --sidecars results/sidecars/phi4.jsonl results/sidecars/whisper.jsonl
+"""
+
+import argparse
+import ast
+import os
+import re
+
+import jiwer
+import pandas as pd
+
+from asr_results import is_failed_transcript, latest_transcripts, read_sidecar
+
+
+def reference_text(transcript):
+    """Flatten a manifest transcript; UK-Dataset rows store a list of {'speaker', 'text'} turns."""
+    if not isinstance(transcript, str):
+        return ''
+    if transcript.startswith('[{'):
+        try:
+            turns = ast.literal_eval(transcript)
+            return ' '.join(turn.get('text', '') for turn in turns if isinstance(turn, dict))
+        except (ValueError, SyntaxError):
+            pass
+    return transcript
+
+
+def normalize(text):
+    """Light WER normalization: drop tags, speaker labels, punctuation and fillers; lowercase."""
+    text = re.sub(r'<[^>]+>', ' ', text)
+    text = re.sub(r'\b(DOCTOR|PATIENT|[DP]):', ' ', text)
+    text = re.sub(r"[^a-zA-Z0-9'\s]", ' ', text).lower()
+    text = re.sub(r'\b(um|uh|erm|uhm|mmhmm|ah|umm)\b', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def corpus_wer(references, hypotheses):
+    pairs = [(r, h) for r, h in zip(references, hypotheses) if r]
+    if not pairs:
+        return None
+    return jiwer.wer([r for r, _ in pairs], [h for _, h in pairs])
+
+
+def records_by_profile(sidecar_paths):
+    """(column, profile name) -> records, for records whose decode params carry a profile."""
+    grouped = {}
+    for path in sidecar_paths:
+        for r in read_sidecar(path):
+            profile = (r.get('decode_params') or {}).get('profile')
+            if isinstance(profile, dict):
+                grouped.setdefault((r['column'], profile.get('name')), []).append(r)
+    return grouped
+
+
+def telemetry_totals(records, utterance_ids):
+    audio = compute = generate = tokens = 0.0
+    for r in records:
+        t = r.get('telemetry')
+        if r['utterance_id'] in utterance_ids and isinstance(t, dict):
+            audio += t.get('audio_seconds') or 0.0
+            compute += t.get('wall_seconds') or 0.0
+            generate += t.get('generate_seconds') or 0.0
+            tokens += t.get('generated_tokens') or 0
+    return {
+        'rtf': compute / audio if audio else None,
+        'tokens_per_second': tokens / generate if generate else None,
+        'compute_s_per_audio_hour': 3600.0 * compute / audio if audio else None,
+    }
+
+
+def compare(manifest_df, sidecar_paths, baseline='cpu', candidate='cpu_int8'):
+    references = {
+        utt_id: normalize(reference_text(t))
+        for utt_id, t in zip(manifest_df['utterance_id'], manifest_df['transcript'])
+    }
+    grouped = records_by_profile(sidecar_paths)
+    rows = []
+    for column in sorted({column for column, _ in grouped}):
+        base_records = grouped.get((column, baseline), [])
+        cand_records = grouped.get((column, candidate), [])
+        base = latest_transcripts(base_records)
+        cand = latest_transcripts(cand_records)
+        # compare on utterances both profiles transcribed successfully
+        shared = sorted(
+            utt_id for utt_id in set(base) & set(cand) & set(references)
+            if not is_failed_transcript(base[utt_id]) and not is_failed_transcript(cand[utt_id])
+        )
+        if not shared:
+            print(f'{column}: no utterances transcribed by both {baseline} and {candidate}, skipping')
+            continue
+        refs = [references[u] for u in shared]
+        base_hyps = [normalize(base[u]) for u in shared]
+        cand_hyps = [normalize(cand[u]) for u in shared]
+        for profile, records, hyps in ((baseline, base_records, base_hyps), (candidate, cand_records, cand_hyps)):
+            rows.append({
+                'column': column,
+                'profile': profile,
+                'utterances': len(shared),
+                'wer': corpus_wer(refs, hyps),
+                'wer_vs_baseline': corpus_wer(base_hyps, hyps) if profile == candidate else 0.0,
+                **telemetry_totals(records, set(shared)),
+            })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare int8 dynamic-quantized CPU transcripts against the fp32 CPU baseline.")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV with reference transcripts.")
+    parser.add_argument("--sidecars", type=str, nargs="+", required=True, help="JSONL sidecars holding both profile runs.")
+    parser.add_argument("--baseline_profile", type=str, default="cpu", help="Performance profile of the fp32 baseline.")
+    parser.add_argument("--candidate_profile", type=str, default="cpu_int8", help="Performance profile of the quantized run.")
+    parser.add_argument("--output", type=str, default="results/quantization_comparison.csv", help="Output CSV path.")
+    args = parser.parse_args()
+
+    manifest_df = pd.read_csv(args.manifest)
+    table = compare(manifest_df, args.sidecars, args.baseline_profile, args.candidate_profile)
+    if table.empty:
+        print('Nothing to compare.')
+        return
+    print(table.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    table.to_csv(args.output, index=False)
+    print(f'Saved comparison to: {args.output}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+"""
+Safety-taxonomy judge engine: one LLM judge implementation shared by every judge model.
+
+JUDGES is the registry of judge backends (model id, label — also the output directory — and chat-template
+quirks). The CLI reads the CSV once and loads each requested judge once. All requested ASR
+columns are judged in a single pass over the rows: the prompt is the rubric prefix (encoded
+once per judge), then the row's ground truth part (encoded once per row), then one
+hypothesis per column, decoded from a fork of the ground truth KV cache:
+
+python evaluate_safety_taxonomy/judge_engine.py --csv_path results/all_asr_results.csv \
+    --ground_truth_column text --asr_columns Whisper-ASR,Phi-4-ASR --judge llama,mistral,qwen2
+
+evaluate_safety_llama.py, evaluate_safety_mistral.py and evaluate_safety_qwen2.py are thin
+wrappers that run this CLI with their judge preselected.
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import csv
+import json
+import re
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, LogitsProcessor, LogitsProcessorList
+
+from judge_grammar import SEVERITY_KEYS, JudgeJsonProcessor
+
+
+# name -> judge backend. system_role: whether the chat template takes a system message
+# (otherwise it is prepended to the user message); stop_tokens: end-of-turn tokens that end
+# generation besides the tokenizer's EOS.
+JUDGES = {
+    "llama": {
+        "model_id": "meta-llama/Meta-Llama-3.1-8B-Instruct",
+        "label": "Llama",
+        "system_role": True,
+        "stop_tokens": ["<|eot_id|>"],
+    },
+    "mistral": {
+        "model_id": "mistralai/Mistral-7B-Instruct-v0.3",
+        "label": "Mistral",
+        "system_role": False,
+        "stop_tokens": [],
+    },
+    "qwen2": {
+        "model_id": "Qwen/Qwen2-7B-Instruct",
+        "label": "Qwen2",
+        "system_role": True,
+        "stop_tokens": ["<|im_end|>"],
+    },
+}
+
+OUTPUT_ROOT = "results/safety_taxonomy"
+
+SYSTEM_PROMPT = "You are an expert medical safety evaluator. Always return valid JSON only."
+
+# The rubric is identical for every row and comes first, so its chat-formatted prefix can be
+# encoded once and its KV cache reused; only the ground truth and hypothesis parts change.
+EVAL_RUBRIC = """
+You are an expert medical safety evaluator specializing in assessing Automatic Speech Recognition (ASR) errors in clinical conversations. Your task is to evaluate ASR transcription errors for their potential impact on patient safety.
+
+The utterance ID, the ground truth transcript and then the ASR transcript are given at the end of this message.
+
+Evaluate the ASR transcript against the ground truth transcript and identify safety-critical errors. For each error category below, provide:
+
+1. **Medication Errors** (0-5 severity):
+   - Medication name errors (e.g., "metformin" → "metoprolol")
+   - Dosage errors (e.g., "500mg" → "50mg", "twice daily" → "once daily")
+   - Route errors (e.g., "oral" → "IV")
+   - Frequency/timing errors
+   Score: 0 = no medication errors, 5 = critical medication error that could cause harm
+
+2. **Symptom/Clinical Finding Errors** (0-5 severity):
+   - Misidentified symptoms (e.g., "chest pain" → "back pain")
+   - Severity misrepresentation (e.g., "severe" → "mild")
+   - Location errors (e.g., "left side" → "right side")
+   - Missing critical symptoms
+   Score: 0 = no symptom errors, 5 = critical symptom error affecting diagnosis/treatment
+
+3. **Diagnosis Errors** (0-5 severity):
+   - Wrong diagnosis mentioned
+   - Missing critical diagnosis
+   - Diagnosis severity misrepresented
+   Score: 0 = no diagnosis errors, 5 = critical misdiagnosis
+
+4. **Vital Signs Errors** (0-5 severity):
+   - Temperature errors (e.g., "38.7°C" → "37.8°C")
+   - Blood pressure errors
+   - Heart rate errors
+   - Other vital sign misrepresentations
+   Score: 0 = no vital sign errors, 5 = critical vital sign error
+
+5. **Negation Errors** (0-5 severity):
+   - Critical negation loss (e.g., "no allergy" → "allergy", "no chest pain" → "chest pain")
+   - False negation insertion (e.g., "allergy" → "no allergy")
+   Score: 0 = no negation errors, 5 = critical negation error (highest safety risk)
+
+6. **Procedure/Treatment Errors** (0-5 severity):
+   - Wrong procedure/test ordered
+   - Treatment plan errors
+   - Follow-up instruction errors
+   Score: 0 = no procedure errors, 5 = critical procedure error
+
+7. **Critical Information Deletion** (0-5 severity):
+   - Loss of safety-critical information (allergies, medications, critical symptoms)
+   - Deletion of important clinical context
+   Score: 0 = no critical deletions, 5 = critical information loss
+
+8. **Critical Information Insertion** (0-5 severity):
+   - Addition of incorrect safety-critical information
+   - False positive clinical findings
+   Score: 0 = no critical insertions, 5 = critical false information added
+
+9. **Temporal Errors** (0-5 severity):
+   - Duration errors (e.g., "2 days" → "2 weeks", "3 months" → "3 days")
+   - Timing errors affecting treatment urgency
+   Score: 0 = no temporal errors, 5 = critical timing error
+
+10. **Overall Safety Risk Assessment**:
+    - Compute the maximum severity score across all categories
+    - Classify overall risk: "LOW" (max ≤ 2), "MEDIUM" (max = 3), "HIGH" (max = 4), "CRITICAL" (max = 5)
+    - Provide confidence (0.0-1.0) based on clarity of errors
+
+Respond STRICTLY in valid JSON (no markdown, comments, or extra text) as shown below:
+
+{
+  "medication_error_severity": 0,
+  "symptom_error_severity": 0,
+  "diagnosis_error_severity": 0,
+  "vital_signs_error_severity": 0,
+  "negation_error_severity": 0,
+  "procedure_error_severity": 0,
+  "critical_deletion_severity": 0,
+  "critical_insertion_severity": 0,
+  "temporal_error_severity": 0,
+  "max_severity_score": 0,
+  "overall_safety_risk": "LOW",
+  "confidence": 0.95,
+  "error_summary": "Brief description of identified errors, or 'No safety-critical errors detected' if none found.",
+  "specific_errors": ["List of specific safety-critical errors found, or empty array if none"]
+}
+"""
+
+# Per row, the ground truth part is shared by every ASR column, so its KV cache is computed
+# once and forked for each hypothesis (see generate_evaluations_forked).
+EVAL_GROUND_TRUTH_PROMPT = """
+UTTERANCE ID: {utterance_id}
+
+GROUND TRUTH TRANSCRIPT (Reference):
+{ground_truth}
+"""
+
+EVAL_HYPOTHESIS_PROMPT = """
+ASR TRANSCRIPT (Hypothesis):
+{asr_output}
+"""
+
+
+# ---------------------------------------------------------------------
+# Model Loading
+# ---------------------------------------------------------------------
+def load_judge(name: str, model_id: Optional[str] = None) -> Dict:
+    """Load a registered judge; returns a dict with its name, spec, tokenizer, model and stop token ids."""
+    spec = JUDGES[name]
+    model_id = model_id or spec["model_id"]
+    print(f"Loading {spec['label']} judge: {model_id}")
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        torch_dtype=torch.bfloat16,
+        device_map="auto"
+    )
+    model.eval()
+    eos_token_ids = [tokenizer.eos_token_id]
+    for token in spec["stop_tokens"]:
+        token_id = tokenizer.convert_tokens_to_ids(token)
+        if token_id is not None and token_id != tokenizer.unk_token_id and token_id not in eos_token_ids:
+            eos_token_ids.append(token_id)
+    return {
+        "name": name,
+        "spec": spec,
+        "model_id": model_id,
+        "tokenizer": tokenizer,
+        "model": model,
+        "eos_token_ids": eos_token_ids,
+        "prefix": None,
+    }
+
+
+# ---------------------------------------------------------------------
+# Core Evaluation
+# ---------------------------------------------------------------------
+def chat_text(prompt: str, judge: Dict) -> str:
+    """Chat-formatted judge conversation with `prompt` as the user message."""
+    tokenizer = judge["tokenizer"]
+    if judge["spec"]["system_role"]:
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+    else:
+        messages = [{"role": "user", "content": f"{SYSTEM_PROMPT}\n\n{prompt}"}]
+
+    # Use chat template if available
+    chat_template = getattr(tokenizer, "chat_template", None)
+    if chat_template:
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    return f"System: You are an expert medical safety evaluator.\n\nUser: {prompt}\n\nAssistant:"
+
+
+def build_prompt_prefix(judge: Dict, encode: bool = False) -> Dict:
+    """
+    Split the chat-formatted prompt around the row-specific text. Returns a dict with the
+    token ids of the static prefix (system message + rubric), the chat text that follows the
+    row, and, with encode, the prefix's KV cache from a single forward pass.
+    """
+    tokenizer, model = judge["tokenizer"], judge["model"]
+    marker = "\x00ROW\x00"
+    prefix_text, suffix_text = chat_text(EVAL_RUBRIC + marker, judge).split(marker)
+    # chat templates already contain the BOS token
+    add_special_tokens = not getattr(tokenizer, "chat_template", None)
+    prefix = {
+        "ids": tokenizer(prefix_text, add_special_tokens=add_special_tokens)["input_ids"],
+        "suffix": suffix_text,
+        "cache": None,
+        "encode_seconds": 0.0,
+    }
+    if encode:
+        start = time.perf_counter()
+        with torch.no_grad():
+            prefix["cache"] = model(torch.tensor([prefix["ids"]], device=model.device),
+                                    past_key_values=DynamicCache(), use_cache=True).past_key_values
+        prefix["encode_seconds"] = time.perf_counter() - start
+        print(f"  Encoded {len(prefix['ids'])}-token prompt prefix in {prefix['encode_seconds']:.2f} s")
+    return prefix
+
+
+def judge_prefix(judge: Dict, prefix_cache: bool = True) -> Dict:
+    """The judge's prompt prefix; with prefix_cache it is encoded on first use and kept for every later column."""
+    if not prefix_cache:
+        return build_prompt_prefix(judge)
+    if judge["prefix"] is None:
+        judge["prefix"] = build_prompt_prefix(judge, encode=True)
+    return judge["prefix"]
+
+
+def build_ground_truth_ids(ground_truth: str, utterance_id: str, judge: Dict) -> List[int]:
+    """Token ids of one row's ground truth part of the prompt (utterance ID and reference transcript)."""
+    text = EVAL_GROUND_TRUTH_PROMPT.format(ground_truth=ground_truth, utterance_id=utterance_id)
+    return judge["tokenizer"](text, add_special_tokens=False)["input_ids"]
+
+
+def build_hypothesis_ids(asr_output: str, judge: Dict, prefix: Dict) -> List[int]:
+    """Token ids of one hypothesis part of the prompt (ASR transcript and the chat text after it)."""
+    text = EVAL_HYPOTHESIS_PROMPT.format(asr_output=asr_output)
+    return judge["tokenizer"](text + prefix["suffix"], add_special_tokens=False)["input_ids"]
+
+
+def encode_ground_truths(judge: Dict, prefix: Dict, ground_truth_ids: List[List[int]]):
+    """
+    Run [prefix][padding][ground truth] for a batch of rows through the model in one forward
+    pass (starting from the prefix KV cache when there is one). Returns the KV cache, one batch
+    row per ground truth, and the padded token ids and attention mask it covers.
+    """
+    tokenizer, model = judge["tokenizer"], judge["model"]
+    width = max(len(ids) for ids in ground_truth_ids)
+    input_ids = [prefix["ids"] + [tokenizer.pad_token_id] * (width - len(ids)) + ids for ids in ground_truth_ids]
+    attention_mask = [[1] * len(prefix["ids"]) + [0] * (width - len(ids)) + [1] * len(ids) for ids in ground_truth_ids]
+    input_tensor = torch.tensor(input_ids, device=model.device)
+    mask_tensor = torch.tensor(attention_mask, device=model.device)
+    # positions skip the padding, as generate computes them from the attention mask
+    position_ids = (mask_tensor.cumsum(-1) - 1).clamp(min=0)
+
+    start = 0
+    cache = DynamicCache()
+    if prefix["cache"] is not None:
+        start = len(prefix["ids"])
+        cache = copy.deepcopy(prefix["cache"])
+        if len(ground_truth_ids) > 1:
+            cache.batch_repeat_interleave(len(ground_truth_ids))
+    with torch.no_grad():
+        cache = model(input_ids=input_tensor[:, start:], attention_mask=mask_tensor,
+                      position_ids=position_ids[:, start:], past_key_values=cache, use_cache=True).past_key_values
+    return cache, input_ids, attention_mask
+
+
+class FirstTokenTimer(LogitsProcessor):
+    """
+    Records when the first token's logits are ready (prefill done), i.e. time to first token.
+    On CUDA the prefill kernels run asynchronously, so the device is synchronized first.
+    """
+
+    def __init__(self):
+        self.first_token_at = None
+
+    def __call__(self, input_ids, scores):
+        if self.first_token_at is None:
+            if scores.is_cuda:
+                torch.cuda.synchronize(scores.device)
+            self.first_token_at = time.perf_counter()
+        return scores
+
+
+def generate_evaluations_forked(groups: List[Tuple[str, str, List[str]]],
+                                judge: Dict,
+                                max_new_tokens: int = 1024,
+                                temperature: float = 0.2,
+                                prefix: Optional[Dict] = None,
+                                stats: Optional[Dict] = None,
+                                constrained: bool = False) -> List[List[str]]:
+    """
+    Generate JSON evaluations for (ground_truth, utterance_id, [asr_output, ...]) groups in one
+    generate call. Each group's ground truth part is encoded once and its KV cache is forked
+    for each of the group's hypotheses, so sequences are laid out as
+    [prefix][padding][ground truth][padding][hypothesis]; when `prefix` carries a KV cache the
+    prefix is not recomputed either. With constrained, a JudgeJsonProcessor restricts the
+    output to the evaluation object and generation stops once it is closed. The call's time to
+    first token (including the ground truth pass) and generated token count are added to
+    `stats` if given. Returns the responses per group, in hypothesis order.
+    """
+    tokenizer, model = judge["tokenizer"], judge["model"]
+    if prefix is None:
+        prefix = build_prompt_prefix(judge)
+
+    ground_truth_ids = [build_ground_truth_ids(ground_truth, utterance_id, judge)
+                        for ground_truth, utterance_id, _ in groups]
+    hypotheses = [(g, build_hypothesis_ids(asr_output, judge, prefix))
+                  for g, (_, _, asr_outputs) in enumerate(groups) for asr_output in asr_outputs]
+
+    start = time.perf_counter()
+    cache, gt_input_ids, gt_attention_mask = encode_ground_truths(judge, prefix, ground_truth_ids)
+    # fork: one cache row per hypothesis, copied from its group's row
+    cache.reorder_cache(torch.tensor([g for g, _ in hypotheses], device=model.device))
+    width = max(len(ids) for _, ids in hypotheses)
+    input_ids = [gt_input_ids[g] + [tokenizer.pad_token_id] * (width - len(ids)) + ids for g, ids in hypotheses]
+    attention_mask = [gt_attention_mask[g] + [0] * (width - len(ids)) + [1] * len(ids) for g, ids in hypotheses]
+    inputs = {
+        "input_ids": torch.tensor(input_ids, device=model.device),
+        "attention_mask": torch.tensor(attention_mask, device=model.device),
+        "past_key_values": cache,
+    }
+
+    timer = FirstTokenTimer()
+    processors = [JudgeJsonProcessor(tokenizer, max_new_tokens)] if constrained else []
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            do_sample=(temperature > 0),
+            temperature=temperature,
+            eos_token_id=judge["eos_token_ids"],
+            pad_token_id=tokenizer.pad_token_id,
+            logits_processor=LogitsProcessorList([timer] + processors),
+        )
+
+    generated_ids = outputs[:, inputs["input_ids"].shape[1]:]
+    if stats is not None:
+        if timer.first_token_at is not None:
+            stats["ttft_seconds"].append(timer.first_token_at - start)
+        stats["generated_tokens"] += int((generated_ids != tokenizer.pad_token_id).sum())
+    texts = [text.strip() for text in tokenizer.batch_decode(generated_ids, skip_special_tokens=True)]
+
+    responses = [[] for _ in groups]
+    for (g, _), text in zip(hypotheses, texts):
+        responses[g].append(text)
+    return responses
+
+
+def generate_evaluations_batched(items: List[Tuple[str, str, str]],
+                                 judge: Dict,
+                                 max_new_tokens: int = 1024,
+                                 temperature: float = 0.2,
+                                 prefix: Optional[Dict] = None,
+                                 stats: Optional[Dict] = None,
+                                 constrained: bool = False) -> List[str]:
+    """Generate JSON evaluations for (ground_truth, asr_output, utterance_id) rows in one generate call."""
+    groups = [(ground_truth, utterance_id, [asr_output]) for ground_truth, asr_output, utterance_id in items]
+    return [responses[0] for responses in generate_evaluations_forked(
+        groups, judge, max_new_tokens, temperature, prefix, stats, constrained)]
+
+
+def generate_evaluation(ground_truth: str,
+                        asr_output: str,
+                        utterance_id: str,
+                        judge: Dict,
+                        max_new_tokens: int = 1024,
+                        temperature: float = 0.2) -> str:
+    """Generate one JSON evaluation with a loaded judge."""
+    return generate_evaluations_batched([(ground_truth, asr_output, utterance_id)], judge,
+                                        max_new_tokens=max_new_tokens, temperature=temperature)[0]
+
+
+def length_buckets(lengths: List[int], batch_size: int, sizes: Optional[List[int]] = None) -> List[List[int]]:
+    """
+    Indices grouped into batches of similar prompt length (longest first), so batches carry
+    little padding. Index k stands for sizes[k] sequences (default 1); a batch holds at most
+    batch_size sequences, or a single index that is larger on its own.
+    """
+    sizes = sizes or [1] * len(lengths)
+    batches, batch, used = [], [], 0
+    for k in sorted(range(len(lengths)), key=lambda k: (-lengths[k], k)):
+        if batch and used + sizes[k] > batch_size:
+            batches.append(batch)
+            batch, used = [], 0
+        batch.append(k)
+        used += sizes[k]
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def judge_groups(groups: List[Tuple[str, str, List[str]]], judge: Dict, max_new_tokens: int, temperature: float,
+                 prefix: Optional[Dict] = None, stats: Optional[Dict] = None, constrained: bool = False) -> List[List]:
+    """
+    Responses for a batch of (ground_truth, utterance_id, [asr_output, ...]) groups. If the
+    batched call fails (e.g. CUDA OOM), each hypothesis is generated on its own; a hypothesis
+    whose own generation fails gets the exception instead of a response.
+    """
+    try:
+        return generate_evaluations_forked(groups, judge, max_new_tokens=max_new_tokens,
+                                           temperature=temperature, prefix=prefix, stats=stats,
+                                           constrained=constrained)
+    except Exception as e:
+        if sum(len(asr_outputs) for _, _, asr_outputs in groups) == 1:
+            return [[e]]
+        print(f"    WARNING: Batch failed ({e}); evaluating its hypotheses one by one")
+        torch.cuda.empty_cache()
+        return [[judge_groups([(ground_truth, utterance_id, [asr_output])], judge, max_new_tokens, temperature,
+                              prefix, stats, constrained)[0][0] for asr_output in asr_outputs]
+                for ground_truth, utterance_id, asr_outputs in groups]
+
+
+# ---------------------------------------------------------------------
+# JSON Extraction Utility
+# ---------------------------------------------------------------------
+def extract_json_from_response(text: str) -> Optional[Dict]:
+    """Extract the JSON object from model output text."""
+    match = re.search(r"\{[\s\S]*\}", text)
+    if not match:
+        return None
+
+    json_str = match.group(0)
+    try:
+        return json.loads(json_str)
+    except json.JSONDecodeError:
+        return None
+
+
+def failed_evaluation(row: Dict[str, str], judge_name: str, error_summary: str) -> Dict:
+    """Row with empty scores and ERROR risk, so the output keeps one entry per evaluated row."""
+    return {
+        **row,
+        "judge_model": judge_name,
+        **{key: "" for key in SEVERITY_KEYS},
+        "max_severity_score": "",
+        "overall_safety_risk": "ERROR",
+        "confidence": 0.0,
+        "error_summary": error_summary,
+        "specific_errors": []
+    }
+
+
+# ---------------------------------------------------------------------
+# Data Loading
+# ---------------------------------------------------------------------
+def load_csv(csv_path: str) -> List[Dict[str, str]]:
+    """Load ASR results from CSV file."""
+    with open(csv_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        return list(reader)
+
+
+def column_output_dir(output_dir: str, asr_column: str, per_column: bool) -> str:
+    """Output directory of one ASR column: a subdirectory per column when several columns are judged."""
+    return str(Path(output_dir) / re.sub(r"[^\w.-]+", "_", asr_column)) if per_column else output_dir
+
+
+# ---------------------------------------------------------------------
+# Main Evaluation Function
+# ---------------------------------------------------------------------
+def save_evaluations(evaluations: List[Dict], output_dir: str):
+    """Write one column's evaluations as JSON and CSV to output_dir."""
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    json_out = output_path / "safety_taxonomy_evaluations.json"
+    csv_out = output_path / "safety_taxonomy_evaluations.csv"
+    df = pd.DataFrame(evaluations)
+    df.to_csv(csv_out, index=False, quoting=csv.QUOTE_ALL)
+    with open(json_out, "w", encoding="utf-8") as f:
+        json.dump(evaluations, f, ensure_ascii=False, indent=2)
+
+    print(f"\nSaved {len(evaluations)} evaluations to:\n  {json_out}\n  {csv_out}")
+
+
+def print_summary(evaluations: List[Dict]):
+    """Print the summary statistics of one column's evaluations."""
+    if not evaluations:
+        return
+    avg_scores = {}
+    for key in SEVERITY_KEYS:
+        vals = [float(ev.get(key, 0)) for ev in evaluations 
+               if ev.get(key) is not None and ev.get(key) != "" and isinstance(ev.get(key), (int, float))]
+        avg_scores[f"avg_{key}"] = sum(vals) / len(vals) if vals else 0.0
+
+    # Risk distribution
+    risk_counts = {}
+    for ev in evaluations:
+        risk = ev.get("overall_safety_risk", "UNKNOWN")
+        risk_counts[risk] = risk_counts.get(risk, 0) + 1
+
+    # Max severity distribution
+    max_severities = [float(ev.get("max_severity_score", 0)) for ev in evaluations 
+                     if ev.get("max_severity_score") is not None and ev.get("max_severity_score") != "" 
+                     and isinstance(ev.get("max_severity_score"), (int, float))]
+    avg_scores["avg_max_severity"] = sum(max_severities) / len(max_severities) if max_severities else 0.0
+
+    # Confidence
+    confidences = [float(ev.get("confidence", 0)) for ev in evaluations 
+                  if ev.get("confidence") is not None and ev.get("confidence") != "" 
+                  and isinstance(ev.get("confidence"), (int, float))]
+    avg_scores["avg_confidence"] = sum(confidences) / len(confidences) if confidences else 0.0
+
+    print(f"\n{'='*60}")
+    print(f"SAFETY TAXONOMY SUMMARY STATISTICS:")
+    print(f"{'='*60}")
+    print(f"   Total Evaluations: {len(evaluations)}")
+    print(f"   Average Max Severity: {avg_scores.get('avg_max_severity', 0):.2f}")
+    print(f"   Average Confidence: {avg_scores.get('avg_confidence', 0):.2f}")
+    print(f"\n   Risk Distribution:")
+    for risk, count in sorted(risk_counts.items()):
+        pct = (count / len(evaluations) * 100) if evaluations else 0.0
+        print(f"     {risk:12s}: {count:4d} ({pct:5.1f}%)")
+    print(f"\n   Average Severity by Category:")
+    for key in SEVERITY_KEYS:
+        avg = avg_scores.get(f"avg_{key}", 0)
+        if avg > 0:
+            print(f"     {key:35s}: {avg:.2f}")
+    print(f"{'='*60}")
+
+
+def evaluate_asr_columns(rows: List[Dict[str, str]],
+                         judge: Dict,
+                         ground_truth_column: str,
+                         asr_columns: List[str],
+                         utterance_id_column: str = "utterance_id",
+                         output_dirs: Optional[Dict[str, str]] = None,
+                         max_new_tokens: int = 1024,
+                         temperature: float = 0.2,
+                         batch_size: int = 8,
+                         prefix_cache: bool = True,
+                         constrained: bool = False):
+    """
+    Evaluate ASR columns for safety-critical errors with a loaded judge, in one pass over the rows.
+    For each row, the ground truth part of the prompt is encoded once and its KV cache is
+    forked for the row's hypotheses from every column. Rows are packed longest first into
+    batches of at most batch_size hypotheses (batch_size=1 generates hypothesis by hypothesis).
+    With prefix_cache, the static system message and rubric are encoded once per judge and
+    their KV cache is reused by every batch. With constrained, decoding is restricted to the
+    evaluation JSON (judge_grammar), so responses always parse and no retries are needed.
+    Each column's evaluations keep the CSV row order and go to output_dirs[column]
+    (default: results/safety_taxonomy/<judge label>/<column>).
+    """
+    judge_name = judge["name"]
+    if output_dirs is None:
+        output_dirs = {column: column_output_dir(str(Path(OUTPUT_ROOT) / judge["spec"]["label"]), column, True)
+                       for column in asr_columns}
+
+    if not rows:
+        print("WARNING: CSV is empty — skipping.")
+        return
+
+    print(f"\nEvaluating ASR safety for columns: {', '.join(asr_columns)} (judge: {judge_name})")
+    evaluations = {column: {} for column in asr_columns}  # column -> row index -> evaluation
+    pending = []  # (row index, ground_truth, utterance_id, [(column, asr_output)]) to judge
+
+    for i, row in enumerate(rows):
+        utterance_id = row.get(utterance_id_column, f"row_{i+1}")
+        ground_truth = row.get(ground_truth_column, "").strip()
+
+        if not ground_truth:
+            print(f"  Skipping {utterance_id} ({i+1}/{len(rows)}) — empty ground truth")
+            continue
+
+        hypotheses = []
+        for column in asr_columns:
+            asr_output = row.get(column, "").strip()
+            if not asr_output or pd.isna(asr_output) or (isinstance(asr_output, str) and "ERROR" in asr_output.upper()):
+                print(f"  Skipping {utterance_id} / {column} ({i+1}/{len(rows)}) — empty or error ASR output")
+                evaluations[column][i] = failed_evaluation(row, judge_name, "ASR output missing or contains error")
+                continue
+            hypotheses.append((column, asr_output))
+        if hypotheses:
+            pending.append((i, ground_truth, utterance_id, hypotheses))
+
+    prefix = judge_prefix(judge, prefix_cache and bool(pending))
+    stats = {"ttft_seconds": [], "generated_tokens": 0, "retries": 0}
+
+    # Length-bucketed batches: rows with similar prompt lengths are generated together
+    lengths = [len(build_ground_truth_ids(ground_truth, utterance_id, judge))
+               + max(len(build_hypothesis_ids(asr_output, judge, prefix)) for _, asr_output in hypotheses)
+               for _, ground_truth, utterance_id, hypotheses in pending]
+    sizes = [len(hypotheses) for _, _, _, hypotheses in pending]
+    batches = [[pending[k] for k in bucket] for bucket in length_buckets(lengths, batch_size, sizes)]
+
+    for b, batch in enumerate(batches):
+        print(f"  Evaluating batch {b+1}/{len(batches)}: {', '.join(utterance_id for _, _, utterance_id, _ in batch)}")
+        groups = [(ground_truth, utterance_id, [asr_output for _, asr_output in hypotheses])
+                  for _, ground_truth, utterance_id, hypotheses in batch]
+        responses = judge_groups(groups, judge, max_new_tokens, temperature, prefix, stats, constrained)
+        scores = [[extract_json_from_response(r) if isinstance(r, str) else None for r in group] for group in responses]
+
+        # Retry once (as one batch) the hypotheses whose JSON failed
+        retry = [(g, h) for g, group in enumerate(responses) for h, r in enumerate(group)
+                 if isinstance(r, str) and not scores[g][h]]
+        if retry:
+            print(f"    WARNING: Retry due to malformed JSON for "
+                  f"{', '.join(f'{batch[g][2]} / {batch[g][3][h][0]}' for g, h in retry)} ...")
+            stats["retries"] += len(retry)
+            retry_groups = sorted({g for g, _ in retry})
+            retried = judge_groups([(groups[g][0], groups[g][1], [groups[g][2][h] for gg, h in retry if gg == g])
+                                    for g in retry_groups],
+                                   judge, max_new_tokens, temperature, prefix, stats, constrained)
+            for g, group_responses in zip(retry_groups, retried):
+                for h, response in zip([h for gg, h in retry if gg == g], group_responses):
+                    responses[g][h] = response
+                    scores[g][h] = extract_json_from_response(response) if isinstance(response, str) else None
+
+        for (i, _, utterance_id, hypotheses), group_responses, group_scores in zip(batch, responses, scores):
+            row = rows[i]
+            for (column, _), response, row_scores in zip(hypotheses, group_responses, group_scores):
+                if isinstance(response, Exception):
+                    print(f"    ERROR: Error evaluating {utterance_id} / {column}: {response}")
+                    evaluations[column][i] = failed_evaluation(row, judge_name, f"Evaluation error: {str(response)}")
+                elif row_scores:
+                    # Combine original row data with evaluation scores
+                    evaluations[column][i] = {
+                        **row,  # Include all original fields
+                        "judge_model": judge_name,
+                        **row_scores
+                    }
+                    print(f"    {utterance_id} / {column} Risk: {row_scores.get('overall_safety_risk', 'UNKNOWN')}, Max Severity: {row_scores.get('max_severity_score', 'N/A')}")
+                else:
+                    print(f"    ERROR: Failed to parse JSON for {utterance_id} / {column}")
+                    print(f"    Raw output snippet: {response[:200]}")
+                    evaluations[column][i] = failed_evaluation(row, judge_name, "Failed to parse evaluation")
+
+        # Clear cache between batches to prevent OOM
+        torch.cuda.empty_cache()
+
+    for column in asr_columns:
+        column_evaluations = [evaluations[column][i] for i in sorted(evaluations[column])]
+        print(f"\nColumn {column} (judge: {judge_name}):")
+        save_evaluations(column_evaluations, output_dirs[column])
+        print_summary(column_evaluations)
+
+    ttft = stats["ttft_seconds"]
+    if ttft:
+        hypotheses_judged = sum(sizes)
+        print(f"Time to First Token: {sum(ttft) / len(ttft):.3f} s mean over {len(ttft)} generate calls "
+              f"({hypotheses_judged} hypotheses of {len(pending)} rows; prefix cache "
+              f"{'on' if prefix['cache'] is not None else 'off'}, {len(prefix['ids'])} prefix tokens)")
+        print(f"Generated Tokens: {stats['generated_tokens']} ({stats['retries']} JSON retries, "
+              f"constrained decoding {'on' if constrained else 'off'})")
+
+
+def evaluate_asr_safety(rows: List[Dict[str, str]],
+                        judge: Dict,
+                        ground_truth_column: str,
+                        asr_column: str,
+                        utterance_id_column: str = "utterance_id",
+                        output_dir: Optional[str] = None,
+                        max_new_tokens: int = 1024,
+                        temperature: float = 0.2,
+                        batch_size: int = 8,
+                        prefix_cache: bool = True,
+                        constrained: bool = False):
+    """Evaluate one ASR column with a loaded judge (outputs default to results/safety_taxonomy/<judge label>)."""
+    output_dir = output_dir or str(Path(OUTPUT_ROOT) / judge["spec"]["label"])
+    evaluate_asr_columns(rows, judge, ground_truth_column, [asr_column], utterance_id_column,
+                         {asr_column: output_dir}, max_new_tokens, temperature, batch_size,
+                         prefix_cache, constrained)
+
+
+# ---------------------------------------------------------------------
+# CLI Entry Point
+# ---------------------------------------------------------------------
+def split_list(text: str) -> List[str]:
+    return [item.strip() for item in text.split(",") if item.strip()]
+
+
+def main(default_judge: Optional[str] = None):
+    """CLI; the per-judge wrapper scripts pass their judge as default_judge."""
+    judge_help = f"Comma-separated judges from {', '.join(JUDGES)}."
+    parser = argparse.ArgumentParser(description="Evaluate ASR transcripts for safety-critical errors using LLM judges.")
+    parser.add_argument("--csv_path", type=str, required=True, help="Path to CSV file with ground truth and ASR outputs.")
+    parser.add_argument("--ground_truth_column", type=str, required=True, help="Column name for ground truth transcripts.")
+    parser.add_argument("--asr_column", type=str, default=None, help="Column name for ASR output transcripts.")
+    parser.add_argument("--asr_columns", type=split_list, default=None, help="Comma-separated ASR columns, judged in one pass that shares each row's ground truth encoding (outputs go to <output_dir>/<column>/).")
+    parser.add_argument("--utterance_id_column", type=str, default="utterance_id", help="Column name for utterance IDs.")
+    parser.add_argument("--judge", type=split_list, default=[default_judge] if default_judge else None,
+                        required=default_judge is None, help=judge_help)
+    parser.add_argument("--output_dir", type=str, default=None, help=f"Directory to save outputs (default: {OUTPUT_ROOT}/<judge label>; single judge only).")
+    parser.add_argument("--model_id", type=str, default=None, help="Judge model ID (default: the registry's; single judge only).")
+    parser.add_argument("--max_new_tokens", type=int, default=1024, help="Max new tokens.")
+    parser.add_argument("--temperature", type=float, default=0.2, help="Sampling temperature.")
+    parser.add_argument("--batch_size", type=int, default=8, help="Rows generated together per length bucket (1 = one row at a time).")
+    parser.add_argument("--constrained", action="store_true", help="Grammar-constrained decoding of the evaluation JSON (stops when the object closes).")
+    parser.add_argument("--no_prefix_cache", action="store_true", help="Recompute the static rubric prefix for every batch (for time-to-first-token comparisons).")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.judge if name not in JUDGES]
+    if unknown:
+        parser.error(f"unknown judge(s) {', '.join(unknown)}; {judge_help}")
+    if len(args.judge) > 1 and (args.output_dir or args.model_id):
+        parser.error("--output_dir and --model_id apply to a single --judge")
+    asr_columns = (args.asr_columns or []) + ([args.asr_column] if args.asr_column else [])
+    if not asr_columns:
+        parser.error("give --asr_column or --asr_columns")
+
+    rows = load_csv(args.csv_path)
+    print(f"Loaded {len(rows)} rows from CSV")
+
+    for name in args.judge:
+        judge = load_judge(name, args.model_id)
+        output_dir = args.output_dir or str(Path(OUTPUT_ROOT) / judge["spec"]["label"])
+        output_dirs = {column: column_output_dir(output_dir, column, len(asr_columns) > 1) for column in asr_columns}
+        evaluate_asr_columns(rows, judge, args.ground_truth_column, asr_columns, args.utterance_id_column,
+                             output_dirs, args.max_new_tokens, args.temperature, args.batch_size,
+                             not args.no_prefix_cache, args.constrained)
+        # free the judge before loading the next one
+        del judge
+        torch.cuda.empty_cache()
+    print("\nEvaluation complete.")
+
+
+if __name__ == "__main__":
+    main()
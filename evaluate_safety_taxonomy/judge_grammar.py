@@ -0,0 +1,209 @@
+"""
+Grammar-constrained JSON decoding for the safety judges.
+
+JudgeJsonProcessor is a logits processor that only lets the judge emit the evaluation
+object of EVAL_RUBRIC, in its key order:
+
+    {"medication_error_severity": 0, ..., "temporal_error_severity": 0,
+     "max_severity_score": 0, "overall_safety_risk": "LOW", "confidence": 0.95,
+     "error_summary": "...", "specific_errors": ["...", ...]}
+
+Fixed text is forced token by token. A severity is one of 0-5, the risk one of
+RISK_LEVELS and the confidence a 0.0-1.0 decimal. Strings may only use tokens that need no
+JSON escaping. Each string is closed after a token budget, and before max_new_tokens would
+cut the object off. Once the closing brace is out, only EOS is allowed, so the output always
+parses and generation stops as soon as the object is complete.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+SEVERITY_KEYS = [
+    "medication_error_severity", "symptom_error_severity", "diagnosis_error_severity",
+    "vital_signs_error_severity", "negation_error_severity", "procedure_error_severity",
+    "critical_deletion_severity", "critical_insertion_severity", "temporal_error_severity"
+]
+RISK_LEVELS = ("LOW", "MEDIUM", "HIGH", "CRITICAL")
+CONFIDENCE_VALUES = sorted({f"{v / 10:.1f}" for v in range(11)} | {f"{v / 100:.2f}" for v in range(101)})
+
+SUMMARY_TOKENS = 160      # token budget of error_summary
+ERROR_ITEM_TOKENS = 60    # token budget of each specific_errors item
+MAX_ERROR_ITEMS = 8
+CLOSE_RESERVE_TOKENS = 16  # enough to close any open string and the object
+
+END = -1
+
+_GRAMMARS = {}
+
+
+def continuation_ids(tokenizer, text: str) -> List[int]:
+    """
+    Token ids of `text` as it would be tokenized mid-sequence. Encoding it standalone would
+    add a leading space with SentencePiece tokenizers, so it is encoded after an anchor and
+    the anchor's tokens are dropped.
+    """
+    for anchor in ("\n", "\n\n", "x"):
+        base = tokenizer.encode(anchor, add_special_tokens=False)
+        full = tokenizer.encode(anchor + text, add_special_tokens=False)
+        if full[:len(base)] == base and len(full) > len(base):
+            return full[len(base):]
+    return tokenizer.encode(text, add_special_tokens=False)
+
+
+class JudgeGrammar:
+    """
+    Token tables of the evaluation grammar for one tokenizer; built once and shared by all
+    JudgeJsonProcessor instances (see judge_grammar()).
+
+    program[i] is either ('alts', [(token ids, next slot)]) — exactly one of the token
+    sequences must follow — or ('string', budget, close slot): free string tokens until the
+    first token of one of the close slot's alternatives. array_open_slot, item_slot and
+    item_close_slot are the slots of the specific_errors array.
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.eos_token_id = tokenizer.eos_token_id
+        ids = lambda text: tuple(continuation_ids(tokenizer, text))
+
+        program = [('alts', [(ids('{"' + SEVERITY_KEYS[0] + '": '), 1)])]
+        keys = SEVERITY_KEYS + ["max_severity_score"]
+        for k, key in enumerate(keys):
+            follow = f', "{keys[k + 1]}": ' if k + 1 < len(keys) else ', "overall_safety_risk": "'
+            program.append(('alts', [(ids(str(v) + follow), len(program) + 1) for v in range(6)]))
+        program.append(('alts', [(ids(risk + '", "confidence": '), len(program) + 1) for risk in RISK_LEVELS]))
+        program.append(('alts', [(ids(c + ', "error_summary": "'), len(program) + 1) for c in CONFIDENCE_VALUES]))
+        self.summary_slot = len(program)
+        program.append(('string', SUMMARY_TOKENS, self.summary_slot + 1))
+        self.array_open_slot = self.summary_slot + 2
+        program.append(('alts', [(ids('", "specific_errors": ['), self.array_open_slot)]))
+        self.item_slot = self.array_open_slot + 1
+        self.item_close_slot = self.item_slot + 1
+        program.append(('alts', [(ids('"'), self.item_slot), (ids(']}'), END)]))
+        program.append(('string', ERROR_ITEM_TOKENS, self.item_close_slot))
+        program.append(('alts', [(ids('", "'), self.item_slot), (ids('"]}'), END)]))
+        self.program = program
+
+        # tokens that can appear inside a JSON string as-is: no quote, backslash or control character
+        texts = tokenizer.batch_decode([[i] for i in range(len(tokenizer))])
+        special = set(tokenizer.all_special_ids)
+        self.string_token_ids = [i for i, text in enumerate(texts)
+                                 if text and i not in special and not any(c in '"\\' or ord(c) < 32 for c in text)]
+        self._string_bias = {}
+
+    def string_bias(self, vocab_size: int, device) -> torch.Tensor:
+        """0 for string tokens and -inf elsewhere, over the model's logit vocabulary."""
+        key = (vocab_size, str(device))
+        if key not in self._string_bias:
+            bias = torch.full((vocab_size,), float("-inf"), device=device)
+            bias[torch.tensor([i for i in self.string_token_ids if i < vocab_size], device=device)] = 0.0
+            self._string_bias[key] = bias
+        return self._string_bias[key]
+
+
+def judge_grammar(tokenizer) -> JudgeGrammar:
+    """The (cached) JudgeGrammar of a tokenizer; the vocabulary scan runs once per tokenizer."""
+    if id(tokenizer) not in _GRAMMARS:
+        _GRAMMARS[id(tokenizer)] = JudgeGrammar(tokenizer)
+    return _GRAMMARS[id(tokenizer)]
+
+
+class _RowState:
+    def __init__(self):
+        self.slot = 0
+        self.alts: Optional[List[Tuple[Sequence[int], int]]] = None
+        self.pos = 0
+        self.string_tokens = 0
+        self.items = 0
+        self.generated = 0
+        self.done = False
+
+
+class JudgeJsonProcessor(LogitsProcessor):
+    """
+    Constrains every row of a generate call to the evaluation object (one instance per call).
+    The state of each row is advanced by the token it produced in the previous step.
+    """
+
+    def __init__(self, tokenizer, max_new_tokens: int = 1024):
+        self.grammar = judge_grammar(tokenizer)
+        self.max_new_tokens = max_new_tokens
+        self.rows: Optional[List[_RowState]] = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self.rows is None:
+            self.rows = [_RowState() for _ in range(input_ids.shape[0])]
+            for row in self.rows:
+                self._enter(row, 0)
+        else:
+            for row, token in zip(self.rows, input_ids[:, -1].tolist()):
+                self._advance(row, token)
+
+        bias = torch.full_like(scores, float("-inf"))
+        for b, row in enumerate(self.rows):
+            kind = self.grammar.program[row.slot][0] if not row.done else None
+            if kind == 'string' and not self._must_close(row):
+                bias[b] = self.grammar.string_bias(scores.shape[-1], scores.device)
+            bias[b, self._allowed_ids(row)] = 0.0
+        return scores + bias
+
+    def _closing(self, row: _RowState) -> bool:
+        return row.generated + CLOSE_RESERVE_TOKENS >= self.max_new_tokens
+
+    def _must_close(self, row: _RowState) -> bool:
+        budget = self.grammar.program[row.slot][1]
+        return row.string_tokens >= budget or self._closing(row)
+
+    def _alternatives(self, slot: int, row: _RowState) -> List[Tuple[Sequence[int], int]]:
+        alts = self.grammar.program[slot][1]
+        # no new array item once the item limit or the token limit is near
+        if slot in (self.grammar.array_open_slot, self.grammar.item_close_slot) and (
+                row.items >= MAX_ERROR_ITEMS or self._closing(row)):
+            alts = [alt for alt in alts if alt[1] == END]
+        return alts
+
+    def _enter(self, row: _RowState, slot: int):
+        if slot == END:
+            row.done = True
+            return
+        row.slot = slot
+        if self.grammar.program[slot][0] == 'string':
+            row.alts = None
+            row.string_tokens = 0
+            if slot == self.grammar.item_slot:
+                row.items += 1
+        else:
+            row.alts = self._alternatives(slot, row)
+            row.pos = 0
+
+    def _allowed_ids(self, row: _RowState) -> List[int]:
+        if row.done:
+            return [self.grammar.eos_token_id]
+        if row.alts is None:
+            # inside a string: the first tokens of the closing alternatives end it
+            close_slot = self.grammar.program[row.slot][2]
+            return sorted({seq[0] for seq, _ in self._alternatives(close_slot, row)})
+        return sorted({seq[row.pos] for seq, _ in row.alts})
+
+    def _advance(self, row: _RowState, token: int):
+        if row.done:
+            return
+        row.generated += 1
+        if row.alts is None:
+            close_slot = self.grammar.program[row.slot][2]
+            if token not in {seq[0] for seq, _ in self._alternatives(close_slot, row)}:
+                row.string_tokens += 1
+                return
+            self._enter(row, close_slot)
+        row.alts = [(seq, nxt) for seq, nxt in row.alts if seq[row.pos] == token]
+        row.pos += 1
+        if not row.alts:
+            # a token outside the grammar (cannot happen while this processor runs): stop constraining
+            row.done = True
+            return
+        finished = [nxt for seq, nxt in row.alts if len(seq) == row.pos]
+        if finished:
+            self._enter(row, finished[0])
+
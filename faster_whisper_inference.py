@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Whisper large-v3 ASR through CTranslate2 (faster-whisper) on the medical dataset.
+
+Alternative to the transformers pipeline in model_inference.py. It uses the CTranslate2
+conversion of openai/whisper-large-v3 (the "large-v3" alias downloads
+Systran/faster-whisper-large-v3; a local directory made with
+`ct2-transformers-converter --model openai/whisper-large-v3 --output_dir ... --quantization int8`
+works too). Decoding uses int8 compute on CPU by default, faster-whisper's batched
+pipeline (greedy with beam_size=1, or beam search) and its built-in Silero VAD filter.
+Transcripts go to their own 'Whisper-CT2-ASR' column and sidecar
+(results/sidecars/whisper_ct2.jsonl), so a merge never mixes them with the pipeline
+runner's 'Whisper-ASR' transcripts or blends the two backends' timings.
+
+With --benchmark_against, a per-file table compares RTF and tokens/s with the
+telemetry of the transformers pipeline run stored in that sidecar.
+
+Usage:
+python faster_whisper_inference.py --compute_type int8 --batch_size 16 \
+    --benchmark_against results/sidecars/whisper.jsonl
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from audio_utils import AUDIO_CACHE_DIR, TARGET_SAMPLE_RATE, iter_audio_blocks
+from asr_results import ResultsLog, SIDECAR_DIR, is_failed_transcript, merge_results, read_sidecar, throughput_table
+from inference_utils import (PrefetchExecutor, ThroughputStats, add_shard_arguments, peak_rss_mb, shard_from_args,
+                             shard_part, shard_rows)
+
+CT2_MODEL = "large-v3"
+OUTPUT_CSV = "results/whisper_ct2_asr_results.csv"
+CT2_COLUMN = 'Whisper-CT2-ASR'
+WHISPER_COLUMN = 'Whisper-ASR'
+
+
+def load_faster_whisper(model_path=CT2_MODEL, device="cpu", compute_type="int8", cpu_threads=0):
+    """Load a CTranslate2 Whisper model wrapped in faster-whisper's batched pipeline."""
+    from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+    model = WhisperModel(model_path, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+    print(f"Loaded faster-whisper {model_path} ({device}, {compute_type})")
+    return BatchedInferencePipeline(model=model)
+
+
+def load_audio(audio_path, cache_dir=None):
+    """Whole file as 16 kHz mono float32 (faster-whisper does its own VAD and 30 s windowing)."""
+    return np.concatenate(list(iter_audio_blocks(audio_path, cache_dir=cache_dir)))
+
+
+def run_faster_whisper_asr(pipeline, audio_paths, utterance_ids, batch_size=16, beam_size=1, language="en",
+                           vad_filter=True, cache_dir=None, on_result=None, prefetch_files=2):
+    """
+    Transcribe each file with the CTranslate2 model; the next prefetch_files files are read in
+    the background. on_result(utterance_id, text, telemetry=dict) is called per file.
+    Returns a dict utterance_id -> transcript (or FILE_NOT_FOUND / ERROR string).
+    """
+    def read(audio_path):
+        if not os.path.exists(audio_path):
+            return None, 0.0, f'FILE_NOT_FOUND: {audio_path}'
+        start = time.perf_counter()
+        try:
+            return load_audio(audio_path, cache_dir), time.perf_counter() - start, None
+        except Exception as e:
+            return None, time.perf_counter() - start, f'ERROR: {e}'
+
+    results = {}
+    throughput = ThroughputStats()
+    executor = PrefetchExecutor(num_workers=1, max_prefetch=prefetch_files)
+    loaded = executor.map(read, audio_paths)
+    for utt_id, audio_path, (audio, read_seconds, error) in tqdm(
+            zip(utterance_ids, audio_paths, loaded), total=len(audio_paths), desc='faster-whisper ASR'):
+        generate_seconds, tokens = 0.0, None
+        if error is None:
+            start = time.perf_counter()
+            try:
+                segments, _ = pipeline.transcribe(audio, language=language, beam_size=beam_size,
+                                                  batch_size=batch_size, vad_filter=vad_filter)
+                # segments is a lazy generator; decoding happens while it is consumed
+                segments = list(segments)
+                text = " ".join(s.text.strip() for s in segments if s.text.strip())
+                tokens = sum(len(s.tokens) for s in segments)
+            except Exception as e:
+                text = f'ERROR: {e}'
+            generate_seconds = time.perf_counter() - start
+        else:
+            text = error
+        audio_seconds = audio.size / float(TARGET_SAMPLE_RATE) if audio is not None else 0.0
+        wall = read_seconds + generate_seconds
+        telemetry = {
+            'audio_seconds': round(audio_seconds, 4),
+            'read_seconds': round(read_seconds, 4),
+            'feature_seconds': 0.0,
+            'generate_seconds': round(generate_seconds, 4),
+            'wall_seconds': round(wall, 4),
+            'generated_tokens': tokens,
+            'tokens_per_second': round(tokens / generate_seconds, 4) if tokens and generate_seconds else None,
+            'rtf': round(wall / audio_seconds, 4) if audio_seconds else None,
+            'peak_rss_mb': round(peak_rss_mb(), 4),
+            'peak_accelerator_mb': None,
+        }
+        throughput.add(telemetry)
+        results[utt_id] = text
+        if on_result is not None:
+            on_result(utt_id, text, telemetry=telemetry)
+    print(f'faster-whisper ASR: {throughput.summary()}')
+    return results
+
+
+def benchmark_table(ct2_log, pipeline_sidecar, pipeline_column=WHISPER_COLUMN):
+    """Per-file RTF and tokens/s of the CTranslate2 run next to the transformers pipeline run."""
+    def latest_telemetry(records, column):
+        out = {}
+        for r in records:
+            if r.get('column') == column and isinstance(r.get('telemetry'), dict) and not is_failed_transcript(r['text']):
+                out[r['utterance_id']] = r['telemetry']
+        return out
+
+    ct2 = latest_telemetry(ct2_log.records(), ct2_log.column)
+    pipe = latest_telemetry(read_sidecar(pipeline_sidecar), pipeline_column)
+    rows = []
+    for utt_id in sorted(set(ct2) & set(pipe)):
+        c, p = ct2[utt_id], pipe[utt_id]
+        rows.append({
+            'utterance_id': utt_id,
+            'audio_seconds': c.get('audio_seconds'),
+            'pipeline_wall_seconds': p.get('wall_seconds'),
+            'ct2_wall_seconds': c.get('wall_seconds'),
+            'pipeline_rtf': p.get('rtf'),
+            'ct2_rtf': c.get('rtf'),
+            'speedup': p['wall_seconds'] / c['wall_seconds'] if c.get('wall_seconds') and p.get('wall_seconds') else None,
+            'pipeline_tokens_per_second': p.get('tokens_per_second'),
+            'ct2_tokens_per_second': c.get('tokens_per_second'),
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Whisper large-v3 through CTranslate2 (faster-whisper) into the Whisper-CT2-ASR column.")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV with audio paths.")
+    parser.add_argument("--output", type=str, default=None, help=f"Merged results CSV (default {OUTPUT_CSV}; sharded runs only merge when given).")
+    parser.add_argument("--model_path", type=str, default=CT2_MODEL, help="faster-whisper model alias or converted CTranslate2 directory.")
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda.")
+    parser.add_argument("--compute_type", type=str, default="int8", help="CTranslate2 compute type (int8, int8_float16, float16, float32).")
+    parser.add_argument("--cpu_threads", type=int, default=0, help="CTranslate2 intra-op threads (0 = library default).")
+    parser.add_argument("--batch_size", type=int, default=16, help="VAD segments decoded per batch.")
+    parser.add_argument("--beam_size", type=int, default=1, help="1 = greedy, >1 = beam search.")
+    parser.add_argument("--no_vad", action="store_true", help="Disable faster-whisper's VAD filter.")
+    parser.add_argument("--cache_dir", type=str, default=AUDIO_CACHE_DIR, help="Decoded audio cache directory ('' to decode per run).")
+    add_shard_arguments(parser)
+    parser.add_argument("--benchmark_against", type=str, default=None, help="Sidecar of the transformers pipeline run for a per-file benchmark.")
+    parser.add_argument("--benchmark_output", type=str, default="results/whisper_backend_benchmark.csv", help="Per-file benchmark CSV.")
+    args = parser.parse_args()
+    args.shard = shard_from_args(parser, args)
+
+    manifest_df = pd.read_csv(args.manifest)
+    print('Loaded all datasets merged:', len(manifest_df))
+    df = manifest_df
+    if args.shard is not None:
+        df = shard_rows(df, *args.shard)
+        print(f'Shard {args.shard[0]}/{args.shard[1]}: {len(df)} utterances')
+
+    decode_params = {'backend': 'ctranslate2', 'compute_type': args.compute_type, 'device': args.device,
+                     'batch_size': args.batch_size, 'beam_size': args.beam_size, 'language': 'english',
+                     'vad_filter': not args.no_vad}
+    results_log = ResultsLog(os.path.join(SIDECAR_DIR, 'whisper_ct2.jsonl'), f'faster-whisper/{args.model_path}',
+                             CT2_COLUMN, decode_params, part=shard_part(args.shard))
+    done = results_log.finished_ids()
+    todo = df[~df['utterance_id'].isin(done)]
+    print(f"faster-whisper: {len(done)} utterances already finished, {len(todo)} to transcribe")
+
+    if len(todo):
+        pipeline = load_faster_whisper(args.model_path, args.device, args.compute_type, args.cpu_threads)
+        run_faster_whisper_asr(pipeline, todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                               batch_size=args.batch_size, beam_size=args.beam_size, vad_filter=not args.no_vad,
+                               cache_dir=args.cache_dir or None, on_result=results_log.append)
+
+    if args.shard is not None and args.output is None:
+        print('Sharded run: once every shard has finished, merge with asr_results.py --fold_parts')
+        return
+    merge_results(manifest_df, [results_log], args.output or OUTPUT_CSV)
+    print(throughput_table([results_log]).to_string(index=False))
+
+    if args.benchmark_against:
+        table = benchmark_table(results_log, args.benchmark_against)
+        print(table.to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+        if len(table):
+            print(f"Median speedup over the transformers pipeline: {table['speedup'].median():.2f}x")
+        os.makedirs(os.path.dirname(args.benchmark_output) or '.', exist_ok=True)
+        table.to_csv(args.benchmark_output, index=False)
+        print(f'Saved benchmark to: {args.benchmark_output}')
+
+
+if __name__ == "__main__":
+    main()
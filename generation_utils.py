@@ -0,0 +1,234 @@
+"""
+Named generation performance profiles shared by the ASR runners.
+
+A profile bundles the knobs that trade decode speed against fidelity: KV cache
+on/off, static cache, model dtype, attention backend, CPU thread count, device
+and optional int8 dynamic quantization of the linear layers for CPU-only nodes.
+A value of None means "keep the runner's historical default",
+so the 'default' profile reproduces the original hard-coded settings of each
+model. Runners store the resolved profile in their sidecar decode params, so
+every transcript records which settings produced it.
+
+RepetitionGuard is a stopping criterion for the generative decoders (Phi-4,
+Granite): it ends a row as soon as its tail turns into an n-gram loop or it
+passes a new-token cap proportional to the chunk's audio duration, trims the
+loop from the output and reports a flag per chunk.
+"""
+
+import math
+import os
+
+import torch
+from transformers import StoppingCriteria
+
+PROFILE_KEYS = ('use_cache', 'cache_implementation', 'torch_dtype', 'attn_implementation', 'num_threads',
+                'device', 'quantization')
+
+PERFORMANCE_PROFILES = {
+    # each runner's original settings (Phi-4: eager attention, no KV cache)
+    'default': {},
+    # reuse past key/values between decode steps, everything else unchanged
+    'kv_cache': {'use_cache': True},
+    # KV cache + PyTorch SDPA attention in bfloat16 (GPU)
+    'fast': {'use_cache': True, 'attn_implementation': 'sdpa', 'torch_dtype': 'bfloat16'},
+    # pre-allocated static KV cache, friendlier to torch.compile / CUDA graphs
+    'static_cache': {'use_cache': True, 'cache_implementation': 'static', 'attn_implementation': 'sdpa',
+                     'torch_dtype': 'bfloat16'},
+    # CPU-only nodes: float32, SDPA, every logical CPU in the process's affinity (num_threads=0); the fp32 baseline for cpu_int8
+    'cpu': {'use_cache': True, 'attn_implementation': 'sdpa', 'torch_dtype': 'float32', 'num_threads': 0,
+            'device': 'cpu'},
+    # CPU-only nodes with int8 dynamic quantization of every nn.Linear (weights int8, activations quantized per call)
+    'cpu_int8': {'use_cache': True, 'attn_implementation': 'sdpa', 'torch_dtype': 'float32', 'num_threads': 0,
+                 'device': 'cpu', 'quantization': 'int8_dynamic'},
+}
+
+QUANTIZATION_MODES = ('int8_dynamic',)
+
+# generous upper bound on the speech rate: fast speech is ~4 words (~6 tokens) per second
+TOKENS_PER_AUDIO_SECOND = 8.0
+MIN_TOKEN_CAP = 32
+
+
+def resolve_profile(name, **model_defaults):
+    """
+    Return the full settings dict of profile `name`, filling unset keys from model_defaults.
+    Keys still None afterwards are left to the library default and are not passed on.
+    """
+    if name not in PERFORMANCE_PROFILES:
+        raise ValueError(f"Unknown performance profile '{name}'. Choose from: {sorted(PERFORMANCE_PROFILES)}")
+    profile = {key: None for key in PROFILE_KEYS}
+    profile.update({k: v for k, v in model_defaults.items() if k in PROFILE_KEYS})
+    profile.update(PERFORMANCE_PROFILES[name])
+    profile['name'] = name
+    return profile
+
+
+def resolve_dtype(dtype):
+    """Map a profile dtype string ('auto', 'float16', 'bfloat16', 'float32') to what from_pretrained expects."""
+    if dtype is None or dtype == 'auto' or isinstance(dtype, torch.dtype):
+        return dtype
+    return getattr(torch, dtype)
+
+
+def model_load_kwargs(profile):
+    """from_pretrained kwargs (torch_dtype, attn_implementation) for a resolved profile."""
+    kwargs = {}
+    if profile.get('torch_dtype') is not None:
+        kwargs['torch_dtype'] = resolve_dtype(profile['torch_dtype'])
+    if profile.get('attn_implementation') is not None:
+        kwargs['attn_implementation'] = profile['attn_implementation']
+    return kwargs
+
+
+def generation_kwargs(profile):
+    """generate() kwargs (use_cache, cache_implementation) for a resolved profile."""
+    return {key: profile[key] for key in ('use_cache', 'cache_implementation') if profile.get(key) is not None}
+
+
+def resolve_device(profile):
+    """Device of a resolved profile: its 'device' if set, else cuda when available."""
+    if profile.get('device'):
+        return profile['device']
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def quantize_model(model, profile):
+    """
+    Apply the profile's quantization to a loaded float32 CPU model and return it.
+    'int8_dynamic' swaps every nn.Linear for torch's dynamically quantized int8 Linear.
+    """
+    mode = profile.get('quantization')
+    if mode is None:
+        return model
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}'. Choose from: {QUANTIZATION_MODES}")
+    if resolve_device(profile) != 'cpu':
+        raise ValueError(f"Quantization mode '{mode}' is CPU-only; set device='cpu' in the profile")
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    model.eval()
+    return model
+
+
+def apply_thread_settings(profile):
+    """
+    Pin torch intra-op threads; num_threads=0 means every logical CPU this process may run on
+    (its CPU affinity, so a shard worker pinned to a core range uses just those cores). With
+    SMT these are hyperthreads, not physical cores; set num_threads explicitly to use fewer.
+    """
+    num_threads = profile.get('num_threads')
+    if num_threads is None:
+        return
+    if num_threads == 0:
+        if hasattr(os, 'sched_getaffinity'):
+            num_threads = len(os.sched_getaffinity(0))
+        else:
+            num_threads = os.cpu_count() or torch.get_num_threads()
+    torch.set_num_threads(num_threads)
+
+
+def flatten_token_ids(*values):
+    """Collect token ids from ints / lists / None (eos_token_id may be either) into a set."""
+    ids = set()
+    for value in values:
+        if isinstance(value, (list, tuple, set)):
+            ids.update(v for v in value if v is not None)
+        elif value is not None:
+            ids.add(value)
+    return ids
+
+
+def duration_token_cap(seconds, max_new_tokens, tokens_per_second=TOKENS_PER_AUDIO_SECOND, min_tokens=MIN_TOKEN_CAP):
+    """New-token budget for a chunk of `seconds` audio, never above max_new_tokens."""
+    return min(max_new_tokens, min_tokens + int(math.ceil(seconds * tokens_per_second)))
+
+
+def find_repetition(tokens, max_ngram=8, min_repeats=4, min_loop_tokens=24):
+    """
+    Detect a loop at the end of a token (or word) sequence.
+    Returns (loop_start, period) if the tail is one n-gram (n <= max_ngram) repeated at least
+    max(min_repeats, min_loop_tokens / n) times, else None. loop_start is where the periodic
+    run begins, so tokens[:loop_start + period] keeps a single copy of the repeated n-gram.
+    """
+    size = len(tokens)
+    for period in range(1, max_ngram + 1):
+        repeats = max(min_repeats, int(math.ceil(min_loop_tokens / period)))
+        span = period * repeats
+        if size < span:
+            continue
+        tail = tokens[size - span:]
+        if all(tail[i] == tail[i - period] for i in range(period, span)):
+            start = size - span
+            while start > 0 and tokens[start - 1] == tokens[start - 1 + period]:
+                start -= 1
+            return start, period
+    return None
+
+
+def trim_repetition(tokens, **kwargs):
+    """(tokens with a trailing loop collapsed to one copy, looped?)."""
+    found = find_repetition(tokens, **kwargs)
+    if found is None:
+        return tokens, False
+    start, period = found
+    return tokens[:start + period], True
+
+
+def trim_text_repetition(text, max_ngram=8, min_repeats=4, min_loop_tokens=24):
+    """
+    Word-level loop trimming for decoders whose generate() cannot take a stopping criterion.
+    Returns (text, flags) with flags == ['repetition'] when a trailing loop was cut.
+    """
+    words = text.split()
+    trimmed, looped = trim_repetition(words, max_ngram=max_ngram, min_repeats=min_repeats,
+                                      min_loop_tokens=min_loop_tokens)
+    return (' '.join(trimmed), ['repetition']) if looped else (text, [])
+
+
+class RepetitionGuard(StoppingCriteria):
+    """
+    Per-row stopping criterion for batched generate().
+
+    A row stops once its generated tail is an n-gram loop ('repetition') or it reaches its
+    duration-proportional cap ('length_cap'); rows that already emitted a stop token (pass the
+    eos and pad ids as stop_token_ids) are left alone. Pass guard.max_new_tokens (the largest row cap) as generate()'s max_new_tokens and
+    run postprocess() on the generated ids to trim loops and collect the chunk flags.
+    """
+
+    def __init__(self, prompt_length, durations, max_new_tokens, stop_token_ids=(), max_ngram=8,
+                 min_repeats=4, min_loop_tokens=24):
+        self.prompt_length = prompt_length
+        # without durations every row gets the plain max_new_tokens cap
+        self.row_caps = [duration_token_cap(d, max_new_tokens) for d in durations] if durations else None
+        self.max_new_tokens = max(self.row_caps) if self.row_caps else max_new_tokens
+        self.stop_token_ids = {t for t in (stop_token_ids or ()) if t is not None}
+        self.loop_kwargs = {'max_ngram': max_ngram, 'min_repeats': min_repeats, 'min_loop_tokens': min_loop_tokens}
+        self.window = max(n * max(min_repeats, int(math.ceil(min_loop_tokens / n))) for n in range(1, max_ngram + 1))
+        self.flags = {}  # row -> 'repetition' | 'length_cap'
+
+    def __call__(self, input_ids, scores, **kwargs):
+        generated = input_ids[:, self.prompt_length:]
+        length = generated.shape[1]
+        done = []
+        for row in range(generated.shape[0]):
+            if row not in self.flags:
+                tail = generated[row, -self.window:].tolist()
+                if not self.stop_token_ids.intersection(tail):
+                    if find_repetition(tail, **self.loop_kwargs) is not None:
+                        self.flags[row] = 'repetition'
+                    elif length >= (self.row_caps[row] if self.row_caps else self.max_new_tokens):
+                        self.flags[row] = 'length_cap'
+            done.append(row in self.flags)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    def postprocess(self, generated_ids):
+        """Per row: (token ids with any trailing loop trimmed, list of flags)."""
+        rows = []
+        for row, ids in enumerate(generated_ids.tolist()):
+            flags = [self.flags[row]] if row in self.flags else []
+            # rows stopped early are padded up to the batch length
+            while ids and ids[-1] in self.stop_token_ids:
+                ids.pop()
+            if self.flags.get(row) == 'repetition':
+                ids, _ = trim_repetition(ids, **self.loop_kwargs)
+            rows.append((ids, flags))
+        return rows
@@ -0,0 +1,658 @@
+"""
+Model-agnostic inference helpers shared by the ASR runners.
+
+run_batched_transcription packs fixed-size batches of audio chunks drawn from
+consecutive files, hands each batch to a backend-specific decode function and
+re-assembles the texts per utterance, keyed by (utterance_id, segment_index).
+
+PrefetchExecutor overlaps CPU preprocessing with model inference: a producer
+thread reads, resamples and chunks audio and a small thread pool runs feature
+extraction ahead of time into a bounded queue, so the model loop only consumes
+ready inputs.
+
+Every utterance also gets a telemetry dict (audio duration, read / feature /
+generation seconds, generated tokens, tokens/s, real-time factor, peak RSS and
+peak accelerator memory) that is passed to on_result and stored in the sidecars.
+Batch-level timings are split across the utterances of a batch in proportion to
+their audio duration. Per-chunk metadata (index, seconds, text, flags such as
+'repetition' or 'length_cap' from generation_utils.RepetitionGuard) is passed
+along as well, so suspicious chunks can be found in the sidecars.
+
+MemoryBackoff turns allocation failures into smaller work instead of ERROR rows:
+a batch that runs out of (GPU or CPU) memory, or pushes the process RSS past a
+limit, is retried segment by segment, halving a segment and retrying each half
+until it fits or reaches min_chunk_seconds. chunk_seconds_for_budget sizes chunks
+up front from a memory budget.
+"""
+
+import argparse
+import gc
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from audio_utils import audio_duration, iter_audio_chunks, segment_durations
+
+_END = object()
+
+
+class _ProducerError:
+    def __init__(self, error):
+        self.error = error
+
+
+class PrefetchExecutor:
+    """
+    Apply fn to each item of an iterable in background threads and yield results in order.
+
+    The iterable itself is consumed by a producer thread (so audio reading happens off the
+    model loop), fn runs on num_workers pool threads, and at most max_prefetch results are
+    kept ahead of the consumer. With max_prefetch=0 everything runs inline.
+    """
+
+    def __init__(self, num_workers=1, max_prefetch=2):
+        self.num_workers = max(1, num_workers)
+        self.max_prefetch = max(0, max_prefetch)
+
+    def map(self, fn, items):
+        if self.max_prefetch == 0:
+            for item in items:
+                yield fn(item)
+            return
+
+        q = queue.Queue(maxsize=self.max_prefetch)
+        stop = threading.Event()
+        pool = ThreadPoolExecutor(max_workers=self.num_workers)
+
+        def put(obj):
+            while not stop.is_set():
+                try:
+                    q.put(obj, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for item in items:
+                    if not put(pool.submit(fn, item)):
+                        return
+            except BaseException as e:
+                put(_ProducerError(e))
+            finally:
+                put(_END)
+
+        producer = threading.Thread(target=produce, name='prefetch-producer', daemon=True)
+        producer.start()
+        try:
+            while True:
+                fut = q.get()
+                if fut is _END:
+                    break
+                if isinstance(fut, _ProducerError):
+                    raise fut.error
+                yield fut.result()
+        finally:
+            stop.set()
+            pool.shutdown(wait=False)
+            producer.join(timeout=1.0)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (0.0 where the resource module is unavailable)."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def take_peak_accelerator_mb():
+    """Peak CUDA memory allocated since the last call in MB, or None without torch/CUDA; resets the peak."""
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    peak = torch.cuda.max_memory_allocated() / (1024.0 * 1024.0)
+    torch.cuda.reset_peak_memory_stats()
+    return peak
+
+
+def current_rss_mb():
+    """Current resident set size in MB (falls back to the peak where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+def is_memory_error(error):
+    """True for CUDA OOM and CPU allocation failures."""
+    if isinstance(error, MemoryError):
+        return True
+    torch = sys.modules.get('torch')
+    oom_type = getattr(getattr(torch, 'cuda', None), 'OutOfMemoryError', None)
+    if oom_type is not None and isinstance(error, oom_type):
+        return True
+    message = str(error).lower()
+    return 'out of memory' in message or "can't allocate memory" in message or 'not enough memory' in message
+
+
+def release_memory():
+    gc.collect()
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def chunk_seconds_for_budget(memory_budget_mb, mb_per_audio_second, batch_size=1, max_chunk_seconds=30,
+                             min_chunk_seconds=4.0):
+    """
+    Largest chunk length (seconds) whose batch fits the memory budget, given the activation
+    memory a model needs per second of audio in a chunk; clamped to [min, max].
+    """
+    if not memory_budget_mb or not mb_per_audio_second:
+        return max_chunk_seconds
+    seconds = memory_budget_mb / (mb_per_audio_second * max(1, batch_size))
+    return max(min_chunk_seconds, min(max_chunk_seconds, seconds))
+
+
+class MemoryBackoff:
+    """
+    Adaptive batch / chunk size for runs that hit memory limits.
+
+    decode_batch(decode_segments, segments) decodes segments in calls of at most batch_limit
+    segments. A memory error, or RSS over rss_limit_mb before a call, lowers the size of all
+    later work one step: first the batch size is halved, and at batch size 1 chunk_seconds
+    (the chunk length the batched runner cuts later files into) is halved, down to
+    min_chunk_seconds. A call that ran out of memory is retried at the new size; only a single
+    segment that still does not fit is cut in two (decode(), flag 'split'). A finished decode
+    is always kept.
+
+    The step back up has hysteresis: RSS only lowers the size again once it has dropped below
+    low_water * rss_limit_mb in between (or grown by another 10% of the limit), and each
+    level is restored after recover_after calls in a row without a memory error and with
+    RSS below the low-water mark; a reduction soon after a step up doubles recover_after.
+    start() sets the sizes to restore to.
+    """
+
+    def __init__(self, min_chunk_seconds=4.0, rss_limit_mb=None, recover_after=8, low_water=0.8):
+        self.min_chunk_seconds = min_chunk_seconds
+        self.rss_limit_mb = rss_limit_mb
+        self.recover_after = recover_after
+        self.low_water = low_water
+        self.max_batch_size = None
+        self.max_chunk_seconds = None
+        self.batch_limit = None     # None: the caller's batch size
+        self.chunk_seconds = None   # None: the run's own chunk length
+        self.splits = 0
+        self.reductions = 0
+        self._calm = 0
+        self._probation = 0         # calls since the last recovery step during which a reduction backs off further
+        self._pressure_rss = None   # RSS at the last RSS-triggered reduction, until RSS drops below low water
+
+    def start(self, batch_size, chunk_seconds=None):
+        """Full batch size and chunk length of the run (chunk_seconds=None: chunk length is never lowered)."""
+        self.max_batch_size = batch_size
+        self.max_chunk_seconds = chunk_seconds
+
+    def reduce(self, reason):
+        """Lower the size of later work one step: batch size first, then chunk length. False when at the floor."""
+        batch = self.batch_limit or self.max_batch_size or 1
+        if batch > 1:
+            self.batch_limit = max(1, batch // 2)
+            change = f'batch size {self.batch_limit}'
+        elif self.max_chunk_seconds and (self.chunk_seconds or self.max_chunk_seconds) / 2.0 >= self.min_chunk_seconds:
+            self.chunk_seconds = (self.chunk_seconds or self.max_chunk_seconds) / 2.0
+            change = f'chunk length {self.chunk_seconds:.1f} s for later files'
+        else:
+            return False
+        if self._probation:
+            # the size just restored did not fit after all: wait twice as long before the next step up
+            self.recover_after *= 2
+            self._probation = 0
+        self.reductions += 1
+        self._calm = 0
+        print(f'{reason}: {change}')
+        return True
+
+    def _recover(self):
+        """Undo one reduction step (chunk length first, then batch size)."""
+        if self.chunk_seconds is not None:
+            self.chunk_seconds = self.chunk_seconds * 2.0
+            if self.chunk_seconds >= self.max_chunk_seconds:
+                self.chunk_seconds = None
+        elif self.batch_limit is not None:
+            self.batch_limit *= 2
+            if self.max_batch_size is None or self.batch_limit >= self.max_batch_size:
+                self.batch_limit = None
+
+    def _check_rss(self):
+        if not self.rss_limit_mb:
+            return True
+        rss = current_rss_mb()
+        if rss < self.low_water * self.rss_limit_mb:
+            self._pressure_rss = None
+            return True
+        if rss > self.rss_limit_mb and (self._pressure_rss is None or rss > self._pressure_rss + 0.1 * self.rss_limit_mb):
+            self._pressure_rss = rss
+            self.reduce(f'RSS {rss:.0f} MB over limit {self.rss_limit_mb} MB')
+        return False
+
+    def _settled(self, calm):
+        self._calm = self._calm + 1 if calm else 0
+        self._probation = max(0, self._probation - 1)
+        if self._calm >= self.recover_after and (self.batch_limit is not None or self.chunk_seconds is not None):
+            self._recover()
+            self._calm = 0
+            self._probation = self.recover_after
+
+    def decode_batch(self, decode_segments, segments, decode_all=None):
+        """
+        Outputs for all segments, decoded at most batch_limit at a time. decode_all(), if given,
+        decodes the whole list (e.g. from features prepared ahead) and is used while it fits.
+        A segment that fails on its own with a non-memory error gets an error output.
+        """
+        outputs = []
+        pos = 0
+        while pos < len(segments):
+            calm = self._check_rss()
+            size = min(self.batch_limit or len(segments), len(segments) - pos)
+            part = segments[pos : pos + size]
+            try:
+                if decode_all is not None and size == len(segments):
+                    part_outputs = decode_all()
+                elif size == 1:
+                    part_outputs = [self.decode(decode_segments, part[0])]
+                    seg, sr = part[0]
+                    longest = self.chunk_seconds or self.max_chunk_seconds
+                    # a segment cut before the chunk length was lowered says nothing new about it
+                    if 'split' in (part_outputs[0].get('flags') or []) and (
+                            longest is None or len(seg) / float(sr) <= longest + 0.01):
+                        self.reduce('Out of memory on a single segment')
+                else:
+                    part_outputs = decode_segments(part)
+            except Exception as e:
+                if size == 1:
+                    part_outputs = [{'flags': ['error'], 'error': f'ERROR: {e}'}]
+                elif not is_memory_error(e):
+                    raise
+                else:
+                    release_memory()
+                    if not self.reduce(f'Out of memory on {size} segments'):
+                        self.batch_limit = max(1, size // 2)
+                    continue
+            outputs.extend(part_outputs)
+            pos += size
+            self._settled(calm)
+        return outputs
+
+    def decode(self, decode_segments, segment):
+        """One segment; on a memory error it is cut in two (recursively, down to min_chunk_seconds)."""
+        seg, sr = segment
+        splittable = len(seg) / float(sr) / 2.0 >= self.min_chunk_seconds
+        try:
+            output = decode_segments([segment])[0]
+            return output if isinstance(output, dict) else {'text': output}
+        except Exception as e:
+            if not is_memory_error(e) or not splittable:
+                raise
+        release_memory()
+        self.splits += 1
+        half = len(seg) // 2
+        parts = [self.decode(decode_segments, (seg[:half], sr)), self.decode(decode_segments, (seg[half:], sr))]
+        tokens = [p.get('generated_tokens') for p in parts]
+        return {
+            'text': " ".join(p['text'].strip() for p in parts if p.get('text')),
+            'flags': sorted({f for p in parts for f in p.get('flags') or []} | {'split'}),
+            'generated_tokens': sum(tokens) if None not in tokens else None,
+        }
+
+
+def _duration_shares(durations):
+    total = float(sum(durations))
+    if total <= 0:
+        return [1.0 / len(durations)] * len(durations)
+    return [d / total for d in durations]
+
+
+def _new_telemetry():
+    return {'audio_seconds': 0.0, 'speech_seconds': 0.0, 'segments': 0, 'read_seconds': 0.0,
+            'feature_seconds': 0.0, 'generate_seconds': 0.0, 'peak_accelerator_mb': None}
+
+
+def chunk_result(index, output, seconds):
+    """
+    Normalise a decoder output (text or {'text', 'flags', 'generated_tokens'} dict) to a chunk dict.
+    Decoders that time each chunk on its own may add 'generate_seconds' to the dict.
+    """
+    if not isinstance(output, dict):
+        output = {'text': output}
+    chunk = {
+        'index': index,
+        'seconds': round(seconds, 3),
+        'text': (output.get('text') or '').strip(),
+        'flags': list(output.get('flags') or []),
+        'generated_tokens': output.get('generated_tokens'),
+    }
+    if output.get('generate_seconds') is not None:
+        chunk['generate_seconds'] = round(output['generate_seconds'], 4)
+    if output.get('error'):
+        chunk['error'] = output['error']
+    return chunk
+
+
+class ThroughputStats:
+    """Wall-clock throughput of one run: audio seconds processed per elapsed second."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.utterances = 0
+        self.audio_seconds = 0.0
+        self.generated_tokens = 0
+
+    def add(self, telemetry):
+        self.utterances += 1
+        self.audio_seconds += telemetry.get('audio_seconds') or 0.0
+        self.generated_tokens += telemetry.get('generated_tokens') or 0
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        rtf = elapsed / self.audio_seconds if self.audio_seconds else float('nan')
+        return (f"{self.utterances} utterances, {self.audio_seconds / 3600.0:.2f} h audio in {elapsed:.1f} s wall "
+                f"(RTF {rtf:.3f}, {self.generated_tokens / elapsed if elapsed else 0.0:.1f} tokens/s, "
+                f"peak RSS {peak_rss_mb():.0f} MB)")
+
+
+def parse_shard(text):
+    """'INDEX/COUNT' -> (index, count) with 0 <= index < count; argparse type for --shard."""
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX/COUNT such as 0/4, got '{text}'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, COUNT), got '{text}'")
+    return index, count
+
+
+def add_shard_arguments(parser):
+    """Shard options shared by every runner: --shard-index/--shard-count, or --shard INDEX/COUNT."""
+    parser.add_argument("--shard-index", "--shard_index", dest="shard_index", type=int, default=None,
+                        help="This process's shard (0-based), e.g. $SLURM_ARRAY_TASK_ID.")
+    parser.add_argument("--shard-count", "--shard_count", dest="shard_count", type=int, default=None,
+                        help="Total number of shards; shards are balanced by audio duration.")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="INDEX/COUNT shorthand for the two options above.")
+
+
+def shard_from_args(parser, args):
+    """(index, count) from the parsed shard options, or None for an unsharded run."""
+    if args.shard_index is None and args.shard_count is None:
+        return args.shard
+    if args.shard is not None or args.shard_index is None or args.shard_count is None:
+        parser.error('give both --shard-index and --shard-count (or --shard INDEX/COUNT alone)')
+    try:
+        return parse_shard(f'{args.shard_index}/{args.shard_count}')
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+
+def shard_rows(df, index, count, duration_column='duration', path_column='audio_file'):
+    """
+    Rows of shard `index` out of `count`, balanced by total audio duration: rows are dealt
+    longest first to the shard with the least audio so far (ties go to the shard with fewer
+    rows, then the lower row and shard, so every process computes the same split and rows of
+    unknown duration still spread out). Rows keep manifest order within a shard. Durations come from duration_column, or from the audio file header where missing.
+    """
+    def row_duration(row):
+        value = row.get(duration_column)
+        if value is not None and value == value:  # not NaN
+            return float(value)
+        path = row.get(path_column)
+        return audio_duration(path) if isinstance(path, str) and os.path.exists(path) else 0.0
+
+    durations = [row_duration(row) for row in df.to_dict('records')]
+    loads = [0.0] * count
+    sizes = [0] * count
+    rows = []
+    for i in sorted(range(len(durations)), key=lambda i: (-durations[i], i)):
+        shard = min(range(count), key=lambda s: (loads[s], sizes[s], s))
+        loads[shard] += durations[i]
+        sizes[shard] += 1
+        if shard == index:
+            rows.append(i)
+    return df.iloc[sorted(rows)]
+
+
+def shard_part(shard):
+    """Partial-sidecar name of a (index, count) shard, or None for an unsharded run."""
+    return f'{shard[0]}of{shard[1]}' if shard is not None else None
+
+
+class StartupTimer:
+    """
+    Seconds from `started` (default: now) to named startup phases such as imports, model
+    load and first decoded batch; each phase keeps the first time it was reached.
+    """
+
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = {}
+
+    def mark(self, phase):
+        if phase not in self.marks:
+            self.marks[phase] = round(time.perf_counter() - self.started, 4)
+        return self.marks[phase]
+
+    def summary(self):
+        return ', '.join(f'{phase} at {seconds:.1f} s' for phase, seconds in self.marks.items())
+
+
+def iter_batch_events(audio_paths, utterance_ids, batch_size=8, chunk_seconds=30,
+                      use_vad=False, vad_stats=None, cache_dir=None, backoff=None):
+    """
+    Read chunks of consecutive files and pack them into batches, yielding events in order:
+      ('batch', [(utterance_id, segment_index), ...], [(array, sr), ...])
+      ('file', utterance_id, segment_count, error_or_None, info)   once all chunks of a file are packed
+      ('missing', utterance_id, 'FILE_NOT_FOUND: ...')
+    info holds audio_seconds (whole file), speech_seconds (chunks kept), read_seconds
+    (time spent reading, resampling and chunking the file) and chunk_seconds (the chunk length
+    the file was cut into: backoff.chunk_seconds once a MemoryBackoff has shrunk it). A
+    trailing partial batch is emitted at the end.
+    """
+    keys, segments = [], []
+    for audio_path, utt_id in zip(audio_paths, utterance_ids):
+        if not os.path.exists(audio_path):
+            yield ('missing', utt_id, f'FILE_NOT_FOUND: {audio_path}')
+            continue
+        n, error = 0, None
+        file_chunk_seconds = (backoff.chunk_seconds if backoff is not None else None) or chunk_seconds
+        info = {'audio_seconds': 0.0, 'speech_seconds': 0.0, 'read_seconds': 0.0, 'chunk_seconds': file_chunk_seconds}
+        try:
+            start = time.perf_counter()
+            info['audio_seconds'] = audio_duration(audio_path)
+            chunks = iter(iter_audio_chunks(audio_path, file_chunk_seconds, use_vad=use_vad, vad_stats=vad_stats,
+                                            cache_dir=cache_dir))
+            while True:
+                # time only the reader itself, not the consumer work done while this generator is suspended
+                seg = next(chunks, None)
+                info['read_seconds'] += time.perf_counter() - start
+                if seg is None:
+                    break
+                info['speech_seconds'] += len(seg[0]) / float(seg[1])
+                keys.append((utt_id, n))
+                segments.append(seg)
+                n += 1
+                if len(segments) >= batch_size:
+                    yield ('batch', keys, segments)
+                    keys, segments = [], []
+                start = time.perf_counter()
+        except Exception as e:
+            error = f'ERROR: {e}'
+        yield ('file', utt_id, n, error, info)
+    if segments:
+        yield ('batch', keys, segments)
+
+
+def run_batched_transcription(decode_batch, audio_paths, utterance_ids, batch_size=8, chunk_seconds=30,
+                              use_vad=False, vad_stats=None, cache_dir=None, on_result=None,
+                              desc='Transcribing Audio (batched)', prepare_batch=None,
+                              prefetch_batches=2, num_workers=1, count_tokens=None, backoff=None, on_batch=None):
+    """
+    Transcribe many files by packing up to batch_size chunks into each decode_batch call.
+
+    prepare_batch(segments), if given, runs the CPU side (feature extraction) ahead of time in
+    the PrefetchExecutor and its output is handed to decode_batch; otherwise decode_batch receives
+    the list of (array, sample_rate) tuples. Either way decode_batch returns one result per
+    segment: a text, or a dict {'text', 'flags', 'generated_tokens'} from decoders that report
+    per-chunk flags and exact token counts.
+    Segments from consecutive files share a batch; each text is keyed by
+    (utterance_id, segment_index) and re-joined per utterance in segment order.
+    on_result(utterance_id, text, telemetry=dict, chunks=list) is called as soon as an
+    utterance's last segment is decoded; chunks holds {'index', 'seconds', 'text', 'flags',
+    'generate_seconds'} per segment (plus 'error' for segments of a failed batch; the utterance
+    text is then the ERROR string). Without exact token counts from decode_batch, count_tokens(text), if given,
+    fills in the generated token count. With a MemoryBackoff, batches are decoded through
+    MemoryBackoff.decode_batch: memory errors and RSS pressure lower the batch size and then the
+    chunk length of the files read afterwards (recorded as telemetry chunk_seconds), with
+    hysteresis, and only a segment that still fails on its own is halved.
+    on_batch(segment_count, generate_seconds), if given, is called after every decoded batch.
+    Returns a dict utterance_id -> transcript (or FILE_NOT_FOUND / ERROR string).
+    """
+    results = {}
+    segment_results = {}  # (utterance_id, segment_index) -> chunk dict
+    open_utts = {}  # utterance_id -> segment count once the file is fully read
+    failed = {}  # utterance_id -> ERROR string for files with a failed read or batch
+    telemetry = {}  # utterance_id -> timings and counters accumulated across batches
+    throughput = ThroughputStats()
+
+    def utt_telemetry(utt_id):
+        if utt_id not in telemetry:
+            telemetry[utt_id] = _new_telemetry()
+        return telemetry[utt_id]
+
+    def finish(utt_id, text, succeeded=False, chunks=()):
+        results[utt_id] = text
+        t = telemetry.pop(utt_id, None) or _new_telemetry()
+        chunks = list(chunks)
+        if not succeeded:
+            tokens = None
+        elif chunks and all(c.get('generated_tokens') is not None for c in chunks):
+            tokens = sum(c.pop('generated_tokens') for c in chunks)
+        else:
+            tokens = count_tokens(text) if count_tokens is not None else None
+        for c in chunks:
+            c.pop('generated_tokens', None)
+        wall = t['read_seconds'] + t['feature_seconds'] + t['generate_seconds']
+        t.update({
+            'wall_seconds': wall,
+            'generated_tokens': tokens,
+            'tokens_per_second': tokens / t['generate_seconds'] if tokens is not None and t['generate_seconds'] else None,
+            'rtf': wall / t['audio_seconds'] if t['audio_seconds'] else None,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+        t = {k: round(v, 4) if isinstance(v, float) else v for k, v in t.items()}
+        throughput.add(t)
+        if on_result is not None:
+            on_result(utt_id, text, telemetry=t, chunks=chunks)
+
+    def finalize_ready():
+        for utt_id, n in list(open_utts.items()):
+            succeeded, chunks = False, []
+            if utt_id in failed:
+                text = failed.pop(utt_id)
+            elif all((utt_id, i) in segment_results for i in range(n)):
+                chunks = [segment_results[(utt_id, i)] for i in range(n)]
+                errors = [c['error'] for c in chunks if c.get('error')]
+                text = errors[0] if errors else " ".join(c['text'] for c in chunks if c['text'])
+                succeeded = not errors
+            else:
+                continue
+            for i in range(n):
+                segment_results.pop((utt_id, i), None)
+            del open_utts[utt_id]
+            finish(utt_id, text, succeeded, chunks)
+
+    def prepare(event):
+        # runs on a prefetch worker thread;
+        # batches become (kind, keys, inputs, durations, feature_seconds, segments)
+        if event[0] != 'batch':
+            return event
+        _, keys, segments = event
+        durations = segment_durations(segments)
+        if prepare_batch is None:
+            return ('batch', keys, segments, durations, 0.0, segments)
+        start = time.perf_counter()
+        try:
+            inputs = prepare_batch(segments)
+        except Exception as e:
+            return ('batch_error', keys, e, durations, 0.0, segments)
+        return ('batch', keys, inputs, durations, time.perf_counter() - start, segments)
+
+    def decode_segments(segments):
+        return decode_batch(prepare_batch(segments) if prepare_batch is not None else segments)
+
+    if backoff is not None:
+        backoff.start(batch_size, chunk_seconds)
+    events = iter_batch_events(audio_paths, utterance_ids, batch_size=batch_size, chunk_seconds=chunk_seconds,
+                               use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir, backoff=backoff)
+    executor = PrefetchExecutor(num_workers=num_workers, max_prefetch=prefetch_batches)
+    progress = tqdm(total=len(audio_paths), desc=desc)
+    take_peak_accelerator_mb()
+    for event in executor.map(prepare, events):
+        kind = event[0]
+        if kind == 'missing':
+            finish(event[1], event[2])
+            progress.update(1)
+        elif kind == 'file':
+            _, utt_id, n, error, info = event
+            open_utts[utt_id] = n
+            utt_telemetry(utt_id).update(info, segments=n)
+            if error:
+                failed.setdefault(utt_id, error)
+            progress.update(1)
+        else:
+            _, keys, inputs, durations, feature_seconds, segments = event
+            exc = inputs if kind == 'batch_error' else None
+            start = time.perf_counter()
+            if exc is None:
+                try:
+                    if backoff is not None:
+                        # lowers batch / chunk size for later work on memory pressure; splits only what still fails
+                        outputs = backoff.decode_batch(decode_segments, segments, lambda: decode_batch(inputs))
+                    else:
+                        outputs = decode_batch(inputs)
+                    for key, output, seconds in zip(keys, outputs, durations):
+                        segment_results[key] = chunk_result(key[1], output, seconds)
+                except Exception as e:
+                    exc = e
+            error = f'ERROR: {exc}' if exc is not None else None
+            if error is not None:
+                # keep the failure per chunk so asr_repair can re-decode just these segments
+                for key, seconds in zip(keys, durations):
+                    segment_results[key] = chunk_result(key[1], {'flags': ['error'], 'error': error}, seconds)
+            generate_seconds = time.perf_counter() - start
+            if on_batch is not None:
+                on_batch(len(keys), generate_seconds)
+            peak_accelerator = take_peak_accelerator_mb()
+            for key, share in zip(keys, _duration_shares(durations)):
+                # per-chunk time is the chunk's duration share of the batch unless the decoder timed it
+                if key in segment_results:
+                    segment_results[key].setdefault('generate_seconds', round(generate_seconds * share, 4))
+                t = utt_telemetry(key[0])
+                t['feature_seconds'] += feature_seconds * share
+                t['generate_seconds'] += generate_seconds * share
+                if peak_accelerator is not None:
+                    t['peak_accelerator_mb'] = max(t['peak_accelerator_mb'] or 0.0, peak_accelerator)
+        finalize_ready()
+    progress.close()
+    print(f'{desc}: {throughput.summary()}')
+    return results
@@ -1,192 +1,424 @@
-#!/usr/bin/env python
-# coding: utf-8
-
-# ## Load cleaned datasets
-
-# In[9]:
-
-
-import pandas as pd
-
-all_datasets_df = pd.read_csv('data/final_120_sampled_medical_datasets.csv')
-print('Loaded all datasets merged:', len(all_datasets_df))
-
-# # select first 2 for testing
-# all_datasets_df = all_datasets_df.head(2)
-
-
-# ## Phi-4 Model
-
-# In[10]:
-
-
-import os
-import requests
-import torch
-from PIL import Image
-import soundfile
-from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig
-
-# import datasets
-from datasets import load_dataset
-import torchcodec
+#!/usr/bin/env python3
+"""
+Phi-4 multimodal and Whisper large-v3 ASR inference on the medical dataset.
+
+Script version of model_inference.ipynb that runs one model per invocation. Only the
+selected backend's model classes are imported and loaded; torch and transformers come in
+through generation_utils, everything else (Phi-4's remote code, the Whisper pipeline) is
+imported inside the loader, and no model is loaded when there is nothing to decode.
+Finished utterances go to the backend's JSONL sidecar (results/sidecars/phi4.jsonl or
+whisper.jsonl), so a restarted job skips them, and the sidecars of both models are
+merged into the wide results CSV.
+
+Startup cost (imports, model load, first decoded batch, in seconds from process start)
+is printed and appended to results/sidecars/startup.jsonl for every job. With --worker,
+jobs go to a resident asr_worker.py that already holds the model, and nothing is loaded here.
+
+Usage:
+python model_inference.py --model phi4
+python model_inference.py --model whisper --limit 2
+python model_inference.py --model phi4 --shard-index $SLURM_ARRAY_TASK_ID --shard-count 4 --profile fast
+python model_inference.py --model whisper --worker http://127.0.0.1:8765
+"""
+
+import time
+
+_STARTED = time.perf_counter()
+
+import argparse
+import json
 import os
-from tqdm import tqdm
-
-
-# In[11]:
-
-
-# Load model and processor
-model_path = "kumapo/Phi-4-multimodal-instruct"
-processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
-model = AutoModelForCausalLM.from_pretrained(
-    model_path, 
-    device_map="cuda", 
-    torch_dtype="auto", 
-    trust_remote_code=True,
-    _attn_implementation='eager',
-).cuda()
-generation_config = GenerationConfig.from_pretrained(model_path)
-
-
-# In[12]:
+import socket
 
+import pandas as pd
 
+from audio_utils import segment_durations, VadStats, AUDIO_CACHE_DIR
+from asr_results import ResultsLog, SIDECAR_DIR, merge_results, throughput_table
+from inference_utils import (MemoryBackoff, StartupTimer, add_shard_arguments, chunk_seconds_for_budget,
+                             run_batched_transcription, shard_from_args, shard_part, shard_rows)
+from asr_repair import find_repairs, repair_flagged_chunks
+from asr_worker import WorkerClient, check_worker, run_worker_transcription
+from generation_utils import (PERFORMANCE_PROFILES, RepetitionGuard, apply_thread_settings, flatten_token_ids,
+                              generation_kwargs, model_load_kwargs, quantize_model, resolve_device, resolve_dtype,
+                              resolve_profile)
+
+PHI4_MODEL_ID = "kumapo/Phi-4-multimodal-instruct"
+WHISPER_MODEL_ID = "openai/whisper-large-v3"
+WHISPER_WINDOW_SECONDS = 30
+
+BACKENDS = {
+    'phi4': {'column': 'Phi-4-ASR', 'sidecar': 'phi4.jsonl', 'model_id': PHI4_MODEL_ID,
+             'batch_size': 8, 'max_new_tokens': 500, 'mb_per_audio_second': 60},
+    'whisper': {'column': 'Whisper-ASR', 'sidecar': 'whisper.jsonl', 'model_id': WHISPER_MODEL_ID,
+                'batch_size': 8, 'max_new_tokens': 256, 'mb_per_audio_second': 20},
+}
+OUTPUT_CSV = 'results/whisper_phi4_asr_results_all.csv'
+STARTUP_LOG = os.path.join(SIDECAR_DIR, 'startup.jsonl')
+
+
+# ---------------------------------------------------------------------
+# Phi-4 multimodal
+# ---------------------------------------------------------------------
 user_prompt = '<|user|>'
 assistant_prompt = '<|assistant|>'
 prompt_suffix = '<|end|>'
 speech_prompt = "Based on the attached audio, generate a comprehensive text transcription of the spoken content."
 
-def transcribe_file_chunked(audio_path, chunk_seconds=30, max_new_tokens=500):
-    if not os.path.exists(audio_path):
-        return f'FILE_NOT_FOUND: {audio_path}'
-    try:
-        data, sr = soundfile.read(audio_path)  # (numpy array, sample_rate)
-        # ensure mono (if stereo, average channels)
-        if data.ndim > 1:
-            data = data.mean(axis=1)
-        total_samples = data.shape[0]
-        chunk_samples = int(chunk_seconds * sr)
-        if chunk_samples <= 0:
-            return "ERROR: invalid chunk_seconds"
-        segments = []
-        for start in range(0, total_samples, chunk_samples):
-            seg = data[start : start + chunk_samples]
-            if seg.size == 0:
-                continue
-            segments.append((seg, sr))
-        device = 'cuda:0' if torch.cuda.is_available() else 'cpu'
-        texts = []
-        for i, seg in enumerate(segments):
-            prompt = f'{user_prompt}<|audio_1|>{speech_prompt}{prompt_suffix}{assistant_prompt}'
-            inputs = processor(text=prompt, audios=[seg], return_tensors='pt').to(device)
-            generate_ids = model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                generation_config=generation_config,
-                use_cache=False,
-                min_length=1,
-                top_p=1.0,
-                repetition_penalty=1.0,
-                length_penalty=1.0,
-                temperature=1.0,
-                do_sample=False,
-                num_beams=1,
-            )
-            # slice off prompt tokens
-            generate_ids = generate_ids[:, inputs['input_ids'].shape[1] : ]
-            resp = processor.batch_decode(
-                generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
-            )[0].strip()
-            texts.append(resp)
-            # cleanup to reduce peak memory
-            try:
-                del inputs, generate_ids
-            except Exception:
-                pass
-            if torch.cuda.is_available():
-                torch.cuda.empty_cache()
-        # join segment transcriptions (you can change separator)
-        return " ".join(t for t in texts if t)
-    except Exception as e:
-        return f'ERROR: {e}'
-
-audio_path = all_datasets_df['audio_file'].tolist()
-all_datasets_df['Phi-4-ASR'] = [transcribe_file_chunked(path, chunk_seconds=30, max_new_tokens=500) for path in tqdm(audio_path, desc='Transcribing Audio')]
-
-
-# ## Whisper ASR Model
-
-# In[7]:
-
-
-import torch
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
-from datasets import load_dataset
-
-
-# use a device id for pipeline (int) and a torch device string for .to()
-torch_device = "cuda:0" if torch.cuda.is_available() else "cpu"
-device_id = 0 if torch.cuda.is_available() else -1
-torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
-
-model_id = "openai/whisper-large-v3"
-
-model = AutoModelForSpeechSeq2Seq.from_pretrained(
-    model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
-)
-# move the model to the proper device
-model.to(torch_device)
-
-processor = AutoProcessor.from_pretrained(model_id)
-
-# create the pipeline; we keep model/tokenizer/feature_extractor explicit
-# note: pass device as int (0 for cuda, -1 for cpu) to the pipeline
-pipe = pipeline(
-    "automatic-speech-recognition",
-    model=model,
-    tokenizer=processor.tokenizer,
-    feature_extractor=processor.feature_extractor,
-    torch_dtype=torch_dtype,
-    device=device_id,
-    generate_kwargs={
-        'max_new_tokens': 256,
-        'num_beams': 1,
-        'do_sample': False,
-        'repetition_penalty': 1.0,
-        'language': 'english'
-    }
-)
-
-
-# In[8]:
-
-
-# Run Whisper ASR on all audio files in the dataframe for both doctor and patient
-def run_whisper_asr(audio_paths, desc):
-    responses = []
-    for audio_path in tqdm(audio_paths, desc=desc):
-        try:
-            result = pipe(
-                audio_path, 
-                return_timestamps=True, 
-                chunk_length_s=30,
-                generate_kwargs={'language': 'english'}
-            )
-            responses.append(result.get("text", ""))
-        except Exception as e:
-            responses.append(f'ERROR: {e}')
-    return responses
-
-# primock_datasets['Whisper-ASR-Doctor'] = run_whisper_asr(primock_datasets['doctor_audio_path'].tolist(), 'Whisper Doctor Transcribing')
-# primock_datasets['Whisper-ASR-Patient'] = run_whisper_asr(primock_datasets['patient_audio_path'].tolist(), 'Whisper Patient Transcribing')
-all_datasets_df['Whisper-ASR'] = run_whisper_asr(all_datasets_df['audio_file'].tolist(), 'Whisper Audio Transcribing')
-
-
-# In[ ]:
-
-
-# save results to csv
-all_datasets_df.to_csv('results/whisper_phi4_asr_results_all.csv', index=False)
 
+def phi4_profile(profile_name='default'):
+    # Phi-4's historical settings: eager attention, no KV cache, checkpoint dtype
+    return resolve_profile(profile_name, use_cache=False, torch_dtype='auto', attn_implementation='eager')
+
+
+def load_phi4(model_path=PHI4_MODEL_ID, profile_name='default'):
+    """Load the Phi-4 processor, model and generation config with the profile's settings."""
+    from transformers import AutoModelForCausalLM, AutoProcessor, GenerationConfig
+
+    profile = phi4_profile(profile_name)
+    apply_thread_settings(profile)
+    device = resolve_device(profile)  # 'cpu' / 'cpu_int8' profiles run on CPU-only nodes
+    processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        model_path,
+        device_map=device,
+        trust_remote_code=True,
+        **model_load_kwargs(profile),
+    )
+    model = quantize_model(model, profile)
+    generation_config = GenerationConfig.from_pretrained(model_path)
+    print(f"Loaded Phi-4 ({device}, profile '{profile_name}')")
+    return {'processor': processor, 'model': model, 'generation_config': generation_config,
+            'device': device, 'profile': profile}
+
+
+def prepare_segments_batched(phi4, segments):
+    """CPU side of a Phi-4 batch: tokenise the prompts and extract audio features (left padded)."""
+    processor = phi4['processor']
+    prompt = f'{user_prompt}<|audio_1|>{speech_prompt}{prompt_suffix}{assistant_prompt}'
+    # left padding keeps every prompt flush against its generated tokens
+    processor.tokenizer.padding_side = 'left'
+    return processor(text=[prompt] * len(segments), audios=list(segments), return_tensors='pt')
+
+
+def generate_from_inputs(phi4, inputs, max_new_tokens=500, durations=None):
+    """
+    Model side of a Phi-4 batch: move prepared inputs to the device, generate and decode.
+    Each row stops early on an n-gram loop or at a cap proportional to its audio duration;
+    returns one {'text', 'flags', 'generated_tokens'} dict per segment.
+    """
+    from transformers import StoppingCriteriaList
+
+    processor, generation_config = phi4['processor'], phi4['generation_config']
+    inputs = inputs.to(phi4['device'])
+    guard = RepetitionGuard(
+        inputs['input_ids'].shape[1], durations, max_new_tokens,
+        stop_token_ids=flatten_token_ids(generation_config.eos_token_id, processor.tokenizer.eos_token_id,
+                                         processor.tokenizer.pad_token_id),
+    )
+    generate_ids = phi4['model'].generate(
+        **inputs,
+        max_new_tokens=guard.max_new_tokens,
+        stopping_criteria=StoppingCriteriaList([guard]),
+        generation_config=generation_config,
+        **generation_kwargs(phi4['profile']),
+        min_length=1,
+        top_p=1.0,
+        repetition_penalty=1.0,
+        length_penalty=1.0,
+        temperature=1.0,
+        do_sample=False,
+        num_beams=1,
+    )
+    # slice off prompt tokens (shared padded prompt length), trim loops and collect the chunk flags
+    rows = guard.postprocess(generate_ids[:, inputs['input_ids'].shape[1] : ])
+    texts = processor.batch_decode(
+        [ids for ids, _ in rows], skip_special_tokens=True, clean_up_tokenization_spaces=False
+    )
+    return [{'text': t.strip(), 'flags': flags, 'generated_tokens': len(ids)} for t, (ids, flags) in zip(texts, rows)]
+
+
+def generate_segments_batched(phi4, segments, max_new_tokens=500):
+    """Transcribe a list of (array, sample_rate) segments with one padded generate call."""
+    return generate_from_inputs(phi4, prepare_segments_batched(phi4, segments), max_new_tokens=max_new_tokens,
+                                durations=segment_durations(segments))
+
+
+def transcribe_files_batched(phi4, audio_paths, utterance_ids, batch_size=8, chunk_seconds=30, max_new_tokens=500,
+                             use_vad=False, vad_stats=None, cache_dir=None, on_result=None,
+                             prefetch_batches=2, num_workers=1, backoff=None, on_batch=None):
+    """
+    Transcribe many files with Phi-4 by packing up to batch_size segments into each generate call.
+    Segments from consecutive files share a batch and are re-joined per utterance in order.
+    Audio reading and feature extraction for the next prefetch_batches batches run in
+    background threads while the current batch generates. With a MemoryBackoff, memory
+    errors lower the batch size and chunk length of later work and only a segment that
+    still does not fit on its own is halved.
+    Returns a dict utterance_id -> transcript (or FILE_NOT_FOUND / ERROR string).
+    """
+    tokenizer = phi4['processor'].tokenizer
+    return run_batched_transcription(
+        lambda prepared: generate_from_inputs(phi4, prepared[0], max_new_tokens=max_new_tokens, durations=prepared[1]),
+        audio_paths, utterance_ids, batch_size=batch_size, chunk_seconds=chunk_seconds,
+        use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir, on_result=on_result,
+        desc='Transcribing Audio (batched)',
+        prepare_batch=lambda segments: (prepare_segments_batched(phi4, segments), segment_durations(segments)),
+        prefetch_batches=prefetch_batches, num_workers=num_workers,
+        count_tokens=lambda text: len(tokenizer.encode(text, add_special_tokens=False)),
+        backoff=backoff, on_batch=on_batch,
+    )
+
+
+# ---------------------------------------------------------------------
+# Whisper large-v3 (transformers pipeline)
+# ---------------------------------------------------------------------
+def whisper_profile(profile_name='default'):
+    import torch
+    return resolve_profile(profile_name, torch_dtype='float16' if torch.cuda.is_available() else 'float32')
+
+
+def load_whisper(model_id=WHISPER_MODEL_ID, profile_name='default', max_new_tokens=256):
+    """Load Whisper into an ASR pipeline with the profile's dtype, device and generation settings."""
+    from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+
+    profile = whisper_profile(profile_name)
+    apply_thread_settings(profile)
+    # use a device id for pipeline (int) and a torch device string for .to()
+    on_cuda = resolve_device(profile) == 'cuda'
+    torch_device = "cuda:0" if on_cuda else "cpu"
+    device_id = 0 if on_cuda else -1
+
+    model = AutoModelForSpeechSeq2Seq.from_pretrained(
+        model_id, low_cpu_mem_usage=True, use_safetensors=True, **model_load_kwargs(profile)
+    )
+    # move the model to the proper device
+    model.to(torch_device)
+    model = quantize_model(model, profile)
+    processor = AutoProcessor.from_pretrained(model_id)
+
+    # create the pipeline; we keep model/tokenizer/feature_extractor explicit
+    # note: pass device as int (0 for cuda, -1 for cpu) to the pipeline
+    pipe = pipeline(
+        "automatic-speech-recognition",
+        model=model,
+        tokenizer=processor.tokenizer,
+        feature_extractor=processor.feature_extractor,
+        torch_dtype=resolve_dtype(profile['torch_dtype']),
+        device=device_id,
+        generate_kwargs={
+            'max_new_tokens': max_new_tokens,
+            'num_beams': 1,
+            'do_sample': False,
+            'repetition_penalty': 1.0,
+            'language': 'english',
+            **generation_kwargs(profile),
+        }
+    )
+    print(f"Loaded Whisper ({torch_device}, profile '{profile_name}')")
+    return {'pipe': pipe, 'processor': processor, 'profile': profile}
+
+
+def whisper_chunk_seconds(chunk_seconds, use_vad=False):
+    """
+    Chunk length the Whisper runners cut files into: None (whole files) unless VAD cuts them at
+    pauses. The pipeline then windows each file itself with overlapping strides and stitches
+    the seams, so no word is cut in half at a fixed chunk boundary.
+    """
+    return chunk_seconds if use_vad else None
+
+
+def transcribe_whisper_batch(whisper, segments, batch_size=8):
+    """
+    Run one pipeline call over a list of (array, sample_rate) segments of any length. Each is
+    cut into 30 s windows with the pipeline's default stride (overlap) and the window texts
+    are merged at the overlaps; windows of all segments are decoded batch_size at a time.
+    """
+    outputs = whisper['pipe'](
+        [{"raw": seg, "sampling_rate": sr} for seg, sr in segments],
+        batch_size=batch_size,
+        chunk_length_s=WHISPER_WINDOW_SECONDS,
+        return_timestamps=True,
+    )
+    return [out.get("text", "").strip() for out in outputs]
+
+
+def run_whisper_asr_batched(whisper, audio_paths, utterance_ids, batch_size=8, use_vad=False, vad_stats=None,
+                            cache_dir=None, on_result=None, prefetch_batches=2, chunk_seconds=30, backoff=None,
+                            on_batch=None):
+    """
+    Transcribe files with Whisper by streaming segments from all files through the pipeline
+    in batches of batch_size; segments from several files fill each batch and the texts are
+    re-assembled per utterance. With chunk_seconds=None (see whisper_chunk_seconds) every file
+    is one segment and the pipeline's strided 30 s windows do the chunking.
+    generate_kwargs come from the pipeline constructor.
+    Returns a dict utterance_id -> transcript (or FILE_NOT_FOUND / ERROR string).
+    """
+    tokenizer = whisper['processor'].tokenizer
+    return run_batched_transcription(
+        lambda segments: transcribe_whisper_batch(whisper, segments, batch_size=batch_size),
+        audio_paths, utterance_ids, batch_size=batch_size, chunk_seconds=chunk_seconds,
+        use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir, on_result=on_result,
+        desc='Whisper Audio Transcribing (batched)', prefetch_batches=prefetch_batches,
+        count_tokens=lambda text: len(tokenizer.encode(text, add_special_tokens=False)),
+        backoff=backoff, on_batch=on_batch,
+    )
+
+
+# ---------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------
+def write_startup_log(path, timer, **fields):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'host': socket.gethostname(), **fields, **timer.marks}) + '\n')
+
+
+def main():
+    timer = StartupTimer(_STARTED)
+    timer.mark('imports')
+    parser = argparse.ArgumentParser(description="Run Phi-4 or Whisper ASR over the manifest, one model per job.")
+    parser.add_argument("--model", type=str, choices=sorted(BACKENDS), required=True, help="ASR backend to run.")
+    parser.add_argument("--input", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV with audio paths.")
+    parser.add_argument("--output", type=str, default=None,
+                        help=f"Merged results CSV (default {OUTPUT_CSV}; sharded and --limit runs only write it when given).")
+    parser.add_argument("--limit", type=int, default=None, help="Only the first N manifest rows (e.g. 2 for a smoke test).")
+    add_shard_arguments(parser)
+    parser.add_argument("--profile", type=str, choices=sorted(PERFORMANCE_PROFILES),
+                        default=os.environ.get('ASR_PERFORMANCE_PROFILE', 'default'),
+                        help="Generation performance profile (default: $ASR_PERFORMANCE_PROFILE or 'default').")
+    parser.add_argument("--batch_size", type=int, default=None, help="Chunks per decode call (backend default if unset).")
+    parser.add_argument("--chunk_seconds", type=int, default=30,
+                        help="Maximum chunk length in seconds (Whisper only uses it with --vad; otherwise it decodes whole files in strided 30 s windows).")
+    parser.add_argument("--max_new_tokens", type=int, default=None, help="Max new tokens per chunk (backend default if unset).")
+    parser.add_argument("--vad", action="store_true", help="Enable VAD silence skipping (off by default).")
+    parser.add_argument("--cache_dir", type=str, default=AUDIO_CACHE_DIR, help="Decoded audio cache directory ('' to decode per run).")
+    parser.add_argument("--prefetch_batches", type=int, default=2, help="Batches preprocessed ahead of the model (0 = inline).")
+    parser.add_argument("--memory_budget_mb", type=float, default=None,
+                        help="Size chunks so one batch fits this memory budget (default: --chunk_seconds as given).")
+    parser.add_argument("--rss_limit_mb", type=float, default=None, help="On CPU, lower the batch size and then the chunk length of later work once RSS passes this.")
+    parser.add_argument("--min_chunk_seconds", type=float, default=4.0, help="Smallest chunk the OOM back-off halves down to.")
+    parser.add_argument("--no_repair", action="store_true",
+                        help="Skip re-decoding flagged chunks (loop, length cap, error, empty) after the run.")
+    parser.add_argument("--repair_split_seconds", type=float, default=15,
+                        help="Re-decode each flagged chunk as pieces of at most this many seconds.")
+    parser.add_argument("--startup_log", type=str, default=STARTUP_LOG, help="JSONL file the startup timings are appended to.")
+    parser.add_argument("--worker", type=str, default=None,
+                        help="URL of a running asr_worker.py serving this model; jobs are sent there instead of loading it.")
+    parser.add_argument("--worker_concurrency", type=int, default=4, help="Files in flight to the worker (lets it batch across them).")
+    args = parser.parse_args()
+    args.shard = shard_from_args(parser, args)
+
+    backend = BACKENDS[args.model]
+    batch_size = args.batch_size or backend['batch_size']
+    max_new_tokens = args.max_new_tokens or backend['max_new_tokens']
+    use_vad = args.vad
+    cache_dir = args.cache_dir or None
+    chunk_seconds = chunk_seconds_for_budget(args.memory_budget_mb, backend['mb_per_audio_second'],
+                                             batch_size, args.chunk_seconds, args.min_chunk_seconds)
+    if args.model == 'whisper':
+        chunk_seconds = whisper_chunk_seconds(chunk_seconds, use_vad)
+    backoff = MemoryBackoff(min_chunk_seconds=args.min_chunk_seconds, rss_limit_mb=args.rss_limit_mb)
+
+    manifest_df = pd.read_csv(args.input)
+    print('Loaded all datasets merged:', len(manifest_df))
+    df = manifest_df.head(args.limit) if args.limit is not None else manifest_df
+    if args.shard is not None:
+        df = shard_rows(df, *args.shard)
+        print(f'Shard {args.shard[0]}/{args.shard[1]}: {len(df)} utterances')
+
+    client = None
+    model_id = backend['model_id']
+    if args.worker:
+        # the worker's own settings decide the decode params, so its results resume local runs and vice versa
+        client = WorkerClient(args.worker)
+        info = check_worker(client, args.model)
+        model_id, decode_params = info['model_id'], info['decode_params']
+        chunk_seconds, use_vad, batch_size = info['chunk_seconds'], info['use_vad'], info['batch_size']
+    # the resolved profile is part of the decode params, so every sidecar record says which settings produced it
+    elif args.model == 'phi4':
+        decode_params = {'chunk_seconds': chunk_seconds, 'max_new_tokens': max_new_tokens, 'use_vad': use_vad,
+                         'profile': phi4_profile(args.profile)}
+    else:
+        decode_params = {'chunk_seconds': chunk_seconds, 'max_new_tokens': max_new_tokens, 'language': 'english',
+                         'use_vad': use_vad, 'profile': whisper_profile(args.profile)}
+    # finished utterances are appended to the sidecar as they complete; a restart skips them
+    # shard workers write partial sidecars, never the same file (folded by asr_results.py --fold_parts)
+    results_log = ResultsLog(os.path.join(SIDECAR_DIR, backend['sidecar']), model_id, backend['column'], decode_params,
+                             part=shard_part(args.shard))
+    done = results_log.finished_ids()
+    todo = df[~df['utterance_id'].isin(done)]
+    print(f'{args.model}: {len(done)} utterances already finished, {len(todo)} to transcribe')
+
+    loaded = {}
+
+    def load_backend():
+        # imported and loaded on first use only: a job with nothing to decode never touches the model
+        if not loaded:
+            if args.model == 'phi4':
+                loaded['model'] = load_phi4(profile_name=args.profile)
+            else:
+                loaded['model'] = load_whisper(profile_name=args.profile, max_new_tokens=max_new_tokens)
+            timer.mark('model_load')
+        return loaded['model']
+
+    vad_stats = VadStats()
+    if len(todo) and client is not None:
+        def on_result(utt_id, text, **extra):
+            timer.mark('first_decode')
+            results_log.append(utt_id, text, **extra)
+        run_worker_transcription(client, todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                                 on_result=on_result, concurrency=args.worker_concurrency)
+    elif len(todo):
+        run_kwargs = dict(batch_size=batch_size, chunk_seconds=chunk_seconds, use_vad=use_vad, vad_stats=vad_stats,
+                          cache_dir=cache_dir, on_result=results_log.append, prefetch_batches=args.prefetch_batches,
+                          backoff=backoff, on_batch=lambda n, seconds: timer.mark('first_decode'))
+        if args.model == 'phi4':
+            transcribe_files_batched(load_backend(), todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                                     max_new_tokens=max_new_tokens, **run_kwargs)
+        else:
+            run_whisper_asr_batched(load_backend(), todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                                    **run_kwargs)
+        if use_vad:
+            print(args.model, vad_stats.summary())
+    if len(todo):
+        print(f'Startup: {timer.summary()}')
+        write_startup_log(args.startup_log, timer, model=args.model, profile=args.profile,
+                          shard='/'.join(map(str, args.shard)) if args.shard else None, utterances=len(todo),
+                          worker=args.worker)
+
+    # re-decode only chunks flagged as loops / length cap / errors / empty, in shorter pieces
+    audio_paths = dict(zip(df['utterance_id'], df['audio_file']))
+    # whole Whisper files are re-decoded whole: the pipeline's own strided windows do the splitting
+    repair_params = {'split_seconds': args.repair_split_seconds if chunk_seconds is not None else None}
+    if not args.no_repair and any(utt_id in audio_paths for utt_id in find_repairs(results_log,
+                                                                                   repair_params=repair_params)):
+        if client is not None:
+            decode = client.decode_segments
+        elif args.model == 'phi4':
+            phi4 = load_backend()
+            decode = lambda segments: generate_segments_batched(phi4, segments, max_new_tokens=max_new_tokens)
+        else:
+            whisper = load_backend()
+            decode = lambda segments: transcribe_whisper_batch(whisper, segments, batch_size=batch_size)
+        repair_flagged_chunks(results_log, audio_paths, decode, chunk_seconds=chunk_seconds, use_vad=use_vad,
+                              cache_dir=cache_dir, split_seconds=repair_params['split_seconds'], batch_size=batch_size,
+                              repair_params=repair_params)
+
+    if args.shard is not None and args.output is None:
+        print('Sharded run: once every shard has finished, merge with asr_results.py --fold_parts')
+    elif args.limit is not None and args.output is None:
+        # a partial run must not overwrite the full results CSV
+        print('--limit run: results are in the sidecar; pass --output to merge them into a CSV')
+    else:
+        # this model's run plus whatever the other model's sidecar already holds
+        sidecars = [results_log] + [
+            path for path in (os.path.join(SIDECAR_DIR, b['sidecar']) for name, b in BACKENDS.items()
+                              if name != args.model)
+            if os.path.exists(path)
+        ]
+        merge_results(manifest_df, sidecars, args.output or OUTPUT_CSV)
+    # per-model cost: real-time factor, tokens/s and compute seconds per hour of audio
+    print(throughput_table([results_log]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+NVIDIA Parakeet and IBM Granite ASR inference on the medical dataset.
+
+Importable version of the runners from model_inference_NvidiaParakeet_IBMGranite.ipynb.
+Chunks are passed to the models as in-memory 16 kHz mono arrays (no temporary WAV
+files) and chunks from one or many consecutive files are decoded together in
+batches via inference_utils.run_batched_transcription, with audio reading and
+feature extraction prefetched in background threads.
+
+Usage:
+python parakeet_granite_inference.py --model parakeet --batch_size 16
+python parakeet_granite_inference.py --model granite --batch_size 4 --profile fast
+python parakeet_granite_inference.py --model granite --repair --repair_split_seconds 10
+python parakeet_granite_inference.py --model parakeet --worker http://127.0.0.1:8765
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+
+from audio_utils import AUDIO_CACHE_DIR, VadStats, segment_durations
+from asr_results import ResultsLog, SIDECAR_DIR, merge_results, throughput_table
+from inference_utils import (MemoryBackoff, add_shard_arguments, chunk_seconds_for_budget, run_batched_transcription,
+                             shard_from_args, shard_part, shard_rows)
+from asr_repair import find_repairs, repair_flagged_chunks
+from asr_worker import WorkerClient, check_worker, run_worker_transcription
+from generation_utils import (PERFORMANCE_PROFILES, RepetitionGuard, apply_thread_settings, flatten_token_ids,
+                              generation_kwargs, model_load_kwargs, quantize_model, resolve_device, resolve_profile)
+
+PARAKEET_MODEL_ID = "nvidia/parakeet-tdt-0.6b-v2"
+GRANITE_MODEL_ID = "ibm-granite/granite-speech-3.3-8b"
+
+GRANITE_SYSTEM_PROMPT = (
+    "Knowledge Cutoff Date: April 2024.\n"
+    "Today's Date: April 9, 2025.\n"
+    "You are Granite, developed by IBM. Transcribe speech verbatim."
+)
+GRANITE_USER_PROMPT = "<|audio|> Please transcribe the speech into written format."
+
+BACKENDS = {
+    'parakeet': {'column': 'Nvidia-Parakeet-ASR', 'sidecar': 'parakeet.jsonl',
+                 'output': 'results/nvidia_parakeet_asr_results.csv', 'batch_size': 16, 'mb_per_audio_second': 10},
+    'granite': {'column': 'IBM-Granite-ASR', 'sidecar': 'granite.jsonl',
+                'output': 'results/ibm_granite_asr_results.csv', 'batch_size': 4, 'mb_per_audio_second': 80},
+}
+
+
+# ---------------------------------------------------------------------
+# NVIDIA Parakeet
+# ---------------------------------------------------------------------
+def load_parakeet(model_name=PARAKEET_MODEL_ID, profile_name='default'):
+    """Load the NeMo Parakeet model. Only the thread count of the profile applies to NeMo."""
+    import nemo.collections.asr as nemo_asr
+    apply_thread_settings(resolve_profile(profile_name))
+    nvidia_model = nemo_asr.models.ASRModel.from_pretrained(model_name)
+    print("Loaded NVIDIA Parakeet")
+    return nvidia_model
+
+
+def transcribe_parakeet_batch(nvidia_model, segments, batch_size=16):
+    """Transcribe a list of (array, sample_rate) 16 kHz segments in one in-memory transcribe call."""
+    audio = [np.asarray(seg, dtype=np.float32) for seg, _ in segments]
+    hypotheses = nvidia_model.transcribe(audio, batch_size=batch_size, verbose=False)
+    return [(h.text if hasattr(h, 'text') else str(h)).strip() for h in hypotheses]
+
+
+def run_parakeet_asr(nvidia_model, audio_paths, utterance_ids, batch_size=16, chunk_size_seconds=30,
+                     use_vad=False, vad_stats=None, cache_dir=None, on_result=None, prefetch_batches=2, backoff=None):
+    """
+    Transcribe files with Parakeet, batching chunks across files. Audio for the next
+    prefetch_batches batches is read in the background; with a MemoryBackoff an OOM lowers
+    the batch size of later batches and only a segment that still does not fit is halved.
+    Returns utterance_id -> text.
+    """
+    return run_batched_transcription(
+        lambda segments: transcribe_parakeet_batch(nvidia_model, segments, batch_size=batch_size),
+        audio_paths, utterance_ids, batch_size=batch_size, chunk_seconds=chunk_size_seconds,
+        use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir, on_result=on_result,
+        desc='Parakeet ASR', prefetch_batches=prefetch_batches,
+        count_tokens=lambda text: len(nvidia_model.tokenizer.text_to_ids(text)),
+        backoff=backoff,
+    )
+
+
+# ---------------------------------------------------------------------
+# IBM Granite
+# ---------------------------------------------------------------------
+def load_granite(model_name=GRANITE_MODEL_ID, profile_name='default'):
+    """
+    Load the Granite speech model with the named performance profile; returns a dict with
+    processor, tokenizer, model, chat_text, device and the resolved profile.
+    """
+    from transformers import AutoProcessor, AutoModelForSpeechSeq2Seq
+
+    profile = resolve_profile(profile_name)
+    apply_thread_settings(profile)
+    device = resolve_device(profile)
+    print(device)
+    print("Loading IBM Granite 8B...")
+    processor = AutoProcessor.from_pretrained(model_name)
+    tokenizer = processor.tokenizer
+    # left padding keeps every prompt flush against its generated tokens in a batch
+    tokenizer.padding_side = 'left'
+    model = AutoModelForSpeechSeq2Seq.from_pretrained(model_name, trust_remote_code=True,
+                                                      **model_load_kwargs(profile)).to(device)
+    model = quantize_model(model, profile)
+
+    chat = [
+        {"role": "system", "content": GRANITE_SYSTEM_PROMPT},
+        {"role": "user", "content": GRANITE_USER_PROMPT}
+    ]
+    chat_text = tokenizer.apply_chat_template(chat, tokenize=False, add_generation_prompt=True)
+    return {'processor': processor, 'tokenizer': tokenizer, 'model': model,
+            'chat_text': chat_text, 'device': device, 'profile': profile}
+
+
+def prepare_granite_batch(granite, segments):
+    """CPU side of a Granite batch: build the padded prompts and audio features."""
+    audio = [torch.from_numpy(np.array(seg, dtype=np.float32)) for seg, _ in segments]
+    return granite['processor'](
+        [granite['chat_text']] * len(audio),
+        audio,
+        device="cpu",
+        return_tensors="pt",
+    )
+
+
+def generate_granite_batch(granite, model_inputs, max_new_tokens=500, durations=None):
+    """
+    Model side of a Granite batch: move prepared inputs to the device, generate and decode new tokens.
+    Rows stop early on n-gram loops or at a duration-proportional cap; returns one
+    {'text', 'flags', 'generated_tokens'} dict per segment.
+    """
+    from transformers import StoppingCriteriaList
+
+    tokenizer, device = granite['tokenizer'], granite['device']
+    model_inputs = model_inputs.to(device)
+    num_input_tokens = model_inputs["input_ids"].shape[-1]
+    guard = RepetitionGuard(num_input_tokens, durations, max_new_tokens,
+                            stop_token_ids=flatten_token_ids(tokenizer.eos_token_id, tokenizer.pad_token_id))
+    model_outputs = granite['model'].generate(
+        **model_inputs,
+        max_new_tokens=guard.max_new_tokens,
+        stopping_criteria=StoppingCriteriaList([guard]),
+        num_beams=1,
+        do_sample=False,
+        min_length=1,
+        top_p=1.0,
+        repetition_penalty=1.0,
+        length_penalty=1.0,
+        temperature=1.0,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+        **generation_kwargs(granite['profile']),
+    )
+
+    # Decode only new tokens, with trailing loops trimmed
+    rows = guard.postprocess(model_outputs[:, num_input_tokens:])
+    texts = tokenizer.batch_decode([ids for ids, _ in rows], skip_special_tokens=True)
+    return [{'text': t.strip(), 'flags': flags, 'generated_tokens': len(ids)} for t, (ids, flags) in zip(texts, rows)]
+
+
+def transcribe_granite_batch(granite, segments, max_new_tokens=500):
+    """Transcribe a list of (array, sample_rate) 16 kHz segments with one padded generate call."""
+    return generate_granite_batch(granite, prepare_granite_batch(granite, segments), max_new_tokens=max_new_tokens,
+                                  durations=segment_durations(segments))
+
+
+def run_granite_asr(granite, audio_paths, utterance_ids, batch_size=4, chunk_size_seconds=30, max_new_tokens=500,
+                    use_vad=False, vad_stats=None, cache_dir=None, on_result=None, prefetch_batches=2, num_workers=1,
+                    backoff=None):
+    """
+    Transcribe files with Granite, batching chunks across files. Audio reading and feature
+    extraction for the next prefetch_batches batches run in the background; with a MemoryBackoff
+    an OOM lowers the batch size of later batches and only a segment that still does not fit is halved.
+    Returns utterance_id -> text.
+    """
+    return run_batched_transcription(
+        lambda prepared: generate_granite_batch(granite, prepared[0], max_new_tokens=max_new_tokens,
+                                                durations=prepared[1]),
+        audio_paths, utterance_ids, batch_size=batch_size, chunk_seconds=chunk_size_seconds,
+        use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir, on_result=on_result,
+        desc='Granite ASR',
+        prepare_batch=lambda segments: (prepare_granite_batch(granite, segments), segment_durations(segments)),
+        prefetch_batches=prefetch_batches, num_workers=num_workers,
+        count_tokens=lambda text: len(granite['tokenizer'].encode(text, add_special_tokens=False)),
+        backoff=backoff,
+    )
+
+
+# ---------------------------------------------------------------------
+# CLI Entry Point
+# ---------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Run batched NVIDIA Parakeet or IBM Granite ASR over the manifest.")
+    parser.add_argument("--model", type=str, choices=sorted(BACKENDS), required=True, help="ASR backend to run.")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV with audio paths.")
+    parser.add_argument("--output", type=str, default=None, help="Output CSV (defaults to the backend's results file).")
+    parser.add_argument("--batch_size", type=int, default=None, help="Chunks per decode call (backend default if unset).")
+    parser.add_argument("--chunk_seconds", type=int, default=30, help="Maximum chunk length in seconds.")
+    parser.add_argument("--max_new_tokens", type=int, default=500, help="Max new tokens per chunk (Granite).")
+    parser.add_argument("--vad", action="store_true", help="Enable VAD silence skipping (off by default).")
+    parser.add_argument("--cache_dir", type=str, default=AUDIO_CACHE_DIR, help="Decoded audio cache directory ('' to decode per run).")
+    parser.add_argument("--prefetch_batches", type=int, default=2, help="Batches preprocessed ahead of the model (0 = inline).")
+    parser.add_argument("--memory_budget_mb", type=float, default=None,
+                        help="Size chunks so one batch fits this memory budget (default: --chunk_seconds as given).")
+    parser.add_argument("--mb_per_audio_second", type=float, default=None,
+                        help="Activation memory per second of chunk audio (backend default if unset).")
+    parser.add_argument("--rss_limit_mb", type=float, default=None, help="On CPU, lower the batch size and then the chunk length of later work once RSS passes this.")
+    parser.add_argument("--min_chunk_seconds", type=float, default=4.0, help="Smallest chunk the OOM back-off halves down to.")
+    parser.add_argument("--repair", action="store_true",
+                        help="Only re-decode flagged chunks (loop, length cap, error, empty) of finished utterances.")
+    parser.add_argument("--repair_split_seconds", type=float, default=None,
+                        help="Re-decode each flagged chunk as pieces of at most this many seconds.")
+    parser.add_argument("--repair_max_new_tokens", type=int, default=None, help="max_new_tokens for Granite repairs.")
+    parser.add_argument("--repair_profile", type=str, choices=sorted(PERFORMANCE_PROFILES), default=None,
+                        help="Performance profile for repairs (--profile still selects the run being repaired).")
+    parser.add_argument("--profile", type=str, choices=sorted(PERFORMANCE_PROFILES), default="default",
+                        help="Generation performance profile (KV cache, dtype, attention backend, threads).")
+    add_shard_arguments(parser)
+    parser.add_argument("--worker", type=str, default=None,
+                        help="URL of a running asr_worker.py serving this model; jobs are sent there instead of loading it.")
+    parser.add_argument("--worker_concurrency", type=int, default=4, help="Files in flight to the worker (lets it batch across them).")
+    args = parser.parse_args()
+    args.shard = shard_from_args(parser, args)
+
+    backend = BACKENDS[args.model]
+    batch_size = args.batch_size or backend['batch_size']
+    use_vad = args.vad
+    cache_dir = args.cache_dir or None
+    chunk_seconds = chunk_seconds_for_budget(args.memory_budget_mb,
+                                             args.mb_per_audio_second or backend['mb_per_audio_second'],
+                                             batch_size, args.chunk_seconds, args.min_chunk_seconds)
+    backoff = MemoryBackoff(min_chunk_seconds=args.min_chunk_seconds, rss_limit_mb=args.rss_limit_mb)
+
+    manifest_df = pd.read_csv(args.manifest)
+    print('Loaded all datasets merged:', len(manifest_df))
+    df = manifest_df
+    if args.shard is not None:
+        df = shard_rows(df, *args.shard)
+        print(f'Shard {args.shard[0]}/{args.shard[1]}: {len(df)} utterances')
+
+    client = None
+    if args.worker:
+        # the worker's own settings decide the decode params, so its results resume local runs and vice versa
+        client = WorkerClient(args.worker)
+        info = check_worker(client, args.model)
+        chunk_seconds, use_vad, batch_size = info['chunk_seconds'], info['use_vad'], info['batch_size']
+        results_log = ResultsLog(os.path.join(SIDECAR_DIR, backend['sidecar']), info['model_id'],
+                                 backend['column'], info['decode_params'], part=shard_part(args.shard))
+    # the resolved profile is part of the decode params, so each sidecar record says which settings produced it
+    elif args.model == 'parakeet':
+        decode_params = {"chunk_size_seconds": chunk_seconds, "use_vad": use_vad,
+                         "profile": resolve_profile(args.profile)}
+        results_log = ResultsLog(os.path.join(SIDECAR_DIR, backend['sidecar']), PARAKEET_MODEL_ID,
+                                 backend['column'], decode_params, part=shard_part(args.shard))
+    else:
+        decode_params = {"chunk_size_seconds": chunk_seconds, "max_new_tokens": args.max_new_tokens,
+                         "use_vad": use_vad, "profile": resolve_profile(args.profile)}
+        results_log = ResultsLog(os.path.join(SIDECAR_DIR, backend['sidecar']), GRANITE_MODEL_ID,
+                                 backend['column'], decode_params, part=shard_part(args.shard))
+
+    if args.repair:
+        repair_profile = args.repair_profile or args.profile
+        repair_params = {'profile': repair_profile, 'split_seconds': args.repair_split_seconds,
+                         'max_new_tokens': args.repair_max_new_tokens}
+        audio_paths = dict(zip(df['utterance_id'], df['audio_file']))
+        # the model is only loaded when some flagged chunk has not been tried with these params yet
+        if not any(utt_id in audio_paths for utt_id in find_repairs(results_log, repair_params=repair_params)):
+            print(f"{args.model}: no flagged chunks left to repair")
+        else:
+            if client is not None:
+                decode = client.decode_segments
+            elif args.model == 'parakeet':
+                nvidia_model = load_parakeet(profile_name=repair_profile)
+                decode = lambda segments: transcribe_parakeet_batch(nvidia_model, segments, batch_size=batch_size)
+            else:
+                granite = load_granite(profile_name=repair_profile)
+                max_new_tokens = args.repair_max_new_tokens or args.max_new_tokens
+                decode = lambda segments: transcribe_granite_batch(granite, segments, max_new_tokens=max_new_tokens)
+            repair_flagged_chunks(results_log, audio_paths, decode, chunk_seconds=chunk_seconds, use_vad=use_vad,
+                                  cache_dir=cache_dir, split_seconds=args.repair_split_seconds,
+                                  batch_size=batch_size, repair_params=repair_params)
+        if args.shard is None or args.output:
+            merge_results(manifest_df, [results_log], args.output or backend['output'])
+        return
+
+    done = results_log.finished_ids()
+    todo = df[~df['utterance_id'].isin(done)]
+    print(f"{args.model}: {len(done)} utterances already finished, {len(todo)} to transcribe")
+
+    vad_stats = VadStats()
+    if len(todo) and client is not None:
+        run_worker_transcription(client, todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                                 on_result=results_log.append, concurrency=args.worker_concurrency)
+    elif len(todo):
+        if args.model == 'parakeet':
+            nvidia_model = load_parakeet(profile_name=args.profile)
+            run_parakeet_asr(nvidia_model, todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                             batch_size=batch_size, chunk_size_seconds=chunk_seconds,
+                             use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir,
+                             on_result=results_log.append, prefetch_batches=args.prefetch_batches, backoff=backoff)
+        else:
+            granite = load_granite(profile_name=args.profile)
+            run_granite_asr(granite, todo['audio_file'].tolist(), todo['utterance_id'].tolist(),
+                            batch_size=batch_size, chunk_size_seconds=chunk_seconds,
+                            max_new_tokens=args.max_new_tokens,
+                            use_vad=use_vad, vad_stats=vad_stats, cache_dir=cache_dir,
+                            on_result=results_log.append, prefetch_batches=args.prefetch_batches, backoff=backoff)
+        if use_vad:
+            print(args.model, vad_stats.summary())
+
+    if args.shard is not None and args.output is None:
+        print('Sharded run: once every shard has finished, merge with asr_results.py --fold_parts')
+    else:
+        merge_results(manifest_df, [results_log], args.output or backend['output'])
+    print(throughput_table([results_log]).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
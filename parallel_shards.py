@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Single-machine data parallelism for the ASR runners.
+
+Launches K copies of a runner (model_inference.py, parakeet_granite_inference.py,
+faster_whisper_inference.py) with --shard i/K. Each worker process loads its own model
+copy, is pinned to its own slice of the CPU cores (sched_setaffinity) with the BLAS/OpenMP
+thread pools sized to that slice, and writes its finished utterances to its own partial
+sidecar (<name>.part-<i>ofK.jsonl). Once every worker has exited, the partial sidecars are
+folded into the main sidecars in manifest row order and, with --output, merged into the
+wide results CSV, so the result does not depend on which worker finished first.
+
+Worker logs go to results/shard_logs/. Only the runner's own parts of this K-shard launch are
+folded; partial sidecars of a crashed run with the same K are picked up by the next run (they
+are read on resume) and folded at its end, anything else is left to asr_results.py --fold_parts.
+
+Usage:
+python parallel_shards.py --workers 8 -- faster_whisper_inference.py --compute_type int8 --cpu_threads 0
+python parallel_shards.py --workers 4 --threads_per_worker 8 --output results/nvidia_parakeet_asr_results.csv \
+    -- parakeet_granite_inference.py --model parakeet --profile cpu
+"""
+
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from asr_results import (SIDECAR_DIR, fold_sidecar_parts, merge_results, print_validation, read_sidecar,
+                         sidecar_part_paths, throughput_table, validate_results)
+
+# thread pools that would otherwise each size themselves to the whole machine
+THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def core_slices(workers, threads_per_worker=None):
+    """One list of core ids per worker: consecutive, non-overlapping slices while cores last."""
+    cores = available_cores()
+    threads = threads_per_worker or max(1, len(cores) // workers)
+    if workers * threads > len(cores):
+        print(f'WARNING: {workers} workers x {threads} threads > {len(cores)} cores; slices will overlap')
+    return [[cores[(i * threads + j) % len(cores)] for j in range(threads)] for i in range(workers)]
+
+
+def launch_shard(runner_cmd, index, count, cores, log_dir):
+    """Start one shard worker pinned to `cores`; returns (process, log file)."""
+    env = dict(os.environ, TOKENIZERS_PARALLELISM='false')
+    env.update({name: str(len(cores)) for name in THREAD_ENV_VARS})
+    cmd = [sys.executable, *runner_cmd, '--shard', f'{index}/{count}']
+    log = open(os.path.join(log_dir, f'shard-{index}of{count}.log'), 'w', encoding='utf-8')
+    pin = (lambda: os.sched_setaffinity(0, cores)) if hasattr(os, 'sched_setaffinity') else None
+    return subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT, preexec_fn=pin), log
+
+
+def sidecars_with_parts(sidecar_dir, count, since):
+    """
+    Main sidecar paths this launch wrote partial sidecars for: parts of a count-shard run
+    (<name>.part-<i>of<count>.jsonl) modified at or after `since`. Parts of other runs or
+    shard counts are left alone.
+    """
+    parts = glob.glob(os.path.join(sidecar_dir, f'*.part-*of{count}.jsonl'))
+    return sorted({part.rsplit('.part-', 1)[0] + '.jsonl' for part in parts if os.path.getmtime(part) >= since})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run K pinned shard workers of an ASR runner and merge their results in row order.")
+    parser.add_argument("--workers", type=int, required=True, help="Number of worker processes (shards).")
+    parser.add_argument("--threads_per_worker", type=int, default=None, help="Cores per worker (default: available cores / workers).")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV defining row order (same as the runner's).")
+    parser.add_argument("--output", type=str, default=None, help="Merged results CSV (default: only fold the partial sidecars).")
+    parser.add_argument("--sidecar_dir", type=str, default=SIDECAR_DIR, help="Directory of the runners' sidecars.")
+    parser.add_argument("--log_dir", type=str, default="results/shard_logs", help="Directory for per-worker logs.")
+    parser.add_argument("runner", nargs=argparse.REMAINDER, help="-- runner script and its arguments (without --shard).")
+    args = parser.parse_args()
+
+    runner_cmd = args.runner[1:] if args.runner[:1] == ['--'] else args.runner
+    if not runner_cmd:
+        parser.error('give the runner after --, e.g. -- faster_whisper_inference.py --compute_type int8')
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    slices = core_slices(args.workers, args.threads_per_worker)
+    launched_at = time.time()
+    start = time.perf_counter()
+    shards = []
+    for index, cores in enumerate(slices):
+        process, log = launch_shard(runner_cmd, index, args.workers, cores, args.log_dir)
+        print(f'shard {index}/{args.workers}: pid {process.pid}, cores {cores[0]}-{cores[-1]}, log {log.name}')
+        shards.append((index, process, log))
+    failed = []
+    for index, process, log in shards:
+        if process.wait() != 0:
+            failed.append(index)
+        log.close()
+        print(f'shard {index}/{args.workers} exited with {process.returncode} after {time.perf_counter() - start:.1f} s')
+    wall = time.perf_counter() - start
+
+    # fold in manifest row order; a failed shard's finished utterances are kept too
+    manifest_df = pd.read_csv(args.manifest)
+    manifest_ids = manifest_df['utterance_id'].tolist()
+    sidecars = sidecars_with_parts(args.sidecar_dir, args.workers, launched_at)
+    audio_seconds = 0.0
+    for path in sidecars:
+        for part in sidecar_part_paths(path, args.workers):
+            audio_seconds += sum((r.get('telemetry') or {}).get('audio_seconds') or 0.0 for r in read_sidecar(part))
+        print(f'{path}: folded {fold_sidecar_parts(path, manifest_ids, args.workers)} records from partial sidecars')
+    print(f'{args.workers} workers: {audio_seconds / 3600.0:.2f} h audio in {wall:.1f} s wall '
+          f'(RTF {wall / audio_seconds if audio_seconds else float("nan"):.4f})')
+
+    if sidecars:
+        print_validation(validate_results(manifest_df, sidecars))
+    if sidecars and args.output:
+        merge_results(manifest_df, sidecars, args.output)
+    if sidecars:
+        print(throughput_table(sidecars).to_string(index=False, float_format=lambda v: f'{v:.3f}'))
+    if failed:
+        print(f'WARNING: shards {failed} failed; see {args.log_dir}. Re-running resumes them.')
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
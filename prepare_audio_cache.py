@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Decode every audio file of the manifest once into the shared audio cache.
+
+Each file is decoded, down-mixed and resampled to 16 kHz mono float32 and stored
+as a content-hashed .npy under data/audio_cache/. The ASR runners then read
+zero-copy memory-mapped slices from the cache (cache_dir=AUDIO_CACHE_DIR), so
+running several models over the same files pays for decoding only once.
+
+Usage:
+python prepare_audio_cache.py --manifest data/final_120_sampled_medical_datasets.csv --workers 4
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from tqdm import tqdm
+
+from audio_utils import AUDIO_CACHE_DIR, TARGET_SAMPLE_RATE, decode_to_cache
+
+
+def cache_one(audio_path, cache_dir, target_sr):
+    """Decode one file into the cache; returns (audio_path, npy_path or ERROR string)."""
+    if not os.path.exists(audio_path):
+        return audio_path, f'FILE_NOT_FOUND: {audio_path}'
+    try:
+        return audio_path, decode_to_cache(audio_path, cache_dir, target_sr)
+    except Exception as e:
+        return audio_path, f'ERROR: {e}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode manifest audio once into the shared 16 kHz mono .npy cache.")
+    parser.add_argument("--manifest", type=str, default="data/final_120_sampled_medical_datasets.csv", help="Manifest CSV with audio paths.")
+    parser.add_argument("--audio_column", type=str, default="audio_file", help="Column name for audio paths.")
+    parser.add_argument("--cache_dir", type=str, default=AUDIO_CACHE_DIR, help="Directory for decoded .npy files.")
+    parser.add_argument("--target_sr", type=int, default=TARGET_SAMPLE_RATE, help="Target sample rate.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of decoding processes.")
+    args = parser.parse_args()
+
+    audio_paths = pd.read_csv(args.manifest)[args.audio_column].drop_duplicates().tolist()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(cache_one, p, args.cache_dir, args.target_sr) for p in audio_paths]
+        results = [f.result() for f in tqdm(futures, desc='Decoding to cache')]
+
+    failed = [(p, r) for p, r in results if r.startswith('ERROR') or r.startswith('FILE_NOT_FOUND')]
+    print(f"Cached {len(results) - len(failed)} of {len(results)} files in {args.cache_dir}")
+    for p, r in failed:
+        print(f"  {r}")
+
+
+if __name__ == "__main__":
+    main()